@@ -0,0 +1,356 @@
+#!/usr/bin/python3 -u
+
+# Sherwood backtesting
+# Replays the trader's buy/sell/stop-loss rules over a saved price history.
+
+import argparse
+from math import floor, inf
+import time
+import numpy as np
+import pandas as pd
+from config import config
+from indicators import batch_rsi, batch_sma
+
+
+def load_prices(filename, ticker=None):
+    """
+    Load a price history from a CSV or Parquet file. Two layouts are understood: the bot's own (a 'timestamp'
+    column and one price column per Robinhood ticker, as in dataframe.pickle), or an OHLC file whose 'close'
+    column is used as the price of ticker.
+
+    Args:
+        filename (str): .csv or .parquet file.
+        ticker (str, optional): ticker for an OHLC file. Defaults to the first ticker in config['ticker_list'].
+
+    Returns:
+        tuple: (timestamps, prices) with int64 epoch seconds and a dict of ticker -> float array.
+    """
+    if filename.endswith(".parquet"):
+        data = pd.read_parquet(filename)
+    else:
+        data = pd.read_csv(filename)
+
+    data.columns = [str(a_column) for a_column in data.columns]
+    time_columns = [a_column for a_column in ("timestamp", "time", "date", "datetime") if a_column in data.columns]
+    if len(time_columns) == 0:
+        timestamps = np.arange(len(data), dtype=np.int64)
+    elif pd.api.types.is_numeric_dtype(data[time_columns[0]]):
+        timestamps = data[time_columns[0]].to_numpy(dtype=np.int64)
+        if len(timestamps) > 0 and timestamps.max() > 10**11:  # milliseconds
+            timestamps = timestamps // 1000
+    else:
+        timestamps = pd.to_datetime(data[time_columns[0]]).to_numpy().astype("datetime64[s]").astype(np.int64)
+
+    if "close" in data.columns:
+        ticker = ticker or list(config["ticker_list"].values())[0]
+        return timestamps, {ticker: data["close"].to_numpy(dtype=float)}
+
+    tickers = [a_ticker for a_ticker in config["ticker_list"].values() if a_ticker in data.columns]
+    if len(tickers) == 0:
+        tickers = [
+            a_column
+            for a_column in data.columns
+            if a_column not in time_columns and "_" not in a_column and pd.api.types.is_numeric_dtype(data[a_column])
+        ]
+
+    return timestamps, {a_ticker: data[a_ticker].to_numpy(dtype=float) for a_ticker in tickers}
+
+
+class backtest:
+    """
+    Vectorized backtest of the trader's strategies. Indicators and buy signals are computed for every bar at
+    once; the only Python loop runs over the bars where something can actually happen (a buy signal while
+    there's cash, or a price crossing the take-profit or stop-loss level of a held lot), which are found by
+    scanning blocks of bars with NumPy.
+
+    The rules are the ones in trader.run: sells (strategy or stop-loss) are checked before buys, prices and
+    quantities are rounded down to the Robinhood increments, buys need available_cash (cash minus the reserve,
+    as of the start of the bar) to cover buy_amount_per_trade, and a lot bought on a bar can only be sold from
+    the next one. Limit orders are assumed to fill at their limit price on the bar they're sent.
+
+    Args:
+        timestamps (array): int64 epoch seconds, one per bar.
+        prices (dict): ticker -> float array of prices (NaN for missing samples).
+        settings (dict, optional): strategy parameters, same keys as config. Defaults to config.
+        starting_cash (float, optional): buying power at the first bar. Defaults to 1000.
+        min_price_increments (dict, optional): ticker -> price increment. Defaults to 0.0001 for every ticker.
+        min_share_increments (dict, optional): ticker -> quantity increment. Defaults to 0.0001 for every ticker.
+        cache (dict, optional): indicator columns already computed for these prices, shared between backtests.
+    """
+
+    def __init__(
+        self,
+        timestamps,
+        prices,
+        settings=config,
+        starting_cash=1000.0,
+        min_price_increments=None,
+        min_share_increments=None,
+        cache=None,
+    ):
+        self.timestamps = np.asarray(timestamps)
+        self.tickers = list(prices)
+        self.prices = prices
+        self.settings = settings
+        self.starting_cash = float(starting_cash)
+        self.price_increments = [
+            (min_price_increments or {}).get(a_ticker, 0.0001) for a_ticker in self.tickers
+        ]
+        self.share_increments = [
+            (min_share_increments or {}).get(a_ticker, 0.0001) for a_ticker in self.tickers
+        ]
+        self.cache = {} if cache is None else cache
+
+    def indicator(self, kind, ticker, period):
+        # Indicator columns only depend on the ticker and the period, so they're shared through the cache
+        key = (kind, ticker, period)
+        if key not in self.cache:
+            function = batch_sma if kind == "sma" else batch_rsi
+            self.cache[key] = function(self.prices[ticker], period)
+
+        return self.cache[key]
+
+    def crossover(self, ticker, above):
+        # Fast-SMA crossed Slow-SMA 3 bars ago and stayed on the same side (old_signals.*_sma_crossover_rsi)
+        periods = self.settings["moving_average_periods"]
+        fast = self.indicator("sma", ticker, periods["sma_fast"])
+        slow = self.indicator("sma", ticker, periods["sma_slow"])
+        rsi = self.indicator("rsi", ticker, self.settings["rsi_period"])
+
+        mask = np.zeros(len(fast), dtype=bool)
+        if len(fast) < 4:
+            return mask
+
+        with np.errstate(invalid="ignore"):
+            side = fast >= slow if above else fast <= slow
+            spread = fast - slow if above else slow - fast
+            valid = ~np.isnan(fast) & ~np.isnan(slow)
+            mask[3:] = (
+                valid[3:] & valid[2:-1] & valid[1:-2] & valid[:-3]
+                & ~np.isnan(rsi[3:])
+                & side[3:] & side[2:-1] & side[1:-2]
+                & ~side[:-3] & valid[:-3]
+                & (spread[3:] >= spread[2:-1])
+            )
+            if above:
+                mask &= rsi > self.settings["rsi_threshold"]["buy"]
+            else:
+                mask &= rsi <= self.settings["rsi_threshold"]["sell"]
+
+        return mask
+
+    def buy_signals(self, ticker):
+        strategy = self.settings["trade_strategies"]["buy"]
+        if strategy == "sma_crossover_rsi":
+            return self.crossover(ticker, above=True)
+        elif strategy == "sma_rsi_threshold":
+            price = self.prices[ticker]
+            fast = self.indicator("sma", ticker, self.settings["moving_average_periods"]["sma_fast"])
+            rsi = self.indicator("rsi", ticker, self.settings["rsi_period"])
+            with np.errstate(invalid="ignore"):
+                return (
+                    ~np.isnan(fast)
+                    & ~np.isnan(rsi)
+                    & (price <= fast - (fast * self.settings["buy_below_moving_average"]))
+                    & (rsi <= self.settings["rsi_threshold"]["buy"])
+                )
+
+        raise ValueError("Unknown buy strategy: " + str(strategy))
+
+    def run(self):
+        """
+        Returns:
+            dict: trades (DataFrame), equity (array, one value per bar), pnl, realized_pnl, unrealized_pnl,
+            max_drawdown, open_lots, bars and bars_per_second.
+        """
+        start_time = time.perf_counter()
+        settings = self.settings
+        sell_strategy = settings["trade_strategies"]["sell"]
+        if sell_strategy not in ("above_buy", "sma_crossover_rsi"):
+            raise ValueError("Unknown sell strategy: " + str(sell_strategy))
+
+        P = np.column_stack([self.prices[a_ticker] for a_ticker in self.tickers])
+        bars, tickers = P.shape
+        buy = np.column_stack([self.buy_signals(a_ticker) for a_ticker in self.tickers])
+        buy_any = buy.any(axis=1)
+        crossed = None
+        if sell_strategy == "sma_crossover_rsi":
+            crossed = np.column_stack([self.crossover(a_ticker, above=False) for a_ticker in self.tickers])
+
+        profit = settings["profit_percentage"]
+        stop_loss = settings["stop_loss_threshold"]
+        amount = settings["buy_amount_per_trade"]
+        reserve = settings["reserve"]
+
+        lots = [[] for a_ticker in self.tickers]  # per ticker: [quantity, price, take-profit level, stop-loss level]
+        take_profit = np.full(tickers, inf)  # lowest take-profit level of the lots held for each ticker
+        stop = np.full(tickers, -inf)  # highest stop-loss level of the lots held for each ticker
+        cash = self.starting_cash
+        cash_change = np.zeros(bars)
+        quantity_change = np.zeros((bars, tickers))
+        trades = []
+        realized = 0.0
+
+        t = 0
+        block = 64
+        while t < bars:
+            # Find the next bar where something can happen
+            available = cash - reserve
+            can_buy = available >= amount and available > 0
+            while t < bars:
+                end = min(t + block, bars)
+                prices = P[t:end]
+                with np.errstate(invalid="ignore"):
+                    hit = (prices < stop).any(axis=1)
+                    if crossed is None:
+                        hit |= (prices > take_profit).any(axis=1)
+                    else:
+                        hit |= (crossed[t:end] & (prices >= take_profit)).any(axis=1)
+                if can_buy:
+                    hit |= buy_any[t:end]
+
+                found = np.flatnonzero(hit)
+                if len(found) > 0:
+                    t += found[0]
+                    block = 64
+                    break
+
+                t = end
+                block = min(block * 2, 65536)
+
+            if t >= bars:
+                break
+
+            # Sells first, like trader.run
+            for j in range(tickers):
+                price = P[t, j]
+                if len(lots[j]) == 0 or price != price:
+                    continue
+
+                sell_price = round(floor(price / self.price_increments[j]) * self.price_increments[j], 7)
+                kept = []
+                for a_lot in lots[j]:
+                    if crossed is None:
+                        signal = price > a_lot[2]
+                    else:
+                        signal = crossed[t, j] and price >= a_lot[2]
+
+                    if signal or price < a_lot[3]:
+                        proceeds = a_lot[0] * sell_price
+                        profit_amount = proceeds - a_lot[0] * a_lot[1]
+                        cash += proceeds
+                        realized += profit_amount
+                        cash_change[t] += proceeds
+                        quantity_change[t, j] -= a_lot[0]
+                        trades.append(
+                            (t, self.timestamps[t], self.tickers[j], "sell", a_lot[0], sell_price, profit_amount,
+                             "signal" if signal else "stop_loss")
+                        )
+                    else:
+                        kept.append(a_lot)
+
+                lots[j] = kept
+
+            # Then buys, all checked against the cash available at the start of the bar
+            if can_buy and buy_any[t]:
+                for j in np.flatnonzero(buy[t]):
+                    price = round(floor(P[t, j] / self.price_increments[j]) * self.price_increments[j], 7)
+                    if price <= 0:
+                        continue
+
+                    quantity = (available if amount == 0 else amount) / price
+                    quantity = round(floor(quantity / self.share_increments[j]) * self.share_increments[j], 7)
+                    cost = quantity * price
+                    if quantity <= 0 or cost > cash:
+                        continue  # Robinhood would reject this order
+
+                    cash -= cost
+                    cash_change[t] -= cost
+                    quantity_change[t, j] += quantity
+                    lots[j].append([quantity, price, price + price * profit, price - price * stop_loss])
+                    trades.append((t, self.timestamps[t], self.tickers[j], "buy", quantity, price, 0.0, "signal"))
+
+            for j in range(tickers):
+                take_profit[j] = min([a_lot[2] for a_lot in lots[j]], default=inf)
+                stop[j] = max([a_lot[3] for a_lot in lots[j]], default=-inf)
+
+            t += 1
+
+        # Equity curve: cash plus holdings marked at the last known price
+        last_prices = np.nan_to_num(pd.DataFrame(P).ffill().to_numpy())
+        holdings = np.cumsum(quantity_change, axis=0)
+        equity = self.starting_cash + np.cumsum(cash_change) + (holdings * last_prices).sum(axis=1)
+        peak = np.maximum.accumulate(equity) if bars > 0 else equity
+        drawdown = np.where(peak > 0, (peak - equity) / np.where(peak > 0, peak, 1.0), 0.0)
+
+        unrealized = sum(
+            a_lot[0] * (last_prices[-1, j] - a_lot[1]) for j in range(tickers) for a_lot in lots[j]
+        ) if bars > 0 else 0.0
+        elapsed = time.perf_counter() - start_time
+
+        return {
+            "trades": pd.DataFrame(
+                trades, columns=["bar", "timestamp", "ticker", "side", "quantity", "price", "profit", "reason"]
+            ),
+            "equity": equity,
+            "starting_cash": self.starting_cash,
+            "final_equity": equity[-1] if bars > 0 else self.starting_cash,
+            "pnl": (equity[-1] if bars > 0 else self.starting_cash) - self.starting_cash,
+            "realized_pnl": realized,
+            "unrealized_pnl": unrealized,
+            "max_drawdown": drawdown.max() if bars > 0 else 0.0,
+            "open_lots": sum(len(a_lots) for a_lots in lots),
+            "bars": bars,
+            "bars_per_second": bars / elapsed if elapsed > 0 else inf,
+        }
+
+
+def print_report(result):
+    trades = result["trades"]
+    print("-- Backtest -----------------------------")
+    print("Bars: " + str(result["bars"]) + " (" + str(int(result["bars_per_second"])) + " bars/s)")
+    print(
+        "Trades: "
+        + str(len(trades))
+        + " ("
+        + str(int((trades["side"] == "buy").sum()))
+        + " buys, "
+        + str(int((trades["side"] == "sell").sum()))
+        + " sells, "
+        + str(int((trades["reason"] == "stop_loss").sum()))
+        + " stop-losses)"
+    )
+    print("Open lots: " + str(result["open_lots"]))
+    print("Starting cash: $" + str(round(result["starting_cash"], 3)))
+    print("Final equity: $" + str(round(result["final_equity"], 3)))
+    print(
+        "PnL: $"
+        + str(round(result["pnl"], 3))
+        + " (realized: $"
+        + str(round(result["realized_pnl"], 3))
+        + ", unrealized: $"
+        + str(round(result["unrealized_pnl"], 3))
+        + ")"
+    )
+    print("Max drawdown: " + str(round(result["max_drawdown"] * 100, 2)) + "%")
+
+
+def main(argv=None):
+    # Command line of this script, also used by "python3 cli.py backtest"
+    parser = argparse.ArgumentParser(description="Backtest the configured strategies on a price history.")
+    parser.add_argument("filename", help="CSV or Parquet file with the prices")
+    parser.add_argument("--ticker", help="ticker for an OHLC file (default: first ticker in config)")
+    parser.add_argument("--cash", type=float, default=1000.0, help="starting cash (default: 1000)")
+    parser.add_argument("--trades", help="save the list of trades to this CSV file")
+    arguments = parser.parse_args(argv)
+
+    timestamps, prices = load_prices(arguments.filename, arguments.ticker)
+    result = backtest(timestamps, prices, starting_cash=arguments.cash).run()
+    print_report(result)
+
+    if arguments.trades:
+        result["trades"].to_csv(arguments.trades, index=False)
+
+
+if __name__ == "__main__":
+    main()
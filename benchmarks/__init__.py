@@ -0,0 +1,2 @@
+# Sherwood benchmarks
+# Stand-ins for the services the bot talks to, and the harnesses that drive the bot against them.
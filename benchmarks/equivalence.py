@@ -0,0 +1,150 @@
+#!/usr/bin/python3 -u
+
+# Sherwood strategy equivalence check
+# Walks a price_store through a synthetic history, one row at a time, and checks at every row that each
+# batch_signals strategy returns, for every ticker (or every lot), what its old_signals reference implementation
+# returns for that ticker (or lot) alone. The lots are passed both as a list of assets and as a lot_ledger, which
+# also holds lots of a ticker that isn't followed anymore: those must never be sold.
+# Run from the repository root: python3 -m benchmarks.equivalence
+# (exit code 1 if any strategy disagrees, or never raised a signal: the check would then prove nothing)
+
+import argparse
+import numpy as np
+from config import config
+import sherwood
+from indicators import batch_indicators
+from ledger import lot_ledger
+from price_store import price_store
+from signals import batch_signals, old_signals
+
+strategies = ("buy_sma_crossover_rsi", "buy_sma_rsi_threshold", "sell_above_buy", "sell_sma_crossover_rsi")
+
+
+def history_for(rows, tickers, seed=0):
+    """
+    Prices that trend up and down, with their indicators computed like the bot does. Every cycle rises for the
+    first 80 to 120 rows (past the warm-up of the slow SMA), then falls for as long, steeply enough against the
+    noise for the RSI to reach the buy threshold, then rises again so the SMAs cross: every strategy fires within
+    the first 300 rows.
+
+    Returns:
+        dict: column -> array of rows values.
+    """
+    rng = np.random.default_rng(seed)
+    values = {}
+    for a_ticker in tickers:
+        trend = 0.01 * np.sin(np.arange(rows) * 2 * np.pi / rng.uniform(160, 240))
+        prices = np.round(100 * np.exp(np.cumsum(trend + rng.normal(0, 0.004, rows))), 3)
+        values[a_ticker] = prices
+        values.update(batch_indicators(a_ticker, prices, config))
+    return values
+
+
+def lots_for(history, tickers, row, seed=0):
+    # A few lots per ticker, bought around the price of a few rows ago, and one around the lowest price of the last
+    # cycle (held long enough to be in profit when the SMAs cross down)
+    rng = np.random.default_rng(seed + row)
+    return [
+        sherwood.asset(
+            a_ticker,
+            1.0,
+            (history[a_ticker][max(0, row - 10)] if i < 2 else history[a_ticker][max(0, row - 200) : row].min())
+            * rng.uniform(0.97, 1.03),
+            a_ticker + "-" + str(i),
+        )
+        for a_ticker in tickers
+        for i in range(3)
+    ]
+
+
+def run_check(rows=2000, tickers=8, seed=0):
+    """
+    Returns:
+        dict: strategy -> rows compared, signals raised and mismatches (as (row, ticker or order id) pairs).
+    """
+    tickers = ["T%03d" % i for i in range(tickers)]
+    history = history_for(rows, tickers, seed)
+    columns = list(history)
+    window = batch_signals.lookback + 1  # the store only needs the last few rows
+    results = {a_strategy: {"rows": 0, "signals": 0, "mismatches": []} for a_strategy in strategies}
+    for a_strategy in ("sell_above_buy", "sell_sma_crossover_rsi"):
+        results[a_strategy + ".unfollowed"] = {"rows": 0, "signals": 0, "mismatches": []}
+
+    batch, old = batch_signals(), old_signals()
+    for a_row in range(window, rows):
+        store = price_store(columns, window)
+        store.load_arrays(
+            np.arange(a_row - window, a_row, dtype=np.int64),
+            {a_column: a_values[a_row - window : a_row] for a_column, a_values in history.items()},
+        )
+        data = store.frame()
+
+        for a_strategy in ("buy_sma_crossover_rsi", "buy_sma_rsi_threshold"):
+            expected = [bool(getattr(old, a_strategy)(a_ticker, data)) for a_ticker in tickers]
+            got = getattr(batch, a_strategy)(tickers, store)
+            results[a_strategy]["rows"] += 1
+            results[a_strategy]["signals"] += sum(expected)
+            results[a_strategy]["mismatches"] += [
+                (a_row, a_ticker) for a_ticker, a_expected, a_got in zip(tickers, expected, got) if a_expected != a_got
+            ]
+
+        lots = lots_for(history, tickers, a_row, seed)
+        ledger = lot_ledger()
+        for a_lot in lots:
+            ledger.add(a_lot.ticker, a_lot.quantity, a_lot.price, a_lot.order_id)
+        ledger.add("GONE", 1.0, 1.0, "unfollowed")  # a ticker removed from ticker_list, with a lot still held
+
+        for a_strategy in ("sell_above_buy", "sell_sma_crossover_rsi"):
+            expected = [bool(getattr(old, a_strategy)(a_lot, data)) for a_lot in lots]
+            got = getattr(batch, a_strategy)(tickers, lots, store)
+            got_ledger = dict(zip([a_lot.order_id for a_lot in ledger.all()], getattr(batch, a_strategy)(tickers, ledger, store)))
+            results[a_strategy]["rows"] += 1
+            results[a_strategy]["signals"] += sum(expected)
+            results[a_strategy]["mismatches"] += [
+                (a_row, a_lot.order_id)
+                for a_lot, a_expected, a_got in zip(lots, expected, got)
+                if a_expected != a_got or a_expected != got_ledger[a_lot.order_id]
+            ]
+            results[a_strategy + ".unfollowed"]["rows"] += 1
+            results[a_strategy + ".unfollowed"]["signals"] += int(got_ledger["unfollowed"])
+            if got_ledger["unfollowed"]:
+                results[a_strategy + ".unfollowed"]["mismatches"].append((a_row, "unfollowed"))
+
+    return results
+
+
+def is_silent(results, a_strategy):
+    # A strategy that never fired was only compared on rows where both implementations say no
+    return a_strategy in strategies and results[a_strategy]["signals"] == 0
+
+
+def print_results(results):
+    print("-- Strategy equivalence ------------------")
+    for a_strategy, a_result in results.items():
+        if len(a_result["mismatches"]) > 0:
+            status = str(len(a_result["mismatches"])) + " mismatches, e.g. " + str(a_result["mismatches"][:3])
+        elif is_silent(results, a_strategy):
+            status = "no signals, nothing was checked (try more --rows)"
+        else:
+            status = "ok"
+        print(
+            a_strategy.ljust(36)
+            + str(a_result["rows"]).rjust(6)
+            + " rows | "
+            + str(a_result["signals"]).rjust(5)
+            + " signals | "
+            + status
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that batch_signals agrees with old_signals.")
+    parser.add_argument("--rows", type=int, default=2000, help="rows of history walked through (default: 2000)")
+    parser.add_argument("--tickers", type=int, default=8, help="number of coins (default: 8)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic prices (default: 0)")
+    arguments = parser.parse_args()
+
+    results = run_check(arguments.rows, arguments.tickers, arguments.seed)
+    print_results(results)
+    if any(len(a_result["mismatches"]) > 0 or is_silent(results, a_strategy) for a_strategy, a_result in results.items()):
+        exit(1)
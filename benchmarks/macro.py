@@ -0,0 +1,306 @@
+#!/usr/bin/python3 -u
+
+# Sherwood macro-benchmark
+# Drives trader.run and the thief loop against the stand-in services and reports the latency of every tick.
+# Run from the repository root: python3 -m benchmarks.macro --tickers 200 --ticks 50
+
+import argparse
+import asyncio
+import contextlib
+import copy
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from config import config
+from metrics import metrics
+from quote_feed import quote_feed
+from scheduler import coin_scheduler, default_rate_limits, rate_limiters
+import sherwood
+from benchmarks.standins import (
+    fault_profile,
+    installed,
+    kraken_standin,
+    market,
+    robinhood_standin,
+    tradingview_standin,
+)
+
+
+class manual_timer:
+    # Takes the place of threading.Timer in sherwood: the benchmark calls trader.run itself, one tick after another
+    def __init__(self, interval, function, *args, **kwargs):
+        pass
+
+    def start(self):
+        pass
+
+
+def percentiles(samples):
+    if len(samples) == 0:
+        return {"count": 0}
+
+    milliseconds = np.asarray(samples) * 1000
+    return {
+        "count": len(milliseconds),
+        "mean_ms": float(milliseconds.mean()),
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p90_ms": float(np.percentile(milliseconds, 90)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "max_ms": float(milliseconds.max()),
+    }
+
+
+def run_benchmark(
+    tickers=200,
+    ticks=50,
+    warmup=100,
+    thief_passes=1,
+    thief_cadence=1.0,
+    client_rate_limits=False,
+    latency=0.0,
+    jitter=0.0,
+    error_rate=0.0,
+    rate_limit=None,
+    freeze_rate=0.0,
+    seed=0,
+    verbose=False,
+):
+    """
+    Run the bot against the stand-ins and measure how long each step takes.
+
+    Args:
+        tickers (int, optional): number of coins traded. Defaults to 200.
+        ticks (int, optional): trader.run iterations measured. Defaults to 50.
+        warmup (int, optional): trader.run iterations before measuring, so the indicators have enough samples to trade.
+            Defaults to 100.
+        thief_passes (int, optional): evaluations of every coin by the thief loop. Defaults to 1.
+        thief_cadence (float, optional): seconds between two evaluations of the same coin. Defaults to 1.
+        client_rate_limits (bool, optional): apply the bot's own rate limits (config['rate_limits']), which
+            measures the scheduler rather than the services. Defaults to False.
+        latency (float, optional): median latency of every service call, in seconds. Defaults to 0.
+        jitter (float, optional): spread of the latency (log-normal sigma). Defaults to 0.
+        error_rate (float, optional): probability that a service call fails. Defaults to 0.
+        rate_limit (float, optional): calls per second accepted by each service. Defaults to no limit.
+        freeze_rate (float, optional): probability that a Kraken price freezes at each tick. Defaults to 0.
+        seed (int, optional): seed for the stand-ins. Defaults to 0.
+        verbose (bool, optional): show what the bot prints. Defaults to False.
+
+    Returns:
+        dict: latency percentiles of the trader ticks and the thief coins, failures and calls made to each service.
+    """
+    pairs = {"XT%03dZUSD" % i: "T%03d" % i for i in range(tickers)}
+    prices = market(list(pairs.values()), freeze_rate=freeze_rate, seed=seed)
+    faults = {
+        a_service: fault_profile(latency, jitter, error_rate, rate_limit, seed=seed + i)
+        for i, a_service in enumerate(("kraken", "robinhood", "tradingview"))
+    }
+    robinhood = robinhood_standin(prices, faults["robinhood"])
+    kraken = kraken_standin(prices, pairs, faults["kraken"]).start()
+    tradingview = tradingview_standin(prices, faults["tradingview"], seed=seed)
+
+    saved_config = copy.deepcopy(config)
+    saved_timer = sherwood.Timer
+    directory = tempfile.TemporaryDirectory()
+    working_directory = os.getcwd()
+    output = None if verbose else open(os.devnull, "w")
+    results = {}
+
+    try:
+        os.chdir(directory.name)
+        sherwood.Timer = manual_timer
+        config.update(
+            {
+                "username": "benchmark",
+                "password": "benchmark",
+                "trades_enabled": True,
+                "debug_enabled": False,
+                "ticker_list": pairs,
+                "save_charts": False,
+                "history_dir": "history",
+                "orders_journal": "orders.journal",
+                "thief_journal": "thief.journal",
+            }
+        )
+
+        with installed(robinhood, kraken, tradingview), contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+            # Startup isn't measured, and the services behave during it (the bot exits if it can't log in)
+            for a_faults in faults.values():
+                a_faults.enabled = False
+            bot = sherwood.trader()
+            Sherrif = sherwood.thief()
+            MaidMarian = sherwood.checker()
+
+            for i in range(warmup):
+                prices.step()
+                robinhood.match()
+                bot.run()
+
+            for a_faults in faults.values():
+                a_faults.enabled = True
+
+            tick_latency = []
+            tick_failures = 0
+            for i in range(ticks):
+                prices.step()
+                robinhood.match()
+                start = time.perf_counter()
+                try:
+                    bot.run()
+                except Exception:
+                    tick_failures += 1
+                tick_latency.append(time.perf_counter() - start)
+
+            if client_rate_limits:
+                limits = rate_limiters(config.get("rate_limits"))
+            else:
+                limits = rate_limiters({a_endpoint: None for a_endpoint in default_rate_limits})
+
+            # Refreshed twice per cadence, like in the main loop
+            quotes = quote_feed(
+                list(pairs.values()),
+                lambda symbol: sherwood.r.orders.get_crypto_quote(symbol),
+                thief_cadence / 2,
+            ).start()
+
+            def housekeeping():
+                # Same as the main loop, plus the market moving once per cadence
+                Sherrif.is_positions_stale = True
+                Sherrif.settle_sells()
+                Sherrif.journal.sync()
+                prices.step()
+                robinhood.match()
+
+            scheduler = coin_scheduler(
+                list(pairs.values()),
+                lambda ticker: sherwood.steal(Sherrif, MaidMarian, ticker, limits, quotes),
+                thief_cadence,
+                every_cadence=housekeeping,
+                rounds=thief_passes,
+            )
+            asyncio.run(scheduler.run())
+            quotes.stop()
+            coin_latency = [a_latency for a_latencies in scheduler.latencies.values() for a_latency in a_latencies]
+
+            bot.history.close()
+            bot.journal.close()
+            Sherrif.journal.close()
+
+        results = {
+            "tickers": tickers,
+            "trader_tick": dict(percentiles(tick_latency), failures=tick_failures),
+            "thief_coin": dict(percentiles(coin_latency), failures=sum(scheduler.failures.values())),
+            "thief_missed_slots": sum(scheduler.missed.values()),
+            "ticks_per_second": ticks / sum(tick_latency) if sum(tick_latency) > 0 else 0.0,
+            "open_positions": len(bot.orders),
+            "quote_feed": quotes.stats(),
+            "metrics": metrics.json(),  # per stage and per endpoint, over the whole run (warmup included)
+            "services": {a_service: a_faults.stats() for a_service, a_faults in faults.items()},
+        }
+    finally:
+        os.chdir(working_directory)
+        sherwood.Timer = saved_timer
+        config.clear()
+        config.update(saved_config)
+        kraken.stop()
+        directory.cleanup()
+        if output:
+            output.close()
+
+    return results
+
+
+def print_results(results):
+    print("-- Macro-benchmark (" + str(results["tickers"]) + " tickers) --------------")
+    for a_name in ("trader_tick", "thief_coin"):
+        a_result = results[a_name]
+        if a_result["count"] == 0:
+            continue
+
+        print(
+            a_name.replace("_", " ").capitalize()
+            + ": p50 "
+            + str(round(a_result["p50_ms"], 2))
+            + " ms | p90 "
+            + str(round(a_result["p90_ms"], 2))
+            + " ms | p99 "
+            + str(round(a_result["p99_ms"], 2))
+            + " ms | max "
+            + str(round(a_result["max_ms"], 2))
+            + " ms ("
+            + str(a_result["count"])
+            + " samples"
+            + (", " + str(a_result["failures"]) + " failed" if "failures" in a_result else "")
+            + ")"
+        )
+
+    print("Trader ticks per second: " + str(round(results["ticks_per_second"], 2)))
+    print("Thief slots missed: " + str(results["thief_missed_slots"]))
+    print(
+        "Quote feed: "
+        + str(results["quote_feed"]["refreshes"])
+        + " refreshes | mean "
+        + str(round(results["quote_feed"]["refresh_mean"] * 1000, 2))
+        + " ms | max "
+        + str(round(results["quote_feed"]["refresh_max"] * 1000, 2))
+        + " ms | "
+        + str(results["quote_feed"]["errors"])
+        + " errors | "
+        + str(len(results["quote_feed"]["stale"]))
+        + " stale"
+    )
+    for a_service, a_endpoints in results["services"].items():
+        for a_endpoint, a_stats in a_endpoints.items():
+            print(
+                a_service
+                + "."
+                + a_endpoint
+                + ": "
+                + str(a_stats["calls"])
+                + " calls, "
+                + str(a_stats["errors"])
+                + " errors, "
+                + str(a_stats["rate_limited"])
+                + " rate limited"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive the bot against local stand-ins of the services it uses.")
+    parser.add_argument("--tickers", type=int, default=200, help="number of coins (default: 200)")
+    parser.add_argument("--ticks", type=int, default=50, help="trader ticks measured (default: 50)")
+    parser.add_argument("--warmup", type=int, default=100, help="trader ticks before measuring (default: 100)")
+    parser.add_argument("--thief-passes", type=int, default=1, help="evaluations of every coin by the thief (default: 1)")
+    parser.add_argument("--thief-cadence", type=float, default=1.0, help="seconds between evaluations of a coin (default: 1)")
+    parser.add_argument("--client-rate-limits", action="store_true", help="apply the bot's own rate limits")
+    parser.add_argument("--latency", type=float, default=0.0, help="median latency of service calls in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="log-normal sigma of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability that a service call fails")
+    parser.add_argument("--rate-limit", type=float, help="calls per second accepted by each service")
+    parser.add_argument("--freeze-rate", type=float, default=0.0, help="probability that a price freezes at each tick")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show what the bot prints")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    arguments = parser.parse_args()
+
+    results = run_benchmark(
+        tickers=arguments.tickers,
+        ticks=arguments.ticks,
+        warmup=arguments.warmup,
+        thief_passes=arguments.thief_passes,
+        thief_cadence=arguments.thief_cadence,
+        client_rate_limits=arguments.client_rate_limits,
+        latency=arguments.latency / 1000,
+        jitter=arguments.jitter,
+        error_rate=arguments.error_rate,
+        rate_limit=arguments.rate_limit,
+        freeze_rate=arguments.freeze_rate,
+        seed=arguments.seed,
+        verbose=arguments.verbose,
+    )
+    print_results(results)
+
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,454 @@
+#!/usr/bin/python3 -u
+
+# Sherwood micro-benchmarks
+# Times the per-tick hot paths across data sizes and ticker counts, and saves or compares baselines.
+# Run from the repository root:
+#   python3 -m benchmarks.micro --save benchmarks/baseline.json      (record a baseline on this machine)
+#   python3 -m benchmarks.micro --compare benchmarks/baseline.json   (exit code 1 if something got slower)
+
+import argparse
+import contextlib
+import copy
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime
+from threading import Lock
+import numpy as np
+import pandas as pd
+from config import config
+import sherwood
+from benchmarks.standins import installed, market, robinhood_standin
+from history_store import history_store
+from indicators import batch_indicators, indicator_engine
+from ledger import lot_ledger
+from price_store import price_store
+from sherwood import stage_seconds
+from signals import batch_signals, old_signals, required_indicators, resolve_strategies
+
+row_sizes = [100, 1000, 10000, 1000000]  # 10000 is the default max_data_rows
+ticker_counts = [1, 10, 100, 500]
+quick_row_sizes = [100, 10000]
+quick_ticker_counts = [1, 100]
+default_rows = 1000  # for the cases whose cost doesn't depend on the length of the history
+minutes = 15  # sampling interval of the generated prices
+
+cases = {}  # name -> (setup function, sizes it depends on)
+budgets = {"metrics.observe": 1e-6, "metrics.probe": 1e-6}  # name -> most seconds a call may take, on any machine
+
+
+def case(name, depends_on=("rows", "tickers")):
+    # Register a benchmark: the setup function takes (rows, tickers) and returns the function to time
+    def register(setup):
+        cases[name] = (setup, depends_on)
+        return setup
+
+    return register
+
+
+class static_feed:
+    # Takes the place of kraken_feed: new prices for every pair at each fetch, without any I/O
+    last_latency = 0.0
+
+    def __init__(self, pairs, seed=0):
+        self.pairs = list(pairs)
+        self.prices = np.random.default_rng(seed).uniform(1.0, 1000.0, len(self.pairs))
+        self.step = 1.0
+
+    def fetch(self):
+        self.step = -self.step  # prices alternate, so they're never seen as frozen
+        return dict(zip(self.pairs, self.prices + self.step))
+
+
+def tickers_for(count):
+    return {"XT%03dZUSD" % i: "T%03d" % i for i in range(count)}
+
+
+def store_for(rows, tickers, seed=0):
+    # rows of random-walk prices for each ticker, with the indicators computed like the bot does
+    engine = indicator_engine(config)
+    columns = []
+    for a_ticker in tickers:
+        columns += [a_ticker] + engine.columns(a_ticker)
+
+    rng = np.random.default_rng(seed)
+    timestamps = int(datetime.now().timestamp()) - minutes * 60 * np.arange(rows, 0, -1, dtype=np.int64)
+    values = {}
+    for a_ticker in tickers:
+        prices = np.round(100 * np.exp(np.cumsum(rng.normal(0, 0.01, rows))), 3)
+        values[a_ticker] = prices
+        values.update(batch_indicators(a_ticker, prices, config))
+
+    store = price_store(columns, rows)
+    store.load_arrays(timestamps, values)
+    return store
+
+
+def store_bytes(rows, tickers):
+    # Memory a price_store of this size needs (mirrored buffers, 6 columns per ticker plus the timestamps)
+    return rows * 2 * 8 * (tickers * 6 + 1)
+
+
+def bot_for(rows, tickers, directory):
+    bot = object.__new__(sherwood.trader)  # skip the login and the loading done by __init__
+    bot.store = store_for(rows, tickers)
+    bot.indicators = indicator_engine(config)
+    for a_ticker in tickers:
+        bot.indicators.warm_up(a_ticker, bot.store.window(a_ticker, min(rows, 1000)))
+    bot.history = history_store(os.path.join(directory, "history"), list(bot.store.columns))
+    bot.kraken = static_feed(config["ticker_list"])
+    bot.min_consecutive_samples = max(config["rsi_period"], config["moving_average_periods"]["sma_fast"])
+    bot.count_consecutive_samples()
+    bot.min_price_increments = {a_ticker: 0.0001 for a_ticker in tickers}
+    bot.min_share_increments = {a_ticker: 0.0001 for a_ticker in tickers}
+    bot.available_cash = 1000000.0
+    bot.is_trading_locked = False
+    bot.orders = lot_ledger()
+    return bot
+
+
+def lots_for(store, tickers):
+    return [
+        sherwood.asset(a_ticker, 1.0, store.last(a_ticker), "order-" + a_ticker) for a_ticker in tickers
+    ]
+
+
+@case("checker.get_new_data")
+def bench_get_new_data(rows, tickers, directory):
+    bot = bot_for(rows, tickers, directory)
+    return lambda: bot.get_new_data(datetime.now())
+
+
+def bench_indicators_update(only_strategies=False):
+    def setup(rows, tickers, directory):
+        indicators = None
+        if only_strategies:
+            # Only what the configured strategies read (the default ones only need the fast SMA and the RSI)
+            indicators = required_indicators(resolve_strategies(config["trade_strategies"]))
+        engine = indicator_engine(config, indicators)
+        prices = np.random.default_rng(0).uniform(1.0, 1000.0, (2, len(tickers)))
+        state = {"i": 0}
+
+        def update():
+            state["i"] ^= 1
+            for a_ticker, a_price in zip(tickers, prices[state["i"]]):
+                engine.update(a_ticker, a_price)
+
+        return update
+
+    return setup
+
+
+case("indicators.update", depends_on=("tickers",))(bench_indicators_update())
+case("indicators.update.strategies", depends_on=("tickers",))(bench_indicators_update(only_strategies=True))
+
+
+@case("checker.is_data_consistent", depends_on=("rows",))
+def bench_is_data_consistent(rows, tickers, directory):
+    bot = bot_for(rows, tickers, directory)
+    now = datetime.fromtimestamp(bot.store.last("timestamp") + minutes * 60)
+    return lambda: bot.is_data_consistent(now)
+
+
+def bench_batch_signal(strategy):
+    def setup(rows, tickers, directory):
+        store = store_for(rows, tickers)
+        method = getattr(batch_signals(), strategy)
+        if strategy.startswith("sell_"):
+            lots = lots_for(store, tickers)
+            return lambda: method(tickers, lots, store)
+        return lambda: method(tickers, store)
+
+    return setup
+
+
+def bench_old_signal(strategy):
+    def setup(rows, tickers, directory):
+        store = store_for(rows, tickers)
+        data = store.frame()
+        method = getattr(old_signals(), strategy)
+        if strategy.startswith("sell_"):
+            lots = lots_for(store, tickers)
+            return lambda: [method(a_lot, data) for a_lot in lots]
+        return lambda: [method(a_ticker, data) for a_ticker in tickers]
+
+    return setup
+
+
+for a_strategy in ("buy_sma_crossover_rsi", "buy_sma_rsi_threshold", "sell_above_buy", "sell_sma_crossover_rsi"):
+    case("signals.batch_signals." + a_strategy, depends_on=("tickers",))(bench_batch_signal(a_strategy))
+
+# old_signals.sell_sma_crossover_rsi refers to an undefined name once its first conditions hold, so it's left out
+for a_strategy in ("buy_sma_crossover_rsi", "buy_sma_rsi_threshold", "sell_above_buy"):
+    case("signals.old_signals." + a_strategy, depends_on=("tickers",))(bench_old_signal(a_strategy))
+
+
+@case("trader.buy", depends_on=("tickers",))
+def bench_buy(rows, tickers, directory):
+    bot = bot_for(rows, tickers, directory)
+    return lambda: [bot.buy(a_ticker) for a_ticker in tickers]
+
+
+@case("trader.sell", depends_on=("tickers",))
+def bench_sell(rows, tickers, directory):
+    bot = bot_for(rows, tickers, directory)
+    for a_lot in lots_for(bot.store, tickers):
+        bot.orders.add(a_lot.ticker, a_lot.quantity, a_lot.price, a_lot.order_id)
+    lots = bot.orders.all()
+    return lambda: [bot.sell(a_lot) for a_lot in lots]
+
+
+@case("ledger.valuation", depends_on=("tickers",))
+def bench_ledger_valuation(rows, tickers, directory):
+    # Value and stop-loss of 20 lots per ticker, as trader.run does every tick
+    ledger = lot_ledger()
+    store = store_for(rows, tickers)
+    for i in range(20):
+        for a_ticker in tickers:
+            ledger.add(a_ticker, 1.0, store.last(a_ticker), "order-" + a_ticker + "-" + str(i))
+    prices = np.array([store.last(a_ticker) for a_ticker in ledger.tickers])
+
+    def value():
+        ledger.valuation(prices)
+        ledger.triggers(prices, config["stop_loss_threshold"])
+
+    return value
+
+
+@case("metrics.observe", depends_on=())
+def bench_metrics_observe(rows, tickers, directory):
+    return lambda: stage_seconds["tick"].observe(0.0123)
+
+
+@case("metrics.probe", depends_on=())
+def bench_metrics_probe(rows, tickers, directory):
+    # One stage of trader.run as it's timed (an empty one), must stay under a microsecond, see budgets
+    def probed():
+        stage_start = time.perf_counter()
+        stage_seconds["tick"].observe(time.perf_counter() - stage_start)
+
+    return probed
+
+
+@case("metrics.time", depends_on=())
+def bench_metrics_time(rows, tickers, directory):
+    # The same with a with block, only used around network calls
+    def timed():
+        with stage_seconds["tick"].time():
+            pass
+
+    return timed
+
+
+def thief_for(tickers):
+    Sherrif = object.__new__(sherwood.thief)  # skip the login and the journal
+    Sherrif.positions = {}
+    Sherrif.is_positions_stale = True
+    Sherrif.positions_lock = Lock()
+    robinhood = robinhood_standin(market(tickers, seed=0))
+    robinhood.holdings = {a_ticker: 1.0 for a_ticker in tickers}
+    return Sherrif, robinhood
+
+
+@case("thief.scout", depends_on=("tickers",))
+def bench_scout(rows, tickers, directory):
+    Sherrif, robinhood = thief_for(tickers)
+
+    def scout():
+        with installed(robinhood=robinhood):
+            Sherrif.scout()
+
+    return scout
+
+
+@case("thief.position", depends_on=("tickers",))
+def bench_position(rows, tickers, directory):
+    Sherrif, robinhood = thief_for(tickers)
+    with installed(robinhood=robinhood):
+        Sherrif.scout()
+
+    # Every coin looked up once, like a pass of the thief loop
+    return lambda: [Sherrif.position(a_ticker) for a_ticker in tickers]
+
+
+def measure(function, repeat=5, min_time=0.05):
+    """
+    Seconds per call: the loop count is picked so that one measurement takes at least min_time, and the best and
+    median of repeat measurements are kept.
+    """
+    timer = timeit.Timer(function)
+    loops = 1
+    while True:
+        elapsed = timer.timeit(loops)
+        if elapsed >= min_time or loops >= 1000000:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    times = [elapsed / loops] + [a_time / loops for a_time in timer.repeat(repeat - 1, loops)]
+    return {"seconds": min(times), "median": statistics.median(times), "loops": loops}
+
+
+def key_for(name, sizes):
+    return name + "[" + ",".join(a_size + "=" + str(a_value) for a_size, a_value in sizes.items()) + "]"
+
+
+def run_benchmarks(rows=row_sizes, tickers=ticker_counts, pattern=None, max_bytes=2 * 10**9, verbose=True):
+    """
+    Run every registered case over the sizes it depends on.
+
+    Returns:
+        dict: environment (python, platform, library versions) and results (case[sizes] -> seconds per call).
+    """
+    results = {}
+    saved_config = copy.deepcopy(config)
+    working_directory = os.getcwd()
+    directory = tempfile.TemporaryDirectory()
+
+    try:
+        os.chdir(directory.name)  # in case something writes to the working directory
+        for a_name, (a_setup, a_depends_on) in cases.items():
+            if pattern and pattern not in a_name:
+                continue
+
+            for a_rows in rows if "rows" in a_depends_on else [default_rows]:
+                for a_tickers in tickers if "tickers" in a_depends_on else [1]:
+                    sizes = {}
+                    if "rows" in a_depends_on:
+                        sizes["rows"] = a_rows
+                    if "tickers" in a_depends_on:
+                        sizes["tickers"] = a_tickers
+                    key = key_for(a_name, sizes)
+
+                    if store_bytes(a_rows, a_tickers) > max_bytes:
+                        if verbose:
+                            print(key + ": skipped (more than " + str(max_bytes) + " bytes of price data)")
+                        continue
+
+                    pairs = tickers_for(a_tickers)
+                    config.update(
+                        {
+                            "ticker_list": pairs,
+                            "trades_enabled": False,
+                            "debug_enabled": False,
+                            "save_charts": False,
+                        }
+                    )
+
+                    with open(os.devnull, "w") as output, contextlib.redirect_stdout(output):
+                        function = a_setup(a_rows, list(pairs.values()), os.path.join(directory.name, key))
+                        results[key] = dict(measure(function), case=a_name, **sizes)
+
+                    if verbose:
+                        print(key + ": " + format_seconds(results[key]["seconds"]))
+    finally:
+        os.chdir(working_directory)
+        config.clear()
+        config.update(saved_config)
+        directory.cleanup()
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "date": datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+
+
+def format_seconds(seconds):
+    if seconds >= 1:
+        return str(round(seconds, 3)) + " s"
+    if seconds >= 1e-3:
+        return str(round(seconds * 1e3, 3)) + " ms"
+    return str(round(seconds * 1e6, 3)) + " us"
+
+
+def over_budget(current):
+    # Keys of the cases slower than their budget, whatever the baseline
+    return [
+        a_key
+        for a_key, a_result in current["results"].items()
+        if a_result["case"] in budgets and a_result["seconds"] > budgets[a_result["case"]]
+    ]
+
+
+def compare(baseline, current, tolerance=0.25):
+    """
+    Compare two runs case by case.
+
+    Returns:
+        list: keys of the cases that are more than tolerance (as a fraction) slower than the baseline.
+    """
+    regressions = []
+    for a_key, a_result in current["results"].items():
+        if a_key not in baseline["results"]:
+            continue
+
+        ratio = a_result["seconds"] / baseline["results"][a_key]["seconds"]
+        status = "slower" if ratio > 1 + tolerance else "faster" if ratio < 1 - tolerance else "same"
+        if status == "slower":
+            regressions.append(a_key)
+
+        print(
+            a_key
+            + ": "
+            + format_seconds(baseline["results"][a_key]["seconds"])
+            + " -> "
+            + format_seconds(a_result["seconds"])
+            + " (x"
+            + str(round(ratio, 2))
+            + ", "
+            + status
+            + ")"
+        )
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the per-tick hot paths of the bot.")
+    parser.add_argument("--quick", action="store_true", help="fewer sizes (rows: 100, 10000; tickers: 1, 100)")
+    parser.add_argument("--filter", help="only run the cases whose name contains this text")
+    parser.add_argument("--max-bytes", type=float, default=2e9, help="skip sizes needing more price data than this")
+    parser.add_argument("--save", help="save the results as a baseline in this JSON file")
+    parser.add_argument("--compare", help="compare the results with the baseline in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="slowdown allowed by --compare (default: 0.25)")
+    arguments = parser.parse_args()
+
+    current = run_benchmarks(
+        quick_row_sizes if arguments.quick else row_sizes,
+        quick_ticker_counts if arguments.quick else ticker_counts,
+        arguments.filter,
+        arguments.max_bytes,
+    )
+
+    over = over_budget(current)
+    for a_key in over:
+        print(a_key + ": over its budget of " + format_seconds(budgets[current["results"][a_key]["case"]]))
+
+    if arguments.save:
+        with open(arguments.save, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            baseline = json.load(f)
+
+        print("-- Compared with " + arguments.compare + " (" + baseline["environment"]["date"] + ") ---------")
+        regressions = compare(baseline, current, arguments.tolerance)
+        if len(regressions) > 0:
+            print(str(len(regressions)) + " regression(s): " + ", ".join(regressions))
+            sys.exit(1)
+
+    if len(over) > 0:
+        sys.exit(1)
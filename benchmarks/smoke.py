@@ -0,0 +1,119 @@
+#!/usr/bin/python3 -u
+
+# Sherwood smoke check
+# Runs every mode of cli.py against the stand-ins, in this process: live, paper and collect are built
+# (python3 cli.py --init-only <mode>, which logs in and loads the prices) and dropped before their first tick,
+# backtest and paper --replay run in full over a short generated price file.
+# Run from the repository root: python3 -m benchmarks.smoke
+# (exit code 1 if any mode fails)
+
+import argparse
+import contextlib
+import copy
+import os
+import tempfile
+import traceback
+import numpy as np
+import pandas as pd
+from config import config
+import cli
+from benchmarks.standins import installed, kraken_standin, market, robinhood_standin, tradingview_standin
+
+checks = {
+    "live": ["--init-only", "live"],
+    "paper": ["--init-only", "paper"],
+    "paper --replay": ["paper", "--replay", "prices.csv"],
+    "collect": ["--init-only", "collect"],
+    "backtest": ["backtest", "prices.csv"],
+}
+
+
+def close(built):
+    # What the mode opened (history, journal) is closed before the next one starts
+    if built is None:
+        return
+    if hasattr(built, "close"):
+        built.close()  # paper_trader also puts the Robinhood client back
+        return
+    for a_name in ("history", "journal"):
+        if getattr(built, a_name, None) is not None:
+            getattr(built, a_name).close()
+
+
+def run_checks(tickers=3, rows=300, verbose=False):
+    """
+    Returns:
+        dict: mode -> None if it worked, the traceback otherwise.
+    """
+    pairs = {"XT%03dZUSD" % i: "T%03d" % i for i in range(tickers)}
+    prices = market(list(pairs.values()), seed=0)
+    robinhood = robinhood_standin(prices)
+    kraken = kraken_standin(prices, pairs).start()
+    tradingview = tradingview_standin(prices)
+
+    saved_config = copy.deepcopy(config)
+    directory = tempfile.TemporaryDirectory()
+    working_directory = os.getcwd()
+    output = None if verbose else open(os.devnull, "w")
+    results = {}
+
+    try:
+        os.chdir(directory.name)
+
+        # A random walk for the modes that replay a file
+        random = np.random.default_rng(0)
+        history = {"timestamp": 1700000000 + 900 * np.arange(rows)}
+        for a_ticker in pairs.values():
+            history[a_ticker] = 100 * np.exp(np.cumsum(random.normal(0, 0.01, rows)))
+        pd.DataFrame(history).to_csv("prices.csv", index=False)
+
+        with installed(robinhood, kraken, tradingview), contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+            for a_name, a_arguments in checks.items():
+                config.clear()
+                config.update(copy.deepcopy(saved_config))
+                config.update(
+                    {
+                        "username": "smoke",
+                        "password": "smoke",
+                        "trades_enabled": True,
+                        "debug_enabled": False,
+                        "ticker_list": pairs,
+                        "save_charts": False,
+                        "history_dir": a_name.replace(" --", "_") + "_history",
+                        "orders_journal": a_name.replace(" --", "_") + ".journal",
+                    }
+                )
+                try:
+                    close(cli.main(a_arguments))
+                    results[a_name] = None
+                except BaseException:  # the bot calls exit() when it can't start
+                    results[a_name] = traceback.format_exc()
+    finally:
+        os.chdir(working_directory)
+        config.clear()
+        config.update(saved_config)
+        kraken.stop()
+        directory.cleanup()
+        if output:
+            output.close()
+
+    return results
+
+
+def print_results(results):
+    print("-- Smoke check ---------------------------")
+    for a_name, a_error in results.items():
+        print(a_name.ljust(16) + ("ok" if a_error is None else "FAILED"))
+        if a_error is not None:
+            print(a_error)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that every mode of cli.py starts, against the stand-ins.")
+    parser.add_argument("--verbose", action="store_true", help="show what the bot prints")
+    arguments = parser.parse_args()
+
+    results = run_checks(verbose=arguments.verbose)
+    print_results(results)
+    if any(a_error is not None for a_error in results.values()):
+        exit(1)
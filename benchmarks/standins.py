@@ -0,0 +1,608 @@
+import asyncio
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+
+class service_error(Exception):
+    # A request the stand-in decided to fail (what a 5xx or a dropped connection looks like to the bot)
+    pass
+
+
+class rate_limited(service_error):
+    pass
+
+
+class fault_profile:
+    """
+    How a stand-in service behaves: how long each call takes, how often it fails and how many calls per second
+    it accepts. Every call is counted per endpoint.
+
+    Args:
+        latency (float, optional): median response time in seconds. Defaults to 0.
+        jitter (float, optional): spread of the response time (sigma of a log-normal distribution around the
+            median); 0 means every call takes exactly latency seconds. Defaults to 0.
+        error_rate (float, optional): probability that a call fails. Defaults to 0.
+        rate_limit (float, optional): calls per second accepted (token bucket, bursts up to the same number of
+            calls); None for no limit. Defaults to None.
+        seed (int, optional): seed for the random numbers, to make runs reproducible.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.enabled = True  # faults and latency only apply while enabled (e.g. not during the bot's startup)
+        self.random = random.Random(seed)
+        self.tokens = rate_limit or 0.0
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.errors = {}
+        self.limited = {}
+
+    def delay(self):
+        if self.latency <= 0:
+            return 0.0
+
+        if self.jitter <= 0:
+            return self.latency
+
+        return self.latency * math.exp(self.random.gauss(0.0, self.jitter))
+
+    def call(self, endpoint):
+        """
+        Called at the start of every request to the stand-in: waits for the simulated latency, then raises
+        rate_limited or service_error if the call must fail.
+        """
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            if not self.enabled:
+                return
+
+            delay = self.delay()
+            failed = self.random.random() < self.error_rate
+            limited = False
+            if self.rate_limit:
+                now = time.monotonic()
+                self.tokens = min(self.rate_limit, self.tokens + (now - self.last_refill) * self.rate_limit)
+                self.last_refill = now
+                if self.tokens < 1.0:
+                    limited = True
+                else:
+                    self.tokens -= 1.0
+
+            if limited:
+                self.limited[endpoint] = self.limited.get(endpoint, 0) + 1
+            elif failed:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+        if delay > 0:
+            time.sleep(delay)
+
+        if limited:
+            raise rate_limited(endpoint + ": rate limit exceeded")
+        if failed:
+            raise service_error(endpoint + ": service unavailable")
+
+    def stats(self):
+        with self.lock:
+            return {
+                a_endpoint: {
+                    "calls": self.calls[a_endpoint],
+                    "errors": self.errors.get(a_endpoint, 0),
+                    "rate_limited": self.limited.get(a_endpoint, 0),
+                }
+                for a_endpoint in self.calls
+            }
+
+
+class market:
+    """
+    Prices shared by the stand-in services: a geometric random walk for each ticker, advanced by step(). With a
+    freeze_rate, a ticker sometimes stops moving for freeze_ticks steps, the way Kraken freezes the values it
+    returns when its API is overloaded.
+
+    Args:
+        tickers (list): Robinhood tickers, e.g. ['BTC', 'ETH'].
+        volatility (float, optional): standard deviation of the log return at each step. Defaults to 0.01.
+        spread (float, optional): bid/ask spread, as a fraction of the price. Defaults to 0.001.
+        freeze_rate (float, optional): probability that a ticker freezes at each step. Defaults to 0.
+        freeze_ticks (int, optional): steps a frozen ticker stays frozen. Defaults to 3.
+        seed (int, optional): seed for the random numbers.
+    """
+
+    def __init__(self, tickers, volatility=0.01, spread=0.001, freeze_rate=0.0, freeze_ticks=3, seed=None):
+        self.random = random.Random(seed)
+        self.volatility = volatility
+        self.spread = spread
+        self.freeze_rate = freeze_rate
+        self.freeze_ticks = freeze_ticks
+        self.prices = {a_ticker: self.random.uniform(1.0, 1000.0) for a_ticker in tickers}
+        self.frozen = {a_ticker: 0 for a_ticker in tickers}  # steps left for each frozen ticker
+
+    def step(self):
+        for a_ticker in self.prices:
+            if self.frozen[a_ticker] > 0:
+                self.frozen[a_ticker] -= 1
+            elif self.freeze_rate > 0 and self.random.random() < self.freeze_rate:
+                self.frozen[a_ticker] = self.freeze_ticks
+            else:
+                self.prices[a_ticker] *= math.exp(self.random.gauss(0.0, self.volatility))
+
+    def quote(self, ticker):
+        # (bid, ask, mark)
+        price = self.prices[ticker]
+        return price * (1 - self.spread / 2), price * (1 + self.spread / 2), price
+
+
+class kraken_standin:
+    """
+    Local HTTP server answering like Kraken's public Ticker endpoint (GET /0/public/Ticker?pair=A,B). Point
+    kraken_feed.url at its url. Failed calls get the error list Kraken would send, and like Kraken a request
+    with a pair it doesn't know fails as a whole.
+
+    Args:
+        prices (market): where the prices come from.
+        pairs (dict): Kraken pair -> Robinhood ticker, like config['ticker_list'].
+        faults (fault_profile, optional): latency and errors. Defaults to none.
+        port (int, optional): port on 127.0.0.1; 0 picks a free one. Defaults to 0.
+    """
+
+    def __init__(self, prices, pairs, faults=None, port=0):
+        self.prices = prices
+        self.pairs = dict(pairs)
+        self.faults = faults or fault_profile()
+        standin = self
+
+        class handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+            def do_GET(self):
+                standin.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1]) + "/0/public/Ticker"
+        self.asset_pairs_url = "http://127.0.0.1:" + str(self.server.server_address[1]) + "/0/public/AssetPairs"
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, request):
+        query = parse_qs(urlparse(request.path).query)
+        try:
+            if urlparse(request.path).path.endswith("AssetPairs"):
+                self.faults.call("AssetPairs")
+                result = {
+                    a_pair: {"wsname": self.pairs[a_pair] + "/USD"}
+                    for a_pair in query.get("pair", [""])[0].split(",")
+                    if a_pair in self.pairs
+                }
+                body = {"error": [], "result": result}
+                self.respond(request, body)
+                return
+
+            self.faults.call("Ticker")
+            requested = query.get("pair", [""])[0].split(",")
+            if any(a_pair not in self.pairs for a_pair in requested):
+                self.respond(request, {"error": ["EQuery:Unknown asset pair"]})
+                return
+
+            result = {}
+            for a_pair in requested:
+                bid, ask, mark = self.prices.quote(self.pairs[a_pair])
+                result[a_pair] = {
+                    "a": [str(ask), "1", "1.000"],
+                    "b": [str(bid), "1", "1.000"],
+                    "c": [str(mark), "0.10000000"],
+                }
+            body = {"error": [], "result": result}
+        except rate_limited:
+            body = {"error": ["EAPI:Rate limit exceeded"]}
+        except service_error:
+            body = {"error": ["EService:Unavailable"]}
+
+        self.respond(request, body)
+
+    def respond(self, request, body):
+        payload = json.dumps(body).encode()
+        request.send_response(200)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
+
+
+class kraken_ws_standin:
+    """
+    Kraken's WebSocket API (ticker channel) on 127.0.0.1: after a subscription, the bid/ask of each subscribed
+    pair is pushed whenever it changed, checked every `period` seconds, with heartbeats in between. Pairs are
+    named like the AssetPairs answer of kraken_standin ('T000/USD'). Each push goes through the fault profile,
+    and a failed one drops the connection, like a network error would. Point market_data.kraken_stream.url at
+    its url.
+
+    Args:
+        prices (market): where the prices come from.
+        faults (fault_profile, optional): latency and dropped connections. Defaults to none.
+        period (float, optional): seconds between two checks of the prices. Defaults to 0.05.
+        port (int, optional): port on 127.0.0.1; 0 picks a free one. Defaults to 0.
+    """
+
+    def __init__(self, prices, faults=None, period=0.05, port=0):
+        self.prices = prices
+        self.faults = faults or fault_profile()
+        self.period = period
+        self.port = port
+        self.url = None
+        self.connections = set()
+        self.subscriptions = 0
+        self.ready = threading.Event()
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=asyncio.run, args=(self.serve(),), daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stopped.set)
+        self.thread.join()
+
+    def drop(self):
+        # Close every connection, the client has to reconnect and resubscribe
+        for a_connection in list(self.connections):
+            asyncio.run_coroutine_threadsafe(a_connection.close(), self.loop)
+
+    async def serve(self):
+        import websockets
+
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        async with websockets.serve(self.handle, "127.0.0.1", self.port) as server:
+            self.url = "ws://127.0.0.1:" + str(list(server.sockets)[0].getsockname()[1])
+            self.ready.set()
+            await self.stopped.wait()
+
+    async def handle(self, connection):
+        self.connections.add(connection)
+        try:
+            await connection.send(json.dumps({"event": "systemStatus", "status": "online"}))
+            subscribed = {}  # name -> channel id
+            sent = {}  # name -> (bid, ask) last pushed
+            while True:
+                try:
+                    message = json.loads(await asyncio.wait_for(connection.recv(), self.period))
+                    if message.get("event") == "subscribe":
+                        self.subscriptions += 1
+                        for a_name in message["pair"]:
+                            subscribed[a_name] = len(subscribed) + 1
+                            await connection.send(
+                                json.dumps(
+                                    {
+                                        "event": "subscriptionStatus",
+                                        "status": "subscribed",
+                                        "pair": a_name,
+                                        "channelID": subscribed[a_name],
+                                        "subscription": {"name": "ticker"},
+                                    }
+                                )
+                            )
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+
+                pushed = False
+                for a_name, a_channel in subscribed.items():
+                    bid, ask, mark = self.prices.quote(a_name.split("/")[0])
+                    if sent.get(a_name) == (bid, ask):
+                        continue
+
+                    await asyncio.to_thread(self.faults.call, "ticker")
+                    sent[a_name] = (bid, ask)
+                    pushed = True
+                    await connection.send(
+                        json.dumps(
+                            [
+                                a_channel,
+                                {"a": [str(ask), 1, "1.000"], "b": [str(bid), 1, "1.000"], "c": [str(mark), "0.1"]},
+                                "ticker",
+                                a_name,
+                            ]
+                        )
+                    )
+                if not pushed:
+                    await connection.send(json.dumps({"event": "heartbeat"}))
+        except Exception:
+            pass  # a failed push or a closed connection ends it
+        finally:
+            self.connections.discard(connection)
+            await connection.close()
+
+
+class robinhood_standin:
+    """
+    In-process replacement for the robin_stocks.robinhood module, with the functions Sherwood calls (login,
+    get_crypto_info, get_crypto_quote, get_crypto_positions, order_crypto, order_buy_crypto_limit,
+    order_sell_crypto_limit, get_all_open_crypto_orders, get_crypto_order_info, cancel_crypto_order,
+    account.load_phoenix_account).
+    Market orders fill right away; limit orders stay open until match() finds the market price has reached
+    them. Orders Robinhood would reject (not enough buying power or coins) get the same kind of answer.
+
+    Args:
+        prices (market): where the quotes come from.
+        faults (fault_profile, optional): latency, errors and rate limit. Defaults to none.
+        cash (float, optional): starting buying power. Defaults to 100000.
+        increment (float, optional): price and quantity increment of every coin. Defaults to 0.0001.
+    """
+
+    def __init__(self, prices, faults=None, cash=100000.0, increment=0.0001):
+        self.prices = prices
+        self.faults = faults or fault_profile()
+        self.cash = cash
+        self.increment = increment
+        self.holdings = {}  # ticker -> quantity
+        self.open_orders = {}  # order id -> order
+        self.book = {}  # order id -> order, every order accepted (open, filled or cancelled)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+        # robin_stocks exposes some of these through submodules
+        self.orders = self
+        self.account = SimpleNamespace(load_phoenix_account=self.load_phoenix_account)
+
+    def login(self, username=None, password=None, *args, **kwargs):
+        self.faults.call("login")
+        return {"access_token": "standin", "token_type": "Bearer", "detail": "logged in"}
+
+    def get_crypto_info(self, symbol, info=None):
+        self.faults.call("get_crypto_info")
+        return {
+            "symbol": symbol + "-USD",
+            "min_order_quantity_increment": str(self.increment),
+            "min_order_price_increment": str(self.increment),
+        }
+
+    def get_crypto_quote(self, symbol, info=None):
+        self.faults.call("get_crypto_quote")
+        bid, ask, mark = self.prices.quote(symbol)
+        return {
+            "symbol": symbol + "USD",
+            "bid_price": str(bid),
+            "ask_price": str(ask),
+            "mark_price": str(mark),
+        }
+
+    def get_crypto_positions(self, info=None):
+        self.faults.call("get_crypto_positions")
+        with self.lock:
+            return [
+                {
+                    "account_id": "standin",
+                    "cost_bases": [],
+                    "currency": {"code": a_ticker, "name": a_ticker},
+                    "id": "position-" + a_ticker,
+                    "quantity": str(a_quantity),
+                    "quantity_available": str(a_quantity),
+                    "updated_at": datetime.now().isoformat(),
+                }
+                # Like Robinhood, coins the account has held before are listed even when the quantity is 0
+                for a_ticker, a_quantity in (
+                    (a_ticker, self.holdings.get(a_ticker, 0.0)) for a_ticker in self.prices.prices
+                )
+            ]
+
+    def load_phoenix_account(self, info=None):
+        self.faults.call("load_phoenix_account")
+        return {"crypto_buying_power": {"amount": str(round(self.cash, 2)), "currency_code": "USD"}}
+
+    def order_crypto(
+        self, symbol, side, quantityOrPrice, amountIn="quantity", limitPrice=None, timeInForce="gtc", jsonify=True
+    ):
+        self.faults.call("order_crypto")
+        bid, ask, mark = self.prices.quote(symbol)
+        price = float(limitPrice) if limitPrice else (ask if side == "buy" else bid)
+        quantity = float(quantityOrPrice) / price if amountIn == "price" else float(quantityOrPrice)
+        quantity = math.floor(quantity / self.increment) * self.increment
+
+        with self.lock:
+            if quantity <= 0:
+                return {"non_field_errors": ["Order quantity has to be above zero."]}
+            if side == "buy" and quantity * price > self.cash:
+                return {"non_field_errors": ["Insufficient buying power."]}
+            if side == "sell" and quantity > self.holdings.get(symbol, 0.0) + 1e-12:
+                return {"non_field_errors": ["Insufficient holdings."]}
+
+            order = {
+                "id": "standin-" + str(next(self.ids)),
+                "symbol": symbol,
+                "side": side,
+                "type": "limit" if limitPrice else "market",
+                "time_in_force": timeInForce,
+                "quantity": str(quantity),
+                "price": str(price),
+                "state": "confirmed",
+                "created_at": datetime.now().isoformat(),
+            }
+
+            # Buying power and coins are held as soon as the order is accepted
+            if side == "buy":
+                self.cash -= quantity * price
+            else:
+                self.holdings[symbol] = self.holdings.get(symbol, 0.0) - quantity
+
+            self.book[order["id"]] = order
+            if limitPrice:
+                self.open_orders[order["id"]] = order
+            else:
+                self.fill(order)
+
+            return dict(order)
+
+    def order_buy_crypto_limit(self, symbol, quantity, limitPrice, timeInForce="gtc", jsonify=True):
+        return self.order_crypto(symbol, "buy", quantity, "quantity", limitPrice, timeInForce)
+
+    def order_sell_crypto_limit(self, symbol, quantity, limitPrice, timeInForce="gtc", jsonify=True):
+        return self.order_crypto(symbol, "sell", quantity, "quantity", limitPrice, timeInForce)
+
+    def get_all_open_crypto_orders(self, info=None):
+        self.faults.call("get_all_open_crypto_orders")
+        with self.lock:
+            return [dict(a_order) for a_order in self.open_orders.values()]
+
+    def get_crypto_order_info(self, order_id):
+        self.faults.call("get_crypto_order_info")
+        with self.lock:
+            order = self.book.get(order_id)
+            return dict(order) if order is not None else {"detail": "Not found."}
+
+    def cancel_crypto_order(self, orderID):
+        self.faults.call("cancel_crypto_order")
+        with self.lock:
+            order = self.open_orders.pop(orderID, None)
+            if order is not None:
+                # Release what the order was holding
+                if order["side"] == "buy":
+                    self.cash += float(order["quantity"]) * float(order["price"])
+                else:
+                    self.holdings[order["symbol"]] += float(order["quantity"])
+                order["state"] = "canceled"
+
+        return {}
+
+    def fill(self, order):
+        if order["side"] == "buy":
+            self.holdings[order["symbol"]] = self.holdings.get(order["symbol"], 0.0) + float(order["quantity"])
+        else:
+            self.cash += float(order["quantity"]) * float(order["price"])
+        order["state"] = "filled"
+
+    def match(self):
+        """
+        Fill the open limit orders the current prices have reached (call it after every market step).
+        """
+        with self.lock:
+            for a_id, a_order in list(self.open_orders.items()):
+                bid, ask, mark = self.prices.quote(a_order["symbol"])
+                if (a_order["side"] == "buy" and ask <= float(a_order["price"])) or (
+                    a_order["side"] == "sell" and bid >= float(a_order["price"])
+                ):
+                    self.fill(self.open_orders.pop(a_id))
+
+
+class tradingview_standin:
+    """
+    Replacement for tradingview_ta's TA_Handler and get_multiple_analysis. Each analysis gets a random summary
+    (how many indicators say buy, sell or neutral) and a few indicators based on the market price.
+
+    Args:
+        prices (market): where the prices come from.
+        faults (fault_profile, optional): latency, errors and rate limit. Defaults to none.
+        seed (int, optional): seed for the random numbers.
+    """
+
+    def __init__(self, prices, faults=None, seed=None):
+        self.prices = prices
+        self.faults = faults or fault_profile()
+        self.random = random.Random(seed)
+        standin = self
+
+        class handler:
+            def __init__(self, symbol="", exchange="", screener="", interval="", timeout=None, **kwargs):
+                self.symbol = symbol
+                self.exchange = exchange
+                self.screener = screener
+                self.interval = interval
+
+            def get_analysis(self):
+                standin.faults.call("get_analysis")
+                return standin.analysis(self.symbol, self.exchange, self.screener, self.interval)
+
+        self.TA_Handler = handler
+
+    def analysis(self, symbol, exchange, screener, interval):
+        buy = self.random.randint(0, 26)
+        sell = self.random.randint(0, 26 - buy)
+        ticker = symbol.upper()[:-3] if symbol.upper().endswith("USD") else symbol.upper()
+        price = self.prices.prices.get(ticker, 0.0)
+        return SimpleNamespace(
+            symbol=symbol,
+            exchange=exchange,
+            screener=screener,
+            interval=interval,
+            time=datetime.now(),
+            summary={
+                "RECOMMENDATION": "BUY" if buy > sell else "SELL" if sell > buy else "NEUTRAL",
+                "BUY": buy,
+                "SELL": sell,
+                "NEUTRAL": 26 - buy - sell,
+            },
+            indicators={"close": price, "RSI": self.random.uniform(0, 100), "SMA20": price, "EMA20": price},
+        )
+
+    def get_multiple_analysis(self, screener, interval, symbols, additional_indicators=None, timeout=None):
+        self.faults.call("get_multiple_analysis")
+        analyses = {}
+        for a_symbol in symbols:
+            exchange, symbol = a_symbol.split(":")
+            analyses[a_symbol.upper()] = self.analysis(symbol, exchange, screener, interval)
+
+        return analyses
+
+
+@contextmanager
+def installed(robinhood=None, kraken=None, tradingview=None, kraken_ws=None):
+    """
+    Point Sherwood at the stand-ins inside the with block: robin_stocks calls go to robinhood, Kraken requests
+    to the kraken server (and the streaming mode to kraken_ws) and TradingView lookups to tradingview.
+    Everything is put back afterwards.
+    """
+    import market_data
+    import sherwood
+    import tradingview_ta
+    from tradingview_cache import tradingview_cache
+
+    saved = []
+
+    def patch(owner, name, value):
+        saved.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, value)
+
+    if robinhood is not None:
+        patch(sherwood, "r", robinhood)
+    if kraken is not None:
+        patch(market_data.kraken_feed, "url", kraken.url)
+        patch(market_data.kraken_stream, "asset_pairs_url", kraken.asset_pairs_url)
+    if kraken_ws is not None:
+        patch(market_data.kraken_stream, "url", kraken_ws.url)
+    if tradingview is not None:
+        patch(tradingview_ta, "TA_Handler", tradingview.TA_Handler)
+        patch(tradingview_ta, "get_multiple_analysis", tradingview.get_multiple_analysis)
+        tradingview_cache.clear()
+
+    try:
+        yield
+    finally:
+        for owner, name, value in reversed(saved):
+            setattr(owner, name, value)
@@ -0,0 +1,127 @@
+#!/usr/bin/python3 -u
+
+# Sherwood startup benchmark
+# Times a fresh process importing what each mode of cli.py needs (python3 cli.py --startup-only <mode>) and a few
+# modules on their own, and lists the slowest imports and the heavy dependencies that got loaded.
+# Run from the repository root: python3 -m benchmarks.startup --max-seconds 1
+# (exit code 1 if the collect or backtest mode takes longer than --max-seconds to start)
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+heavy_modules = ("pandas", "matplotlib", "robin_stocks", "tradingview_ta", "requests", "websockets")
+lean_modes = ("collect", "backtest")  # the modes that must start quickly
+
+commands = {
+    "python": ["-c", "pass"],  # the interpreter alone, for reference
+    "import config": ["-c", "import config"],
+    "import signals": ["-c", "import signals"],
+    "import sherwood": ["-c", "import sherwood"],
+}
+for a_mode in ("live", "paper", "collect", "backtest"):
+    commands["cli " + a_mode] = ["cli.py", "--startup-only", a_mode]
+
+
+def wall_time(arguments):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + arguments, cwd=root, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def import_profile(arguments, top=5):
+    """
+    Run once with -X importtime.
+
+    Returns:
+        tuple: (slowest top-level imports as (module, seconds), heavy modules imported)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + arguments,
+        cwd=root,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    # Lines look like "import time:       225 |       1234 |   package.module", nested imports are indented
+    top_level = []
+    imported = set()
+    for a_line in result.stderr.splitlines():
+        if not a_line.startswith("import time:") or "|" not in a_line:
+            continue
+
+        fields = a_line[len("import time:") :].split("|")
+        if not fields[1].strip().isdigit():
+            continue  # header
+
+        name = fields[2].rstrip()
+        imported.add(name.strip().split(".")[0])
+        if not name.startswith("  "):
+            top_level.append((name.strip(), int(fields[1]) / 1e6))
+
+    slowest = sorted(top_level, key=lambda item: -item[1])[:top]
+    return slowest, sorted(a_module for a_module in heavy_modules if a_module in imported)
+
+
+def run_benchmark(repeat=5):
+    """
+    Returns:
+        dict: command -> median, min and max seconds of a fresh process, slowest imports and heavy modules loaded.
+    """
+    results = {}
+    for a_name, a_arguments in commands.items():
+        wall_time(a_arguments)  # warm up the file system cache and the bytecode
+        samples = [wall_time(a_arguments) for i in range(repeat)]
+        slowest, heavy = import_profile(a_arguments)
+        results[a_name] = {
+            "median_s": statistics.median(samples),
+            "min_s": min(samples),
+            "max_s": max(samples),
+            "slowest_imports": slowest,
+            "heavy_modules": heavy,
+        }
+
+    return results
+
+
+def print_results(results):
+    print("-- Startup benchmark --------------------")
+    for a_name, a_result in results.items():
+        print(
+            a_name.ljust(16)
+            + str(round(a_result["median_s"] * 1000)).rjust(6)
+            + " ms | heavy: "
+            + (", ".join(a_result["heavy_modules"]) or "none")
+            + " | slowest: "
+            + ", ".join(a_module + " " + str(round(a_seconds * 1000)) + " ms" for a_module, a_seconds in a_result["slowest_imports"][:3])
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time how long each mode of the bot takes to start.")
+    parser.add_argument("--repeat", type=int, default=5, help="processes started per command (default: 5)")
+    parser.add_argument(
+        "--max-seconds", type=float, help="fail if the collect or backtest mode takes longer than this to start"
+    )
+    parser.add_argument("--output", help="save the results to this JSON file")
+    arguments = parser.parse_args()
+
+    results = run_benchmark(arguments.repeat)
+    print_results(results)
+
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if arguments.max_seconds is not None:
+        slow = [a_mode for a_mode in lean_modes if results["cli " + a_mode]["median_s"] > arguments.max_seconds]
+        if len(slow) > 0:
+            print("Slower than " + str(arguments.max_seconds) + " s to start: " + ", ".join(slow))
+            sys.exit(1)
@@ -0,0 +1,186 @@
+#!/usr/bin/python3 -u
+
+# Sherwood streaming benchmark
+# Runs trader.stream against the Kraken WebSocket stand-in, dropping the connection now and then, and reports how
+# long after each bar close the strategies were evaluated.
+# Run from the repository root: python3 -m benchmarks.stream --tickers 50 --bars 10 --bar-seconds 1
+
+import argparse
+import contextlib
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+from config import config
+import sherwood
+from benchmarks.macro import manual_timer, percentiles
+from benchmarks.standins import (
+    fault_profile,
+    installed,
+    kraken_standin,
+    kraken_ws_standin,
+    market,
+    robinhood_standin,
+    tradingview_standin,
+)
+
+
+class streaming_trader(sherwood.trader):
+    bar_lag = []  # seconds between the close of a bar and the end of its evaluation
+    stop_loss_checks = 0
+
+    def run(self, prices=None, now=None):
+        super().run(prices, now)
+        if now is not None:
+            self.bar_lag.append(time.time() - now.timestamp())
+
+    def check_stop_loss(self, ticker):
+        self.stop_loss_checks += 1
+        super().check_stop_loss(ticker)
+
+
+def run_benchmark(tickers=50, bars=10, bar_seconds=1.0, push_period=0.05, drop_every=None, error_rate=0.0, seed=0, verbose=False):
+    """
+    Stream prices to the bot and measure how quickly it reacts.
+
+    Args:
+        tickers (int, optional): number of coins traded. Defaults to 50.
+        bars (int, optional): bars evaluated. Defaults to 10.
+        bar_seconds (float, optional): length of a bar (minutes_between_updates). Defaults to 1.
+        push_period (float, optional): seconds between two price moves (and pushes). Defaults to 0.05.
+        drop_every (float, optional): seconds between two dropped connections. Defaults to never.
+        error_rate (float, optional): probability that a push fails and drops the connection. Defaults to 0.
+        seed (int, optional): seed for the stand-ins. Defaults to 0.
+        verbose (bool, optional): show what the bot prints. Defaults to False.
+
+    Returns:
+        dict: percentiles of the bar lag, price events handled, connections and messages.
+    """
+    pairs = {"XT%03dZUSD" % i: "T%03d" % i for i in range(tickers)}
+    prices = market(list(pairs.values()), seed=seed)
+    robinhood = robinhood_standin(prices)
+    kraken = kraken_standin(prices, pairs).start()
+    kraken_ws = kraken_ws_standin(prices, fault_profile(error_rate=error_rate, seed=seed), period=push_period).start()
+    tradingview = tradingview_standin(prices, seed=seed)
+
+    saved_config = copy.deepcopy(config)
+    saved_timer = sherwood.Timer
+    directory = tempfile.TemporaryDirectory()
+    working_directory = os.getcwd()
+    output = None if verbose else open(os.devnull, "w")
+    is_done = threading.Event()
+
+    def move_prices():
+        # The market keeps moving while the bot streams, the connection drops every drop_every seconds
+        last_drop = time.time()
+        while not is_done.wait(push_period):
+            prices.step()
+            robinhood.match()
+            if drop_every is not None and time.time() - last_drop >= drop_every:
+                kraken_ws.drop()
+                last_drop = time.time()
+
+    try:
+        os.chdir(directory.name)
+        sherwood.Timer = manual_timer
+        config.update(
+            {
+                "username": "benchmark",
+                "password": "benchmark",
+                "trades_enabled": True,
+                "debug_enabled": False,
+                "ticker_list": pairs,
+                "save_charts": False,
+                "minutes_between_updates": bar_seconds / 60,
+                "history_dir": "history",
+                "orders_journal": "orders.journal",
+            }
+        )
+
+        with installed(robinhood, kraken, tradingview, kraken_ws), contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+            bot = streaming_trader()
+            mover = threading.Thread(target=move_prices, daemon=True)
+            mover.start()
+            bot.stream(bars)
+            is_done.set()
+            mover.join()
+            bot.history.close()
+            bot.journal.close()
+
+        results = {
+            "tickers": tickers,
+            "bar_lag": percentiles(bot.bar_lag),
+            "stop_loss_checks": bot.stop_loss_checks,
+            "connections": bot.kraken_stream.connections,
+            "messages": bot.kraken_stream.messages,
+            "subscriptions": kraken_ws.subscriptions,
+        }
+    finally:
+        is_done.set()
+        os.chdir(working_directory)
+        sherwood.Timer = saved_timer
+        config.clear()
+        config.update(saved_config)
+        kraken.stop()
+        kraken_ws.stop()
+        directory.cleanup()
+        if output:
+            output.close()
+
+    return results
+
+
+def print_results(results):
+    print("-- Streaming benchmark (" + str(results["tickers"]) + " tickers) --------------")
+    print(
+        "Bar close to evaluation done: p50 "
+        + str(round(results["bar_lag"]["p50_ms"], 2))
+        + " ms | p99 "
+        + str(round(results["bar_lag"]["p99_ms"], 2))
+        + " ms | max "
+        + str(round(results["bar_lag"]["max_ms"], 2))
+        + " ms ("
+        + str(results["bar_lag"]["count"])
+        + " bars)"
+    )
+    print("Stop-loss checks between bars: " + str(results["stop_loss_checks"]))
+    print(
+        "Connections: "
+        + str(results["connections"])
+        + " | subscriptions: "
+        + str(results["subscriptions"])
+        + " | messages: "
+        + str(results["messages"])
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream prices to the bot from a local Kraken WebSocket stand-in.")
+    parser.add_argument("--tickers", type=int, default=50, help="number of coins (default: 50)")
+    parser.add_argument("--bars", type=int, default=10, help="bars evaluated (default: 10)")
+    parser.add_argument("--bar-seconds", type=float, default=1.0, help="length of a bar in seconds (default: 1)")
+    parser.add_argument("--push-period", type=float, default=0.05, help="seconds between price moves (default: 0.05)")
+    parser.add_argument("--drop-every", type=float, help="drop the connection every this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability that a push drops the connection")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show what the bot prints")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    arguments = parser.parse_args()
+
+    results = run_benchmark(
+        tickers=arguments.tickers,
+        bars=arguments.bars,
+        bar_seconds=arguments.bar_seconds,
+        push_period=arguments.push_period,
+        drop_every=arguments.drop_every,
+        error_rate=arguments.error_rate,
+        seed=arguments.seed,
+        verbose=arguments.verbose,
+    )
+    print_results(results)
+
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import queue
+import numpy as np
+
+
+def downsample(timestamps, series, points):
+    """
+    Reduce a long history to about `points` samples for drawing: the history is split in points / 2 buckets and
+    the highest and lowest price of each bucket are kept (with the other columns at the same rows), so spikes
+    stay visible at screen resolution.
+
+    Args:
+        timestamps (array): epoch seconds, one per row.
+        series (dict): column name -> array; the first column is the one whose extremes are kept.
+        points (int): maximum number of samples returned.
+
+    Returns:
+        tuple: (timestamps, series) with at most `points` rows.
+    """
+    rows = len(timestamps)
+    if rows <= points:
+        return np.array(timestamps), {a_name: np.array(a_values) for a_name, a_values in series.items()}
+
+    buckets = max(1, points // 2)
+    size = rows // buckets
+    first = rows - size * buckets  # the oldest rows that don't fill a bucket are dropped
+    price = np.asarray(list(series.values())[0])[first:].reshape(buckets, size)
+
+    offsets = np.arange(buckets) * size + first
+    lowest = np.argmin(np.where(np.isnan(price), np.inf, price), axis=1) + offsets
+    highest = np.argmax(np.where(np.isnan(price), -np.inf, price), axis=1) + offsets
+    rows = np.unique(np.concatenate([lowest, highest]))
+
+    return np.asarray(timestamps)[rows], {a_name: np.asarray(a_values)[rows] for a_name, a_values in series.items()}
+
+
+def render(ticker, timestamps, series, directory, dpi):
+    import matplotlib
+
+    matplotlib.use("Agg")  # no display needed
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    x = np.asarray(timestamps).astype("datetime64[s]")
+    for a_name, a_values in series.items():
+        ax.plot(x, a_values, label=a_name)
+    ax.legend()
+    fig.autofmt_xdate()
+
+    # Written under a temporary name first, so a chart being viewed is never half-written
+    filename = os.path.join(directory, "chart-" + str(ticker).lower() + "-sma.png")
+    fig.savefig(filename + ".tmp.png", dpi=dpi)
+    plt.close(fig)
+    os.replace(filename + ".tmp.png", filename)
+
+
+def render_loop(requests, directory, dpi):
+    # Runs in the worker process: take everything waiting in the queue, keep only the newest request for each
+    # ticker (a chart that's already out of date isn't worth drawing), then draw them
+    while True:
+        pending = {}
+        request = requests.get()
+        while True:
+            if request is None:
+                for a_request in pending.values():
+                    render(*a_request, directory, dpi)
+                return
+
+            pending[request[0]] = request
+            try:
+                request = requests.get_nowait()
+            except queue.Empty:
+                break
+
+        for a_request in pending.values():
+            try:
+                render(*a_request, directory, dpi)
+            except Exception as e:
+                print("An exception occurred drawing the chart for " + str(a_request[0]) + ": " + str(e))
+
+
+class chart_renderer:
+    """
+    Draws the price/SMA charts in a separate process, so saving them never slows down a tick. submit() only
+    downsamples the data to screen resolution and puts it in a queue; the worker coalesces the requests waiting
+    for the same ticker and renders only the newest one. A chart is only submitted when its data changed.
+
+    Args:
+        directory (str, optional): where the charts are saved. Defaults to the working directory.
+        dpi (int, optional): resolution of the saved images. Defaults to 300.
+        points (int, optional): samples drawn at most; longer histories are downsampled. Defaults to 1920, the
+            width in pixels of a chart at 300 dpi.
+    """
+
+    def __init__(self, directory=".", dpi=300, points=1920):
+        self.points = points
+        self.versions = {}  # ticker -> version of the data last submitted
+        context = multiprocessing.get_context("spawn")  # the bot runs threads, which don't mix well with fork
+        self.requests = context.Queue()
+        self.process = context.Process(
+            target=render_loop, args=(self.requests, directory, dpi), daemon=True
+        )
+        self.process.start()
+
+    def submit(self, ticker, timestamps, series, version=None):
+        """
+        Ask for this ticker's chart to be redrawn.
+
+        Args:
+            ticker (str): used in the file name (chart-<ticker>-sma.png).
+            timestamps (array): epoch seconds.
+            series (dict): column name -> array, one line each; the first one is the price.
+            version (optional): anything that changes when the data changes (e.g. the time of the last sample);
+                nothing is drawn if it's the same as in the previous call for this ticker.
+        """
+        if version is not None and self.versions.get(ticker) == version:
+            return
+
+        self.versions[ticker] = version
+        timestamps, series = downsample(timestamps, series, self.points)
+        self.requests.put((ticker, timestamps, series))
+
+    def close(self):
+        # Draw what's still waiting, then stop the worker
+        self.requests.put(None)
+        self.process.join()
@@ -0,0 +1,150 @@
+#!/usr/bin/python3 -u
+
+# Sherwood command line
+# One entry point for every way of running the bot. Each mode only imports what it uses: collecting prices never
+# loads robin_stocks or tradingview_ta, backtesting doesn't load the trader at all.
+# Run from the repository root: python3 cli.py collect --ticks 10
+
+import argparse
+import time
+from config import config
+
+modes = ("live", "paper", "collect", "backtest")
+
+
+def fill_defaults(defaults):
+    # Settings missing from config.py, as trader.__init__ does
+    for a_key, a_value in defaults.items():
+        if a_key not in config:
+            config[a_key] = a_value
+
+
+def run_live(arguments):
+    """
+    Trade with the settings of config.py: every minutes_between_updates (trader.run), or as soon as each bar closes
+    with --stream (trader.stream). In paper mode, the orders go to a simulated exchange quoted with the live prices
+    (see paper.py), or the whole session is replayed over a price file with --replay.
+    """
+    import sherwood
+
+    if arguments.mode == "paper":
+        import paper
+        from exchange import simulated_exchange
+
+    if arguments.startup_only:
+        return
+
+    if arguments.mode == "paper" and arguments.replay:
+        import backtest
+
+        timestamps, prices = backtest.load_prices(arguments.replay, arguments.ticker)
+        paper.print_results(
+            paper.replay(
+                timestamps, prices, arguments.cash, arguments.fee, arguments.depth, arguments.spread, arguments.verbose
+            )
+        )
+        return
+
+    if arguments.mode == "paper":
+        bot = paper.paper_trader(simulated_exchange(arguments.cash, arguments.fee, arguments.depth), arguments.spread)
+    else:
+        bot = sherwood.trader()
+    if arguments.init_only:
+        return bot
+
+    if arguments.stream:
+        bot.stream(arguments.bars)
+    else:
+        bot.run()  # schedules the next ticks itself
+
+
+def run_collect(arguments):
+    """
+    Only fetch the prices and compute the indicators, into the history on disk (history_dir): no login to
+    Robinhood, no strategy, no order.
+    """
+    import sherwood
+    from market_bus import market_producer
+    from price_store import price_store
+
+    if arguments.startup_only:
+        return
+
+    fill_defaults(sherwood.trader.default_config)
+    producer = market_producer(price_store)
+    if arguments.init_only:
+        return producer
+
+    print("Collecting " + str(len(config["ticker_list"])) + " pairs into " + str(config["history_dir"]))
+
+    try:
+        done = 0
+        interval = config["minutes_between_updates"] * 60
+        while arguments.ticks is None or done < arguments.ticks:
+            # Aligned to the clock, like the other modes
+            time.sleep(interval - time.time() % interval)
+            producer.tick()
+            done += 1
+    finally:
+        producer.history.close()
+
+
+def run_backtest(arguments):
+    """
+    Replay the configured strategies over a price file, see backtest.py for the arguments.
+    """
+    import backtest
+
+    if arguments.startup_only:
+        return
+
+    backtest.main(arguments.arguments)
+
+
+def main(argv=None):
+    """
+    Parse the command line (argv, sys.argv by default) and run the mode it selects.
+
+    Returns:
+        object: with --init-only, the trader (or the producer of the collect mode) built by the mode, None otherwise.
+    """
+    parser = argparse.ArgumentParser(description="Run the Sherwood bot.")
+    parser.add_argument(
+        "--startup-only", action="store_true", help="import what the mode needs and exit (see benchmarks.startup)"
+    )
+    parser.add_argument(
+        "--init-only",
+        action="store_true",
+        help="build the bot (login, prices loaded) and exit before its first tick (see benchmarks.smoke)",
+    )
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    for a_mode, a_help in (("live", "trade with real orders"), ("paper", "trade on a simulated exchange")):
+        a_parser = subparsers.add_parser(a_mode, help=a_help)
+        a_parser.add_argument("--stream", action="store_true", help="stream the prices from Kraken's WebSocket")
+        a_parser.add_argument("--bars", type=int, help="with --stream, stop after this many bars")
+        a_parser.set_defaults(run=run_live)
+
+    # Simulated exchange of the paper mode (a_parser is the last one of the loop)
+    a_parser.add_argument("--replay", help="replay this CSV or Parquet price file instead of the live prices")
+    a_parser.add_argument("--ticker", help="with --replay, ticker of an OHLC file (default: first ticker in config)")
+    a_parser.add_argument("--cash", type=float, default=10000.0, help="starting buying power (default: 10000)")
+    a_parser.add_argument("--fee", type=float, default=0.0, help="fee of each fill, e.g. 0.001 for 0.1%% (default: 0)")
+    a_parser.add_argument("--depth", type=float, help="USD that can fill per coin, side and tick (default: no limit)")
+    a_parser.add_argument("--spread", type=float, default=0.0, help="ask - bid around each price, e.g. 0.002 (default: 0)")
+    a_parser.add_argument("--verbose", action="store_true", help="with --replay, show what the bot prints")
+
+    a_parser = subparsers.add_parser("collect", help="only record the prices and indicators")
+    a_parser.add_argument("--ticks", type=int, help="stop after this many ticks (default: run forever)")
+    a_parser.set_defaults(run=run_collect)
+
+    a_parser = subparsers.add_parser("backtest", help="replay the strategies over a price file")
+    a_parser.add_argument("arguments", nargs=argparse.REMAINDER, help="arguments of backtest.py")
+    a_parser.set_defaults(run=run_backtest)
+
+    arguments = parser.parse_args(argv)
+    return arguments.run(arguments)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+from datetime import datetime, timezone
+import heapq
+import itertools
+from math import floor, inf
+import threading
+import time
+
+# States of an order, as Robinhood reports them
+open_states = ("confirmed", "partially_filled")
+
+
+def is_multiple(value, increment):
+    # Robinhood rejects quantities and prices that aren't a whole number of increments
+    steps = value / increment
+    return abs(steps - round(steps)) <= 1e-6 * max(1.0, abs(steps))
+
+
+class simulated_exchange:
+    """
+    In-process exchange standing in for the part of robin_stocks.robinhood the bot uses (login, get_crypto_info,
+    get_crypto_quote, get_crypto_positions, account.load_phoenix_account, order_crypto, order_buy_crypto_limit,
+    order_sell_crypto_limit, get_all_open_crypto_orders, get_crypto_order_info, cancel_crypto_order), so paper
+    trading goes through the same order lifecycle as live trading: orders are accepted or rejected like Robinhood
+    does (quantity and price increments, buying power, holdings), rest on a book and get filled, in part or
+    entirely, as the quotes move.
+
+    The quotes are pushed with update() or update_prices(), from live prices or from a replayed history. Resting
+    limit orders are kept in one heap per symbol and side (best price first, then oldest first), so a new quote
+    only looks at the orders it crosses; cancelled orders are dropped from the heaps lazily. An order that crosses
+    the quote when it arrives fills at the quote (taker), a resting order fills at its limit price (maker). Market
+    orders are limit orders at the quote plus market_collar. Buying power and coins are held as soon as an order
+    is accepted, and released by fills and cancellations.
+
+    Args:
+        cash (float, optional): starting buying power in USD. Defaults to 10000.
+        fee_rate (float, optional): fee charged on each fill, as a fraction of its value. Defaults to 0.
+        depth (float, optional): USD that can be filled on each side of a symbol for each quote (partial fills);
+            the sizes passed to update() take precedence. Defaults to None, for no limit.
+        increments (dict, optional): symbol -> (quantity increment, price increment). Defaults to
+            default_increments for every symbol.
+        default_increments (tuple, optional): Defaults to (0.0001, 0.0001), like the debug mode of the bot.
+        market_collar (float, optional): how far past the quote a market order may fill. Defaults to 0.01.
+    """
+
+    def __init__(
+        self,
+        cash=10000.0,
+        fee_rate=0.0,
+        depth=None,
+        increments=None,
+        default_increments=(0.0001, 0.0001),
+        market_collar=0.01,
+    ):
+        self.cash = float(cash)  # buying power, what open buy orders hold excluded
+        self.starting_cash = float(cash)
+        self.fee_rate = fee_rate
+        self.depth = depth
+        self.increments = dict(increments or {})
+        self.default_increments = default_increments
+        self.market_collar = market_collar
+        self.holdings = {}  # symbol -> coins available, what open sell orders hold excluded
+        self.quotes = {}  # symbol -> (bid, ask, bid size, ask size)
+        self.book = {}  # order id -> order (every order, open or not)
+        self.open = {}  # order id -> order, only the open ones (what every tick looks at, however long the history)
+        self.bids = {}  # symbol -> heap of (-limit price, sequence, order id)
+        self.asks = {}  # symbol -> heap of (limit price, sequence, order id)
+        self.sequence = itertools.count(1)
+        self.clock = None  # epoch seconds of the last quote when replaying, None to use the system clock
+        self.fills = 0
+        self.partial_fills = 0
+        self.rejections = 0
+        self.volume = 0.0  # USD
+        self.fees = 0.0  # USD
+        self.lock = threading.RLock()  # the trader, the thief loop and the quote feed can call it concurrently
+
+        # robin_stocks exposes some of these functions through submodules
+        self.orders = self
+        self.account = self
+
+    def now(self):
+        return self.clock if self.clock is not None else time.time()
+
+    def timestamp(self):
+        return datetime.fromtimestamp(self.now(), timezone.utc).isoformat()
+
+    def increments_of(self, symbol):
+        return self.increments.get(symbol, self.default_increments)
+
+    # -- Market data -----------------------------------------------------------------------------------------------
+
+    def update(self, symbol, bid, ask=None, timestamp=None, bid_size=None, ask_size=None):
+        """
+        New quote for a symbol: fills the resting orders it crosses.
+
+        Args:
+            symbol (str): e.g. 'BTC'.
+            bid (float): best bid, the price sell orders fill at.
+            ask (float, optional): best ask, the price buy orders fill at. Defaults to the bid.
+            timestamp (float, optional): epoch seconds of the quote, which becomes the exchange's clock. Defaults
+                to None, for the system clock.
+            bid_size (float, optional): coins that can be sold at the bid. Defaults to depth.
+            ask_size (float, optional): coins that can be bought at the ask. Defaults to depth.
+        """
+        bid = float(bid)
+        ask = float(ask) if ask is not None else bid
+        with self.lock:
+            if timestamp is not None:
+                self.clock = float(timestamp)
+            self.quotes[symbol] = (
+                bid,
+                ask,
+                bid_size if bid_size is not None else (self.depth / bid if self.depth else inf),
+                ask_size if ask_size is not None else (self.depth / ask if self.depth else inf),
+            )
+            self.match(symbol)
+
+    def update_prices(self, prices, timestamp=None, spread=0.0):
+        """
+        Quote every symbol around a single price (e.g. what the bot fetched from Kraken, or a row of a history).
+
+        Args:
+            prices (dict): symbol -> price; NaN prices are skipped.
+            spread (float, optional): ask - bid, as a fraction of the price. Defaults to 0.
+        """
+        with self.lock:
+            for a_symbol, a_price in prices.items():
+                if a_price == a_price:  # not NaN
+                    self.update(a_symbol, a_price * (1 - spread / 2), a_price * (1 + spread / 2), timestamp)
+
+    def match(self, symbol):
+        bid, ask, bid_size, ask_size = self.quotes[symbol]
+
+        # Buy orders at or above the ask, then sell orders at or below the bid, best price first
+        for a_heap, a_side, a_liquidity in (
+            (self.bids.get(symbol), "buy", ask_size),
+            (self.asks.get(symbol), "sell", bid_size),
+        ):
+            while a_heap and a_liquidity > 0:
+                key, a_sequence, a_id = a_heap[0]
+                order = self.book[a_id]
+                if order["state"] not in open_states:
+                    heapq.heappop(a_heap)  # filled or cancelled since it was queued
+                    continue
+
+                limit = -key if a_side == "buy" else key
+                if (a_side == "buy" and limit < ask) or (a_side == "sell" and limit > bid):
+                    break
+
+                filled = self.fill(order, min(order["remaining"], a_liquidity), limit)
+                if filled == 0.0:
+                    break  # less than one increment left at this quote
+                a_liquidity -= filled
+                if order["state"] not in open_states:
+                    heapq.heappop(a_heap)
+
+            if a_side == "buy":
+                ask_size = a_liquidity
+            else:
+                bid_size = a_liquidity
+
+        self.quotes[symbol] = (bid, ask, bid_size, ask_size)
+
+    def fill(self, order, quantity, price):
+        """
+        Execute part or all of an order.
+
+        Returns:
+            float: the quantity filled.
+        """
+        quantity_increment = self.increments_of(order["symbol"])[0]
+        if quantity < order["remaining"]:
+            # A partial fill is a whole number of increments
+            quantity = floor(quantity / quantity_increment + 1e-9) * quantity_increment
+            if quantity <= 0:
+                return 0.0
+
+        value = quantity * price
+        fee = value * self.fee_rate
+        if order["side"] == "buy":
+            # What the order held for this quantity, less what it cost
+            self.cash += quantity * order["price"] * (1 + self.fee_rate) - value - fee
+            self.holdings[order["symbol"]] = self.holdings.get(order["symbol"], 0.0) + quantity
+        else:
+            self.cash += value - fee
+
+        order["remaining"] -= quantity
+        if order["remaining"] < quantity_increment / 2:
+            order["remaining"] = 0.0
+        order["cumulative_quantity"] += quantity
+        order["executed_notional"] += value
+        order["fees"] += fee
+        order["executions"].append(
+            {
+                "id": order["id"] + "-" + str(len(order["executions"]) + 1),
+                "price": price,
+                "quantity": quantity,
+                "timestamp": self.timestamp(),
+            }
+        )
+        order["state"] = "filled" if order["remaining"] == 0.0 else "partially_filled"
+        if order["state"] == "filled":
+            del self.open[order["id"]]
+        order["updated_at"] = self.timestamp()
+
+        self.fills += 1
+        if order["state"] == "partially_filled":
+            self.partial_fills += 1
+        self.volume += value
+        self.fees += fee
+        return quantity
+
+    # -- robin_stocks.robinhood ------------------------------------------------------------------------------------
+
+    def login(self, username=None, password=None, *args, **kwargs):
+        return {"access_token": "paper", "token_type": "Bearer", "detail": "logged in"}
+
+    def logout(self):
+        pass
+
+    def get_crypto_info(self, symbol, info=None):
+        quantity_increment, price_increment = self.increments_of(symbol)
+        result = {
+            "symbol": symbol + "-USD",
+            "asset_currency": {"code": symbol, "name": symbol},
+            "min_order_quantity_increment": str(quantity_increment),
+            "min_order_price_increment": str(price_increment),
+            "min_order_size": str(quantity_increment),
+            "tradability": "tradable",
+        }
+        return result[info] if info else result
+
+    def get_crypto_quote(self, symbol, info=None):
+        with self.lock:
+            if symbol not in self.quotes:
+                return {"detail": "Not found."}
+            bid, ask, bid_size, ask_size = self.quotes[symbol]
+
+        result = {
+            "symbol": symbol + "USD",
+            "bid_price": str(bid),
+            "ask_price": str(ask),
+            "mark_price": str((bid + ask) / 2),
+        }
+        return result[info] if info else result
+
+    def get_crypto_positions(self, info=None):
+        with self.lock:
+            # Coins held by open sell orders are part of the position, but not available
+            held = {}
+            for a_order in self.open_orders():
+                if a_order["side"] == "sell":
+                    held[a_order["symbol"]] = held.get(a_order["symbol"], 0.0) + a_order["remaining"]
+
+            positions = [
+                {
+                    "account_id": "paper",
+                    "cost_bases": [],
+                    "currency": {"code": a_symbol, "name": a_symbol},
+                    "id": "position-" + a_symbol,
+                    "quantity": str(self.holdings.get(a_symbol, 0.0) + held.get(a_symbol, 0.0)),
+                    "quantity_available": str(self.holdings.get(a_symbol, 0.0)),
+                    "updated_at": self.timestamp(),
+                }
+                for a_symbol in sorted(set(self.holdings) | set(held))
+            ]
+
+        return [a_position[info] for a_position in positions] if info else positions
+
+    def load_phoenix_account(self, info=None):
+        result = {"crypto_buying_power": {"amount": str(round(self.cash, 2)), "currency_code": "USD"}}
+        return result[info] if info else result
+
+    def order_crypto(
+        self, symbol, side, quantityOrPrice, amountIn="quantity", limitPrice=None, timeInForce="gtc", jsonify=True
+    ):
+        with self.lock:
+            quantity_increment, price_increment = self.increments_of(symbol)
+            quote = self.quotes.get(symbol)
+
+            if limitPrice is not None:
+                price = float(limitPrice)
+                if not is_multiple(price, price_increment):
+                    return self.reject("Price must be a multiple of " + str(price_increment) + ".")
+            elif quote is None:
+                return self.reject("No quote available for " + str(symbol) + ".")
+            elif side == "buy":
+                price = quote[1] * (1 + self.market_collar)
+            else:
+                price = quote[0] * (1 - self.market_collar)
+
+            if amountIn == "price":
+                # Spend (or get) this many dollars, at the quote for a market order
+                reference = price if limitPrice is not None else (quote[1] if side == "buy" else quote[0])
+                quantity = floor(float(quantityOrPrice) / reference / quantity_increment + 1e-9) * quantity_increment
+            else:
+                quantity = float(quantityOrPrice)
+                if not is_multiple(quantity, quantity_increment):
+                    return self.reject("Order quantity must be a multiple of " + str(quantity_increment) + ".")
+
+            if quantity <= 0:
+                return self.reject("Order quantity has to be above zero.")
+            if side == "buy" and quantity * price * (1 + self.fee_rate) > self.cash + 1e-9:
+                return self.reject("Insufficient buying power.")
+            if side == "sell" and quantity > self.holdings.get(symbol, 0.0) + quantity_increment / 2:
+                return self.reject("Insufficient holdings.")
+
+            order = {
+                "id": "paper-" + str(next(self.sequence)),
+                "symbol": symbol,
+                "side": side,
+                "type": "limit" if limitPrice is not None else "market",
+                "time_in_force": timeInForce,
+                "quantity": quantity,
+                "price": price,
+                "remaining": quantity,
+                "cumulative_quantity": 0.0,
+                "executed_notional": 0.0,
+                "fees": 0.0,
+                "executions": [],
+                "state": "confirmed",
+                "created_at": self.timestamp(),
+                "updated_at": self.timestamp(),
+            }
+            self.book[order["id"]] = order
+            self.open[order["id"]] = order
+
+            # Held until the order is filled or cancelled
+            if side == "buy":
+                self.cash -= quantity * price * (1 + self.fee_rate)
+                heapq.heappush(self.bids.setdefault(symbol, []), (-price, next(self.sequence), order["id"]))
+            else:
+                self.holdings[symbol] = self.holdings.get(symbol, 0.0) - quantity
+                heapq.heappush(self.asks.setdefault(symbol, []), (price, next(self.sequence), order["id"]))
+
+            # Crossing the quote: filled right away at the quote, as far as its size allows
+            if quote is not None:
+                bid, ask, bid_size, ask_size = quote
+                if side == "buy" and price >= ask:
+                    ask_size -= self.fill(order, min(quantity, ask_size), ask)
+                elif side == "sell" and price <= bid:
+                    bid_size -= self.fill(order, min(quantity, bid_size), bid)
+                self.quotes[symbol] = (bid, ask, bid_size, ask_size)
+
+            return self.public(order)
+
+    def order_buy_crypto_limit(self, symbol, quantity, limitPrice, timeInForce="gtc", jsonify=True):
+        return self.order_crypto(symbol, "buy", quantity, "quantity", limitPrice, timeInForce)
+
+    def order_sell_crypto_limit(self, symbol, quantity, limitPrice, timeInForce="gtc", jsonify=True):
+        return self.order_crypto(symbol, "sell", quantity, "quantity", limitPrice, timeInForce)
+
+    def open_orders(self):
+        return list(self.open.values())
+
+    def get_all_open_crypto_orders(self, info=None):
+        with self.lock:
+            orders = [self.public(a_order) for a_order in self.open_orders()]
+        return [a_order[info] for a_order in orders] if info else orders
+
+    def get_all_crypto_orders(self, info=None):
+        with self.lock:
+            orders = [self.public(a_order) for a_order in self.book.values()]
+        return [a_order[info] for a_order in orders] if info else orders
+
+    def get_crypto_order_info(self, order_id):
+        with self.lock:
+            order = self.book.get(order_id)
+            return self.public(order) if order is not None else {"detail": "Not found."}
+
+    def cancel_crypto_order(self, orderID):
+        with self.lock:
+            order = self.book.get(orderID)
+            if order is None or order["state"] not in open_states:
+                return {"detail": "Order cannot be canceled."}
+
+            # Release what's left of what the order was holding (it leaves the heap at the next match)
+            if order["side"] == "buy":
+                self.cash += order["remaining"] * order["price"] * (1 + self.fee_rate)
+            else:
+                self.holdings[order["symbol"]] = self.holdings.get(order["symbol"], 0.0) + order["remaining"]
+            order["remaining"] = 0.0
+            order["state"] = "canceled"
+            del self.open[orderID]
+            order["updated_at"] = self.timestamp()
+
+        return {}
+
+    def cancel_all_crypto_orders(self):
+        with self.lock:
+            for a_order in self.open_orders():
+                self.cancel_crypto_order(a_order["id"])
+        return []
+
+    def reject(self, reason):
+        self.rejections += 1
+        return {"non_field_errors": [reason]}
+
+    def public(self, order):
+        # The order as Robinhood returns it: numbers as strings, no internal fields
+        average = order["executed_notional"] / order["cumulative_quantity"] if order["cumulative_quantity"] > 0 else None
+        return {
+            "id": order["id"],
+            "currency_pair_id": order["symbol"] + "-USD",
+            "symbol": order["symbol"],
+            "side": order["side"],
+            "type": order["type"],
+            "time_in_force": order["time_in_force"],
+            "quantity": str(order["quantity"]),
+            "price": str(order["price"]),
+            "cumulative_quantity": str(order["cumulative_quantity"]),
+            "average_price": str(average) if average is not None else None,
+            "rounded_executed_notional": str(round(order["executed_notional"], 2)),
+            "fees": str(order["fees"]),
+            "executions": [
+                {
+                    "id": a_execution["id"],
+                    "effective_price": str(a_execution["price"]),
+                    "quantity": str(a_execution["quantity"]),
+                    "timestamp": a_execution["timestamp"],
+                }
+                for a_execution in order["executions"]
+            ],
+            "state": order["state"],
+            "created_at": order["created_at"],
+            "last_transaction_at": order["updated_at"],
+        }
+
+    # -- Results ---------------------------------------------------------------------------------------------------
+
+    def equity(self):
+        # Cash (held by open buy orders included) plus every coin at its bid
+        with self.lock:
+            value = self.cash
+            for a_order in self.open_orders():
+                if a_order["side"] == "buy":
+                    value += a_order["remaining"] * a_order["price"] * (1 + self.fee_rate)
+                else:
+                    value += a_order["remaining"] * self.quotes.get(a_order["symbol"], (0.0,))[0]
+            for a_symbol, a_quantity in self.holdings.items():
+                value += a_quantity * self.quotes.get(a_symbol, (0.0,))[0]
+            return value
+
+    def stats(self):
+        with self.lock:
+            return {
+                "orders": len(self.book),
+                "open_orders": len(self.open_orders()),
+                "fills": self.fills,
+                "partial_fills": self.partial_fills,
+                "rejections": self.rejections,
+                "volume": self.volume,
+                "fees": self.fees,
+                "cash": self.cash,
+                "equity": self.equity(),
+                "pnl": self.equity() - self.starting_cash,
+            }
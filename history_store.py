@@ -0,0 +1,213 @@
+import json
+import os
+import struct
+import threading
+import numpy as np
+
+
+class history_store:
+    """
+    Append-only, on-disk price history, split in numbered segments inside a directory.
+
+    New rows go to the active segment, a row-major log (NNNNNN.log, with its column list in NNNNNN.json) where
+    each tick costs a single write of one fixed-size record, so disk traffic is O(new rows) instead of O(history).
+    Once a segment holds segment_rows rows it's sealed, and a background thread compacts it into one .npy file
+    per column (directory NNNNNN/) that can be memory-mapped. load() only maps the newest segments it needs,
+    so cold start time depends on the number of rows requested, not on how much history is on disk.
+
+    Args:
+        directory (str): where the segments are stored.
+        columns (list): float columns of each row (the int64 epoch timestamp is always stored first).
+        segment_rows (int, optional): rows per segment before it's sealed and compacted. Defaults to 100000.
+    """
+
+    def __init__(self, directory, columns, segment_rows=100000):
+        self.directory = directory
+        self.columns = list(columns)
+        self.segment_rows = segment_rows
+        self.record = struct.Struct("<q" + "d" * len(self.columns))
+        self.dtype = self.segment_dtype(self.columns)
+        self.compactor = None
+        self.lock = threading.Lock()  # a segment is switched from its log to its directory while load() doesn't map it
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Reopen the newest log if it has the same columns, otherwise start a new segment
+        self.segment = self.segments()[-1] if len(self.segments()) > 0 else 0
+        if self.segment > 0 and self.is_log(self.segment) and self.schema(self.segment) == self.columns:
+            self.file = open(self.path(self.segment, ".log"), "r+b")
+
+            # Drop a partially written record left behind by a crash
+            self.rows = os.path.getsize(self.file.name) // self.record.size
+            self.file.truncate(self.rows * self.record.size)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.open_segment(self.segment + 1)
+
+        self.compact()  # finish compacting segments sealed before a restart
+
+    def path(self, segment, suffix=""):
+        return os.path.join(self.directory, "%06d" % segment + suffix)
+
+    def segments(self):
+        numbers = set()
+        for a_name in os.listdir(self.directory):
+            a_number = a_name.split(".")[0]
+            if a_number.isdigit() and not a_name.endswith(".tmp"):
+                numbers.add(int(a_number))
+
+        return sorted(numbers)
+
+    def is_log(self, segment):
+        return os.path.exists(self.path(segment, ".log")) and not os.path.isdir(self.path(segment))
+
+    def schema(self, segment):
+        with open(self.path(segment, ".json")) as f:
+            return json.load(f)["columns"]
+
+    def open_segment(self, segment):
+        self.segment = segment
+        with open(self.path(segment, ".json"), "w") as f:
+            json.dump({"columns": self.columns}, f)
+
+        self.file = open(self.path(segment, ".log"), "ab")
+        self.rows = 0
+
+    def append(self, timestamp, values):
+        """
+        Write one row at the end of the active segment. Columns missing from values are stored as NaN.
+        """
+        self.file.write(
+            self.record.pack(
+                int(timestamp), *[float(values.get(a_column, np.nan)) for a_column in self.columns]
+            )
+        )
+        self.file.flush()
+        self.rows += 1
+
+        if self.rows >= self.segment_rows:
+            self.seal()
+
+    def append_rows(self, timestamps, values):
+        """
+        Write several rows at once (e.g. when importing an existing history).
+
+        Args:
+            timestamps (array): int64 epoch seconds.
+            values (dict): column name -> array with one value per timestamp.
+        """
+        records = np.empty(len(timestamps), dtype=self.dtype)
+        records["timestamp"] = timestamps
+        for a_column in self.columns:
+            records[a_column] = values.get(a_column, np.nan)
+
+        written = 0
+        while written < len(records):
+            chunk = records[written : written + self.segment_rows - self.rows]
+            self.file.write(chunk.tobytes())
+            self.file.flush()
+            self.rows += len(chunk)
+            written += len(chunk)
+            if self.rows >= self.segment_rows:
+                self.seal()
+
+    def seal(self):
+        self.file.close()
+        self.open_segment(self.segment + 1)
+        self.compact()
+
+    def compact(self):
+        # Runs in the background; one compaction at a time is plenty since segments fill up slowly (a segment
+        # sealed while another one is being compacted is picked up at the next seal, and load() reads logs too)
+        if self.compactor is not None and self.compactor.is_alive():
+            return
+
+        self.compactor = threading.Thread(target=self.compact_segments, daemon=True)
+        self.compactor.start()
+
+    def compact_segments(self):
+        for a_segment in self.segments():
+            if a_segment == self.segment or not os.path.exists(self.path(a_segment, ".log")):
+                continue
+
+            if os.path.isdir(self.path(a_segment)):
+                # Compacted already, the process stopped before the log was removed
+                with self.lock:
+                    os.remove(self.path(a_segment, ".log"))
+                continue
+
+            try:
+                columns = self.schema(a_segment)
+                records = np.fromfile(self.path(a_segment, ".log"), dtype=self.segment_dtype(columns))
+
+                # Write everything to a temporary directory first so a crash can't leave a half-compacted segment
+                temporary = self.path(a_segment, ".tmp")
+                os.makedirs(temporary, exist_ok=True)
+                for a_field in records.dtype.names:
+                    np.save(os.path.join(temporary, a_field + ".npy"), records[a_field])
+
+                with self.lock:
+                    os.rename(temporary, self.path(a_segment))
+                    os.remove(self.path(a_segment, ".log"))
+            except Exception as e:
+                print("An exception occurred compacting history segment " + str(a_segment) + ": " + str(e))
+
+    def segment_dtype(self, columns):
+        return np.dtype([("timestamp", "<i8")] + [(a_column, "<f8") for a_column in columns])
+
+    def load(self, rows):
+        """
+        Memory-map the newest segments and return (at most) the last rows of the history.
+
+        Returns:
+            tuple: (timestamps, values) with an int64 array of epoch seconds and a dict of column -> float array;
+            columns a segment doesn't have are filled with NaN.
+        """
+        parts = []
+        remaining = rows
+        # The compactor may be turning a sealed log into its directory meanwhile: it waits until the segments are
+        # mapped (a mapping outlives the removal of its file)
+        with self.lock:
+            for a_segment in reversed(self.segments()):
+                if remaining <= 0:
+                    break
+
+                columns = self.schema(a_segment)
+                if os.path.isdir(self.path(a_segment)):
+                    segment = {
+                        a_field: np.load(os.path.join(self.path(a_segment), a_field + ".npy"), mmap_mode="r")
+                        for a_field in ["timestamp"] + columns
+                    }
+                    length = len(segment["timestamp"])
+                else:
+                    dtype = self.segment_dtype(columns)
+                    length = os.path.getsize(self.path(a_segment, ".log")) // dtype.itemsize
+                    if length == 0:
+                        continue
+                    segment = np.memmap(self.path(a_segment, ".log"), dtype=dtype, mode="r", shape=(length,))
+
+                take = min(length, remaining)
+                parts.append((segment, columns, length - take))
+                remaining -= take
+
+        parts.reverse()
+        timestamps = np.concatenate(
+            [np.asarray(a_segment["timestamp"][start:]) for a_segment, columns, start in parts]
+        ) if len(parts) > 0 else np.zeros(0, dtype=np.int64)
+
+        values = {}
+        for a_column in self.columns:
+            values[a_column] = np.concatenate(
+                [
+                    np.asarray(a_segment[a_column][start:])
+                    if a_column in columns
+                    else np.full(len(a_segment["timestamp"]) - start, np.nan)
+                    for a_segment, columns, start in parts
+                ]
+            ) if len(parts) > 0 else np.zeros(0)
+
+        return timestamps, values
+
+    def close(self):
+        self.file.close()
+        if self.compactor is not None:
+            self.compactor.join()
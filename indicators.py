@@ -0,0 +1,326 @@
+from collections import deque
+from math import fsum, isnan, nan
+import numpy as np
+from lazy import lazy_module
+
+pd = lazy_module("pandas")  # only needed by the batch_* functions
+
+# Indicators the strategies can ask for, and the price_store column(s) each one fills (after the ticker)
+indicator_columns = {
+    "sma_fast": ("_SMA_F",),
+    "sma_slow": ("_SMA_S",),
+    "rsi": ("_RSI",),
+    "macd": ("_MACD", "_MACD_S"),
+}
+
+
+class ticker_indicators:
+    """
+    Running indicator state for a single ticker. Every call to update() costs O(1) regardless of how much
+    history has been seen, and produces the same values as the batch computation done in checker.get_new_data:
+    SMA via shift(1).rolling(window).mean(), and TA-Lib's RSI and MACD (SMA-seeded Wilder/EMA smoothing).
+
+    Args:
+        sma_fast (int): window for the fast simple moving average.
+        sma_slow (int): window for the slow simple moving average.
+        rsi_period (int): period for the RSI (Wilder smoothing).
+        macd_fast (int): period for the fast EMA of the MACD.
+        macd_slow (int): period for the slow EMA of the MACD.
+        macd_signal (int): period for the EMA of the MACD line (signal line).
+        indicators (list, optional): names of the indicators to compute (see indicator_columns), the others are
+            always NaN. Defaults to None, for all of them.
+    """
+
+    def __init__(self, sma_fast, sma_slow, rsi_period, macd_fast, macd_slow, macd_signal, indicators=None):
+        self.is_computed = tuple(
+            indicators is None or a_name in indicators for a_name in indicator_columns
+        )  # sma_fast, sma_slow, rsi, macd
+
+        if macd_slow < macd_fast:  # TA-Lib swaps the periods in this case, so do we
+            macd_fast, macd_slow = macd_slow, macd_fast
+
+        self.sma_periods = (sma_fast, sma_slow)
+        self.sma_windows = (deque(), deque())  # previous prices (the current one is excluded, like shift(1))
+        self.sma_sums = [0.0, 0.0]
+        self.sma_pops = [0, 0]  # pops since the running sums were last recomputed exactly
+
+        self.rsi_period = rsi_period
+        self.rsi_samples = 0  # number of price differences seen so far
+        self.rsi_gain = 0.0  # sum of gains until seeded, then the smoothed average gain
+        self.rsi_loss = 0.0
+        self.last_price = nan
+
+        self.macd_fast = macd_fast
+        self.macd_slow = macd_slow
+        self.macd_signal = macd_signal
+        self.k_fast = 2.0 / (macd_fast + 1)
+        self.k_slow = 2.0 / (macd_slow + 1)
+        self.k_signal = 2.0 / (macd_signal + 1)
+        self.macd_seed = []  # prices kept only until both EMAs are seeded
+        self.ema_fast = nan
+        self.ema_slow = nan
+        self.signal_seed = []  # MACD values kept only until the signal line is seeded
+        self.ema_signal = nan
+
+    def update(self, price):
+        """
+        Feed the next price and return the indicators for the row that contains it.
+
+        Returns:
+            tuple: (sma_fast, sma_slow, rsi, macd, macd_signal); values are NaN until enough samples are available.
+        """
+        price = float(price)
+        if isnan(price):  # missing sample, state is left untouched
+            return nan, nan, nan, nan, nan
+
+        is_sma_fast, is_sma_slow, is_rsi, is_macd = self.is_computed
+        sma_fast = self._update_sma(0, price) if is_sma_fast else nan
+        sma_slow = self._update_sma(1, price) if is_sma_slow else nan
+        rsi = self._update_rsi(price) if is_rsi else nan
+        macd, macd_s = self._update_macd(price) if is_macd else (nan, nan)
+
+        self.last_price = price
+
+        return sma_fast, sma_slow, rsi, macd, macd_s
+
+    def _update_sma(self, i, price):
+        period = self.sma_periods[i]
+        window = self.sma_windows[i]
+
+        # The average for this row only looks at the samples before it
+        value = self.sma_sums[i] / period if len(window) == period else nan
+
+        window.append(price)
+        self.sma_sums[i] += price
+        if len(window) > period:
+            self.sma_sums[i] -= window.popleft()
+            self.sma_pops[i] += 1
+
+            # Recompute the sum exactly once per window length so rounding errors can't pile up (amortized O(1))
+            if self.sma_pops[i] >= period:
+                self.sma_sums[i] = fsum(window)
+                self.sma_pops[i] = 0
+
+        return value
+
+    def _update_rsi(self, price):
+        if isnan(self.last_price):
+            return nan
+
+        diff = price - self.last_price
+        gain = diff if diff > 0 else 0.0
+        loss = -diff if diff < 0 else 0.0
+        period = self.rsi_period
+        self.rsi_samples += 1
+
+        if self.rsi_samples < period:
+            self.rsi_gain += gain
+            self.rsi_loss += loss
+            return nan
+        elif self.rsi_samples == period:
+            # Seed the averages with a simple mean of the first period's gains and losses
+            self.rsi_gain = (self.rsi_gain + gain) / period
+            self.rsi_loss = (self.rsi_loss + loss) / period
+        else:
+            # Wilder smoothing
+            self.rsi_gain = (self.rsi_gain * (period - 1) + gain) / period
+            self.rsi_loss = (self.rsi_loss * (period - 1) + loss) / period
+
+        total = self.rsi_gain + self.rsi_loss
+        return 100.0 * (self.rsi_gain / total) if total != 0.0 else 0.0
+
+    def _update_macd(self, price):
+        if self.macd_seed is not None:
+            self.macd_seed.append(price)
+            if len(self.macd_seed) < self.macd_slow:
+                return nan, nan
+
+            # Both EMAs start at the same sample; each is seeded with the mean of its own period
+            self.ema_slow = fsum(self.macd_seed) / self.macd_slow
+            self.ema_fast = fsum(self.macd_seed[-self.macd_fast :]) / self.macd_fast
+            self.macd_seed = None
+        else:
+            self.ema_fast += (price - self.ema_fast) * self.k_fast
+            self.ema_slow += (price - self.ema_slow) * self.k_slow
+
+        macd = self.ema_fast - self.ema_slow
+
+        if self.signal_seed is not None:
+            self.signal_seed.append(macd)
+            if len(self.signal_seed) < self.macd_signal:
+                return nan, nan  # TA-Lib doesn't report the MACD line before the signal line is available
+
+            self.ema_signal = fsum(self.signal_seed) / self.macd_signal
+            self.signal_seed = None
+        else:
+            self.ema_signal += (macd - self.ema_signal) * self.k_signal
+
+        return macd, self.ema_signal
+
+
+class indicator_engine:
+    """
+    Keeps one ticker_indicators per ticker and names the results after the columns used in the price data
+    (TICKER_SMA_F, TICKER_SMA_S, TICKER_RSI, TICKER_MACD, TICKER_MACD_S). Only the columns of the indicators
+    asked for are computed and returned, so the price_store doesn't need the others.
+
+    Args:
+        config (dict): the bot configuration; uses 'moving_average_periods' and 'rsi_period'.
+        indicators (list, optional): names of the indicators to compute (see indicator_columns). Defaults to
+            None, for all of them.
+    """
+
+    def __init__(self, config, indicators=None):
+        unknown = set(indicators or ()) - set(indicator_columns)
+        if len(unknown) > 0:
+            raise ValueError("Unknown indicators: " + ", ".join(sorted(unknown)))
+
+        self.indicators = [
+            a_name for a_name in indicator_columns if indicators is None or a_name in indicators
+        ]
+        self.suffixes = tuple(
+            a_suffix for a_name in self.indicators for a_suffix in indicator_columns[a_name]
+        )
+        # Position of each of these columns in what ticker_indicators.update returns
+        every_suffix = [a_suffix for a_suffixes in indicator_columns.values() for a_suffix in a_suffixes]
+        self.positions = [every_suffix.index(a_suffix) for a_suffix in self.suffixes]
+
+        periods = config["moving_average_periods"]
+        self.parameters = (
+            periods["sma_fast"],
+            periods["sma_slow"],
+            config["rsi_period"],
+            periods["macd_fast"],
+            periods["macd_slow"],
+            periods["macd_signal"],
+            self.indicators,
+        )
+        self.tickers = {}
+
+    def columns(self, ticker):
+        return [ticker + suffix for suffix in self.suffixes]
+
+    def update(self, ticker, price):
+        """
+        Feed a new price for this ticker and return a dictionary with the new value of each indicator column.
+        """
+        if ticker not in self.tickers:
+            self.tickers[ticker] = ticker_indicators(*self.parameters)
+
+        values = self.tickers[ticker].update(price)
+        return {
+            ticker + a_suffix: values[a_position]
+            for a_suffix, a_position in zip(self.suffixes, self.positions)
+        }
+
+    def warm_up(self, ticker, prices):
+        """
+        Rebuild the state for this ticker from its price history (e.g. after loading saved data at startup).
+        This is the only O(history) operation; every new tick after it is O(1).
+        """
+        self.tickers[ticker] = ticker_indicators(*self.parameters)
+        for a_price in prices:
+            self.tickers[ticker].update(a_price)
+
+
+# Bulk versions of the same indicators, for a whole price history at once (backtesting, parameter sweeps).
+# They agree with ticker_indicators to floating-point tolerance: missing samples (NaN) are skipped the same way.
+
+
+def skip_missing(function):
+    # Compute on the valid samples only and put the results back in place, leaving NaN where the price is missing
+    def wrapper(prices, *args):
+        prices = np.asarray(prices, dtype=float)
+        valid = ~np.isnan(prices)
+        if valid.all():
+            return function(prices, *args)
+
+        out = np.full(len(prices), nan)
+        out[valid] = function(prices[valid], *args)
+        return out
+
+    return wrapper
+
+
+def ema_from(values, period, first):
+    # EMA seeded with the mean of the period values ending at index first (TA-Lib style), NaN before it
+    out = np.full(len(values), nan)
+    if first >= len(values):
+        return out
+
+    seeded = values[first:].copy()
+    seeded[0] = values[first - period + 1 : first + 1].mean()
+    out[first:] = pd.Series(seeded).ewm(alpha=2.0 / (period + 1), adjust=False).mean().to_numpy()
+    return out
+
+
+@skip_missing
+def batch_sma(prices, period):
+    # Same as shift(1).rolling(period).mean(): the average for a row only looks at the samples before it
+    return pd.Series(prices).shift(1).rolling(window=period).mean().to_numpy()
+
+
+@skip_missing
+def batch_rsi(prices, period):
+    out = np.full(len(prices), nan)
+    if len(prices) <= period:
+        return out
+
+    diffs = np.diff(prices)
+    averages = []
+    for a_series in (np.maximum(diffs, 0.0), np.maximum(-diffs, 0.0)):
+        # Seeded with the mean of the first period values, then Wilder smoothing (an EMA with alpha = 1 / period)
+        seeded = a_series[period - 1 :].copy()
+        seeded[0] = a_series[:period].mean()
+        averages.append(pd.Series(seeded).ewm(alpha=1.0 / period, adjust=False).mean().to_numpy())
+
+    gain, loss = averages
+    total = gain + loss
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out[period:] = np.where(total != 0.0, 100.0 * (gain / total), 0.0)
+    return out
+
+
+def batch_macd(prices, fast, slow, signal):
+    # Returns the MACD line and its signal line
+    prices = np.asarray(prices, dtype=float)
+    valid = ~np.isnan(prices)
+    macd_line, signal_line = np.full(len(prices), nan), np.full(len(prices), nan)
+    if slow < fast:
+        fast, slow = slow, fast
+
+    values = prices[valid]
+    first = slow + signal - 2  # TA-Lib doesn't report either line before this sample
+    if len(values) <= first:
+        return macd_line, signal_line
+
+    macd = ema_from(values, fast, slow - 1) - ema_from(values, slow, slow - 1)
+    signals = ema_from(macd, signal, first)
+    macd[:first] = nan
+
+    macd_line[valid], signal_line[valid] = macd, signals
+    return macd_line, signal_line
+
+
+def batch_indicators(ticker, prices, config, indicators=None):
+    """
+    The indicator columns of a ticker for a whole price history, named like the price_store columns.
+
+    Args:
+        indicators (list, optional): names of the indicators to compute (see indicator_columns). Defaults to
+            None, for all of them.
+    """
+    periods = config["moving_average_periods"]
+    columns = {}
+    if indicators is None or "sma_fast" in indicators:
+        columns[ticker + "_SMA_F"] = batch_sma(prices, periods["sma_fast"])
+    if indicators is None or "sma_slow" in indicators:
+        columns[ticker + "_SMA_S"] = batch_sma(prices, periods["sma_slow"])
+    if indicators is None or "rsi" in indicators:
+        columns[ticker + "_RSI"] = batch_rsi(prices, config["rsi_period"])
+    if indicators is None or "macd" in indicators:
+        columns[ticker + "_MACD"], columns[ticker + "_MACD_S"] = batch_macd(
+            prices, periods["macd_fast"], periods["macd_slow"], periods["macd_signal"]
+        )
+
+    return columns
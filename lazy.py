@@ -0,0 +1,38 @@
+import importlib
+
+
+class lazy_module:
+    """
+    Stands in for a module that takes long to import (pandas, robin_stocks, tradingview_ta...): the module is only
+    imported the first time one of its attributes is used, so a mode of the bot that never uses it (e.g. collecting
+    prices, or backtesting) doesn't pay for it at startup.
+
+        pd = lazy_module("pandas")
+        pd.DataFrame()  # pandas is imported here
+
+    Args:
+        name (str): the module, e.g. 'robin_stocks.robinhood'.
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def load(self):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        # Only called for what isn't in __dict__, so everything but _name and _module
+        return getattr(self._module if self._module is not None else self.load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        # e.g. a stand-in patched over one of the module's functions, seen by every user of the module
+        setattr(self.load(), attribute, value)
+
+    def __delattr__(self, attribute):
+        delattr(self.load(), attribute)
+
+    def __repr__(self):
+        return "<lazy module '" + self._name + "'" + (" (loaded)" if self._module is not None else "") + ">"
@@ -0,0 +1,154 @@
+from collections import namedtuple
+import numpy as np
+
+# One row of the ledger: a position opened by one of our buy orders
+lot_dtype = np.dtype(
+    [
+        ("ticker", np.int32),  # position in lot_ledger.tickers
+        ("quantity", np.float64),  # 0 once sold, until the lot is removed
+        ("price", np.float64),  # purchase price
+        ("order_id", "S40"),  # Robinhood order id of the buy order (a UUID)
+        ("timestamp", np.int64),  # epoch seconds of the buy
+        ("side", np.int8),  # 1 for buy, -1 for sell
+    ]
+)
+
+# A single lot, with the same fields as the asset class (ticker, quantity, price, order_id)
+lot = namedtuple("lot", ["ticker", "quantity", "price", "order_id", "timestamp", "side"])
+
+
+class lot_ledger:
+    """
+    The lots we hold, as one NumPy structured array (see lot_dtype) instead of one Python object per lot, so
+    cost basis, current value, unrealized PnL and the stop-loss/take-profit triggers of every lot are computed in
+    a few array operations against the latest price of each ticker. Lots are found by order id through a dict;
+    removing one moves the last row into its place, so the rows aren't in any particular order.
+
+    Args:
+        capacity (int, optional): rows allocated at first; doubled whenever it's full. Defaults to 64.
+    """
+
+    def __init__(self, capacity=64):
+        self.lots = np.zeros(max(1, capacity), dtype=lot_dtype)
+        self.count = 0
+        self.rows = {}  # order id -> row
+        self.tickers = []  # ticker id -> Robinhood ticker
+        self.ticker_ids = {}  # Robinhood ticker -> ticker id
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, order_id):
+        return order_id in self.rows
+
+    def ticker_id(self, ticker):
+        if ticker not in self.ticker_ids:
+            self.ticker_ids[ticker] = len(self.tickers)
+            self.tickers.append(ticker)
+        return self.ticker_ids[ticker]
+
+    def view(self):
+        # The rows in use (a view, only valid until the next add or remove)
+        return self.lots[: self.count]
+
+    def add(self, ticker, quantity, price, order_id, timestamp=0, side="buy"):
+        if order_id in self.rows:
+            self.remove(order_id)
+
+        if self.count == len(self.lots):
+            self.lots = np.concatenate([self.lots, np.zeros(len(self.lots), dtype=lot_dtype)])
+
+        self.lots[self.count] = (
+            self.ticker_id(ticker),
+            float(quantity),
+            float(price),
+            str(order_id).encode(),
+            int(timestamp),
+            1 if side == "buy" else -1,
+        )
+        self.rows[order_id] = self.count
+        self.count += 1
+
+    def remove(self, order_id):
+        row = self.rows.pop(order_id)
+        last = self.count - 1
+        if row != last:
+            self.lots[row] = self.lots[last]
+            self.rows[self.lots[row]["order_id"].decode()] = row
+        self.count = last
+
+    def set_quantity(self, order_id, quantity):
+        self.lots["quantity"][self.rows[order_id]] = quantity
+
+    def lot(self, row):
+        a_lot = self.lots[row]
+        return lot(
+            self.tickers[a_lot["ticker"]],
+            float(a_lot["quantity"]),
+            float(a_lot["price"]),
+            a_lot["order_id"].decode(),
+            int(a_lot["timestamp"]),
+            "buy" if a_lot["side"] > 0 else "sell",
+        )
+
+    def get(self, order_id):
+        return self.lot(self.rows[order_id]) if order_id in self.rows else None
+
+    def all(self):
+        # Every lot as a namedtuple, in row order (for printing and the code that handles lots one at a time)
+        return [self.lot(a_row) for a_row in range(self.count)]
+
+    def remove_sold(self):
+        # Lots sold during a previous tick (quantity 0)
+        sold = [a_order_id.decode() for a_order_id in self.view()["order_id"][self.view()["quantity"] <= 0.0]]
+        for a_order_id in sold:
+            self.remove(a_order_id)
+        return sold
+
+    def columns(self, tickers):
+        # Position of each lot's ticker in this tickers list (e.g. the columns of a signals matrix), -1 for a
+        # ticker missing from it
+        column_of = {a_ticker: i for i, a_ticker in enumerate(tickers)}
+        lookup = np.array([column_of.get(a_ticker, -1) for a_ticker in self.tickers], dtype=np.intp)
+        return lookup[self.view()["ticker"]]
+
+    def valuation(self, prices):
+        """
+        Value every lot at once.
+
+        Args:
+            prices (array): latest price of each ticker, indexed by ticker id (see price_vector).
+
+        Returns:
+            dict: arrays with one value per row (current price, cost, value, pnl) and the totals of each.
+        """
+        lots = self.view()
+        current = np.asarray(prices, dtype=float)[lots["ticker"]] if self.count > 0 else np.zeros(0)
+        cost = lots["quantity"] * lots["price"]
+        value = lots["quantity"] * current
+        return {
+            "current_price": current,
+            "cost": cost,
+            "value": value,
+            "pnl": value - cost,
+            "total_cost": float(cost.sum()),
+            "total_value": float(value.sum()),
+            "total_pnl": float((value - cost).sum()),
+        }
+
+    def triggers(self, prices, stop_loss_threshold, profit_percentage=None):
+        """
+        Returns:
+            tuple: (stop_loss, take_profit) boolean masks, one value per row, for the lots still held. The
+            current price is below (resp. above) the purchase price by stop_loss_threshold (resp.
+            profit_percentage); take_profit is all False when profit_percentage is None.
+        """
+        lots = self.view()
+        current = np.asarray(prices, dtype=float)[lots["ticker"]] if self.count > 0 else np.zeros(0)
+        held = lots["quantity"] > 0.0
+        stop_loss = held & (current < lots["price"] - (lots["price"] * stop_loss_threshold))
+        if profit_percentage is None:
+            return stop_loss, np.zeros(self.count, dtype=bool)
+
+        take_profit = held & (current > lots["price"] + (lots["price"] * profit_percentage))
+        return stop_loss, take_profit
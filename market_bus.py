@@ -0,0 +1,309 @@
+#!/usr/bin/python3 -u
+
+# Sherwood market-data bus
+# One producer process fetches the prices of every pair and computes the indicators into shared memory; several
+# shard processes, each trading a slice of ticker_list, read them from there without copying and without
+# calling Kraken themselves.
+# Run from the repository root: python3 market_bus.py --shards 4
+
+import argparse
+import copy
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+from datetime import datetime
+import numpy as np
+from config import config
+from price_store import price_store
+import sherwood
+
+# Header of the shared segment: sequence (odd while the producer is writing), start, rows, version
+header_fields = 4
+
+
+class shared_price_store(price_store):
+    """
+    price_store whose buffers live in one shared memory segment, so other processes can map them. Only the
+    process that created it may change it; append() and load_arrays() are wrapped in a seqlock: the sequence
+    number is odd while a row is being written, and readers retry if it changed while they were reading.
+
+    Another process attaches with shared_price_store(columns, max_rows, name=...) and calls refresh() to pin the
+    rows published so far: window() and last() then keep reading those same rows, as views on the shared
+    buffers, until the next refresh(). The producer's next append only writes the row after them and, once the
+    buffer is full, the oldest of them (see price_store.append), so the pinned rows stay valid in the meantime.
+
+    Args:
+        columns (list): names of the float columns, in the same order in every process.
+        max_rows (int): maximum number of rows kept.
+        name (str, optional): name of the segment to attach to. Defaults to None, to create a new one.
+    """
+
+    def __init__(self, columns, max_rows, name=None):
+        self.capacity = int(max_rows)
+        self.is_owner = name is None
+        size = 8 * (header_fields + 2 * self.capacity * (len(columns) + 1))
+        if self.is_owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            try:
+                self.memory = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:  # Python < 3.13: registered with the producer's resource tracker, unlinked by the producer
+                self.memory = shared_memory.SharedMemory(name=name)
+
+        self.header = np.ndarray(header_fields, dtype=np.int64, buffer=self.memory.buf)
+        offset = 8 * header_fields
+        self.timestamps = np.ndarray(2 * self.capacity, dtype=np.int64, buffer=self.memory.buf, offset=offset)
+        self.columns = {}
+        for a_column in columns:
+            offset += 8 * 2 * self.capacity
+            self.columns[a_column] = np.ndarray(2 * self.capacity, dtype=np.float64, buffer=self.memory.buf, offset=offset)
+
+        if self.is_owner:
+            self.header[:] = 0
+            self.timestamps[:] = 0
+            for a_buffer in self.columns.values():
+                a_buffer[:] = np.nan
+
+        self.start, self.rows, self.version = (int(a_value) for a_value in self.header[1:])
+        self._frame = None
+        self._frame_key = None
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def add_column(self, column):
+        # The layout of the segment is fixed once created
+        raise ValueError("Can't add column " + str(column) + " to a shared price store")
+
+    def publish(self, change, *args):
+        if not self.is_owner:
+            raise ValueError("Only the producer can change the shared prices")
+
+        self.header[0] += 1  # odd: readers will retry
+        change(*args)
+        self.header[1:] = (self.start, self.rows, self.version)
+        self.header[0] += 1
+
+    def append(self, timestamp, values):
+        self.publish(super().append, timestamp, values)
+
+    def load_arrays(self, timestamps, values):
+        self.publish(super().load_arrays, timestamps, values)
+
+    def refresh(self):
+        """
+        Pin the rows the producer published so far (in a shard).
+
+        Returns:
+            bool: True if there are new rows since the previous refresh.
+        """
+        while True:
+            sequence = self.header[0]
+            if sequence % 2 == 0:
+                start, rows, version = (int(a_value) for a_value in self.header[1:])
+                if self.header[0] == sequence:
+                    break
+            time.sleep(0)
+
+        is_changed = version != self.version
+        self.start, self.rows, self.version = start, rows, version
+        return is_changed
+
+    def published_version(self):
+        return int(self.header[3])
+
+    def read(self, function):
+        """
+        Call function(self) on pinned rows and retry if the producer published anything in the meantime, for a
+        reader that can't tolerate even the oldest row changing (e.g. copying whole windows while the producer
+        appends faster than once per tick).
+
+        Returns:
+            the result of function.
+        """
+        while True:
+            self.refresh()
+            result = function(self)
+            if self.header[0] % 2 == 0 and self.published_version() == self.version:
+                return result
+
+    def close(self):
+        self.header = self.timestamps = None
+        self.columns = {}
+        self.memory.close()
+        if self.is_owner:
+            self.memory.unlink()
+
+
+class market_producer(sherwood.checker):
+    """
+    Fetches the prices of every pair in ticker_list with one request per tick, updates the indicators and writes
+    both into a shared_price_store (and to the history on disk), like trader.get_new_data does for a single
+    process. It's the only process talking to Kraken.
+
+    Args:
+        new_store (class, optional): store for the prices. Defaults to shared_price_store; the collect mode of
+            cli.py passes price_store, it only fills the history on disk.
+    """
+
+    charts = None
+
+    def __init__(self, new_store=shared_price_store):
+        self.load_prices(new_store)
+
+    def tick(self, now=None):
+        self.get_new_data(now or datetime.now())
+
+
+class shard_trader(sherwood.trader):
+    """
+    Trades its slice of ticker_list (config['ticker_list'] in its process) with the prices and indicators the
+    producer wrote in shared memory. Everything else (orders, journal, Robinhood calls) is the same as a
+    single-process trader; each shard has its own orders journal, and only spends its share of the account's
+    buying power (config['shards'] shards trade on the same account).
+
+    Args:
+        bus (tuple): (name, columns, max_rows) of the producer's shared_price_store.
+    """
+
+    legacy_orders = None  # each shard has its own journal, importing orders.pickle would hold its lots N times
+
+    def __init__(self, bus):
+        self.bus = bus
+        super().__init__()
+
+    def load_prices(self, new_store=None):
+        # Nothing to fetch or to load from disk, the producer does it
+        name, columns, max_rows = self.bus
+        self.store = shared_price_store(columns, max_rows, name=name)
+        self.store.refresh()
+        self.count_consecutive_samples()
+
+    def get_new_data(self, now, prices=None):
+        version = self.store.version
+        self.store.refresh()
+        self.is_trading_locked = False
+
+        if self.store.version == version + 1:
+            # One new row: constant-time update of the counters, like the producer
+            tickers = [
+                a_ticker
+                for a_ticker in config["ticker_list"].values()
+                if not np.isnan(self.store.last(a_ticker))
+            ]
+            self.track_consecutive_samples(int(self.store.last("timestamp")), tickers)
+        else:
+            self.count_consecutive_samples()
+
+        return self.store
+
+    def get_available_cash(self):
+        # Each shard gets 1/shards of what's left, so the shards can't commit more than the account has on a tick
+        available_cash = super().get_available_cash()
+        if available_cash <= 0:
+            return available_cash
+
+        return round(available_cash / config.get("shards", 1), 3)
+
+    def follow(self, ticks=None, poll=0.05):
+        """
+        Run a tick every time the producer publishes a new row.
+
+        Args:
+            ticks (int, optional): ticks before returning. Defaults to None, to run forever.
+            poll (float, optional): seconds between two checks for a new row. Defaults to 0.05.
+        """
+        done = 0
+        while ticks is None or done < ticks:
+            if self.store.published_version() == self.store.version:
+                time.sleep(poll)
+                continue
+
+            # get_new_data picks up the new row; passing prices (none needed) keeps run() from starting its own timer
+            self.run({})
+            done += 1
+
+
+def shard_config(settings, tickers, shard, shards):
+    # The settings of one shard: its slice of the pairs, its share of the buying power and its own orders journal
+    settings = copy.deepcopy(settings)
+    settings["ticker_list"] = dict(tickers)
+    settings["shards"] = shards
+    settings["orders_journal"] = str(settings.get("orders_journal", "orders.journal")) + "." + str(shard)
+    settings["save_charts"] = False  # drawn by the producer
+    return settings
+
+
+def run_shard(bus, settings, ready, ticks=None):
+    # Entry point of a shard process
+    config.clear()
+    config.update(settings)
+    bot = shard_trader(bus)
+    ready.put(settings["orders_journal"])
+    bot.follow(ticks)
+
+
+def slices(pairs, shards):
+    # Round-robin, so each shard gets a similar number of pairs
+    pairs = list(pairs.items())
+    return [pairs[i::shards] for i in range(shards)]
+
+
+def run_shards(shards=None, ticks=None):
+    """
+    Start the producer in this process and one shard process per slice of ticker_list, then fetch the prices
+    every minutes_between_updates.
+
+    Args:
+        shards (int, optional): number of shard processes. Defaults to one per CPU.
+        ticks (int, optional): ticks before stopping everything. Defaults to None, to run forever.
+    """
+    shards = max(1, min(shards or multiprocessing.cpu_count(), len(config["ticker_list"])))
+    producer = market_producer()
+    bus = (producer.store.name, list(producer.store.columns), producer.store.capacity)
+
+    context = multiprocessing.get_context("spawn")  # the shards map the segment themselves
+    ready = context.Queue()
+    processes = []
+    for i, a_slice in enumerate(slices(config["ticker_list"], shards)):
+        a_process = context.Process(
+            target=run_shard, args=(bus, shard_config(config, a_slice, i, shards), ready, ticks), daemon=True
+        )
+        a_process.start()
+        processes.append(a_process)
+
+    # A shard only acts on the rows published after it started
+    for a_process in processes:
+        ready.get()
+    print("Started " + str(shards) + " shards for " + str(len(config["ticker_list"])) + " pairs")
+
+    try:
+        done = 0
+        interval = config["minutes_between_updates"] * 60
+        while ticks is None or done < ticks:
+            # Aligned to the clock, like the other modes
+            time.sleep(interval - time.time() % interval)
+            producer.tick()
+            done += 1
+
+        for a_process in processes:
+            a_process.join()
+    finally:
+        for a_process in processes:
+            if a_process.is_alive():
+                a_process.terminate()
+        producer.history.close()
+        producer.store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trade many pairs with one price producer and several shard processes.")
+    parser.add_argument("--shards", type=int, help="shard processes (default: one per CPU)")
+    parser.add_argument("--ticks", type=int, help="stop after this many ticks (default: run forever)")
+    arguments = parser.parse_args()
+
+    for a_key, a_value in sherwood.trader.default_config.items():
+        if a_key not in config:
+            config[a_key] = a_value
+    run_shards(arguments.shards, arguments.ticks)
@@ -0,0 +1,311 @@
+import asyncio
+import json
+from math import floor
+import queue
+import threading
+import time
+import requests
+from metrics import endpoint
+
+
+def is_unknown_pair(result):
+    # Kraken's answer is about a pair it doesn't know ('EQuery:Unknown asset pair'), not e.g. EService or EAPI
+    return any(a_error.startswith("EQuery:") for a_error in result["error"])
+
+
+class kraken_feed:
+    """
+    Fetches the latest prices of all the configured Kraken pairs with a single request (the Ticker endpoint
+    accepts a comma-separated list of pairs), over a keep-alive session so consecutive ticks reuse the same
+    connection. The latency of every fetch is recorded.
+
+    Kraken fails the whole request if one of the pairs is unknown (e.g. delisted). When it does, the pairs are
+    fetched one by one for that tick, and the ones Kraken doesn't know are reported and dropped from self.pairs,
+    so the next ticks are a single request again.
+
+    Args:
+        pairs (list): Kraken pair names, e.g. ['XETHZUSD', 'XXBTZUSD'].
+        timeout (float, optional): request timeout in seconds. Defaults to 10.
+    """
+
+    url = "https://api.kraken.com/0/public/Ticker"
+
+    def __init__(self, pairs, timeout=10):
+        self.pairs = list(pairs)
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.last_latency = 0.0  # seconds taken by the most recent fetch
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+        self.fetches = 0
+
+    def fetch(self):
+        """
+        Returns:
+            dict: Kraken pair -> current ask price, for every pair Kraken returned a price for.
+        """
+        result = self.get(self.pairs)
+
+        if len(result["error"]) > 0:
+            if not is_unknown_pair(result):
+                raise RuntimeError("Kraken returned an error: " + str(result["error"]))
+            return self.fetch_each()
+
+        prices = {}
+        for a_pair in self.pairs:
+            if a_pair in result["result"]:
+                prices[a_pair] = float(result["result"][a_pair]["a"][0])
+
+        return prices
+
+    def fetch_each(self):
+        # One request per pair, to find the ones Kraken doesn't know; any other error only skips its pair this tick
+        prices = {}
+        unknown = []
+        for a_pair in self.pairs:
+            result = self.get([a_pair])
+            if len(result["error"]) == 0:
+                if a_pair in result["result"]:
+                    prices[a_pair] = float(result["result"][a_pair]["a"][0])
+            elif is_unknown_pair(result):
+                unknown.append(a_pair)
+
+        if len(unknown) > 0:
+            print("Kraken doesn't know " + ", ".join(unknown) + ": not fetching it anymore (check ticker_list)")
+            self.pairs = [a_pair for a_pair in self.pairs if a_pair not in unknown]
+
+        return prices
+
+    def get(self, pairs):
+        start = time.perf_counter()
+        result = self.session.get(self.url, params={"pair": ",".join(pairs)}, timeout=self.timeout).json()
+        self.record_latency(time.perf_counter() - start)
+        return result
+
+    def record_latency(self, latency):
+        endpoint("kraken.Ticker").observe(latency)
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_latency += latency
+        self.fetches += 1
+
+    def latency_stats(self):
+        return {
+            "fetches": self.fetches,
+            "last": self.last_latency,
+            "mean": self.total_latency / self.fetches if self.fetches > 0 else 0.0,
+            "max": self.max_latency,
+        }
+
+
+class bar_aggregator:
+    """
+    Turns a stream of price updates into bars of `interval` seconds, aligned to the clock like the polling mode's
+    ticks. A pair without any update during a bar gets the previous bar's close, as long as the connection that
+    produced it is still up (see reset).
+
+    Args:
+        interval (float): length of a bar in seconds.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.start = None  # epoch seconds at which the current bar opened
+        self.bars = {}  # pair -> [open, high, low, close] of the current bar
+        self.closes = {}  # pair -> close of the last bar it had an update in
+
+    def next_close(self, now):
+        # When the current bar closes (or, before the first update, when the bar forming now closes)
+        start = self.start if self.start is not None else floor(now / self.interval) * self.interval
+        return start + self.interval
+
+    def update(self, pair, price, timestamp):
+        """
+        Returns:
+            list: the bars this update closed, see close_until.
+        """
+        closed = self.close_until(timestamp)
+        if self.start is None:
+            self.start = floor(timestamp / self.interval) * self.interval
+
+        bar = self.bars.get(pair)
+        if bar is None:
+            self.bars[pair] = [price, price, price, price]
+        else:
+            bar[1] = max(bar[1], price)
+            bar[2] = min(bar[2], price)
+            bar[3] = price
+
+        return closed
+
+    def close_until(self, now):
+        """
+        Close the current bar if `now` is past its end.
+
+        Returns:
+            list: (epoch seconds at which the bar closed, {pair: (open, high, low, close)}), empty if the bar is
+            still open or had no prices at all.
+        """
+        if self.start is None or now < self.start + self.interval:
+            return []
+
+        end = self.start + self.interval
+        bar = {a_pair: (a_close, a_close, a_close, a_close) for a_pair, a_close in self.closes.items()}
+        for a_pair, a_bar in self.bars.items():
+            bar[a_pair] = tuple(a_bar)
+            self.closes[a_pair] = a_bar[3]
+
+        self.bars = {}
+        self.start = floor(now / self.interval) * self.interval
+        return [(end, bar)] if len(bar) > 0 else []
+
+    def reset(self):
+        # The connection dropped: prices that were only carried over can't be trusted anymore
+        self.closes = {}
+
+
+class kraken_stream:
+    """
+    Streaming alternative to kraken_feed: subscribes to Kraken's WebSocket ticker channel for all the pairs and
+    aggregates the ask prices into bars of `interval` seconds. The connection runs in a background thread and
+    reconnects (and resubscribes) on its own, waiting a bit longer after each failed attempt.
+
+    Two kinds of events are put in `events`, in order:
+    * ("bar", close time, {pair: (open, high, low, close)}) when a bar closes;
+    * ("price", pair) when a pair's price changed; the price itself is read from `latest`, so a consumer that
+      falls behind handles each pair once, with its most recent price.
+
+    Args:
+        pairs (list): Kraken pair names, e.g. ['XETHZUSD', 'XXBTZUSD'].
+        interval (float): length of a bar in seconds.
+        silence (float, optional): seconds without any message (Kraken sends a heartbeat every second) after which
+            the connection is considered dead. Defaults to 10.
+        max_reconnect_delay (float, optional): longest wait between two connection attempts. Defaults to 60.
+    """
+
+    url = "wss://ws.kraken.com"
+    asset_pairs_url = "https://api.kraken.com/0/public/AssetPairs"  # gives the WebSocket name of each pair
+
+    def __init__(self, pairs, interval, silence=10, max_reconnect_delay=60):
+        self.pairs = list(pairs)
+        self.aggregator = bar_aggregator(interval)
+        self.silence = silence
+        self.max_reconnect_delay = max_reconnect_delay
+        self.names = {}  # WebSocket name (e.g. 'XBT/USD') -> Kraken pair
+        self.latest = {}  # Kraken pair -> (bid, ask, epoch seconds of the update)
+        self.events = queue.Queue()
+        self.pending = set()  # pairs with a "price" event not handled yet
+        self.is_stopped = False
+        self.thread = None
+        self.loop = None
+        self.task = None
+        self.connections = 0
+        self.messages = 0
+
+    def ws_names(self):
+        result = requests.get(self.asset_pairs_url, params={"pair": ",".join(self.pairs)}, timeout=10).json()
+        if len(result["error"]) > 0:
+            raise RuntimeError("Kraken returned an error: " + str(result["error"]))
+
+        return {result["result"][a_pair]["wsname"]: a_pair for a_pair in self.pairs if a_pair in result["result"]}
+
+    def start(self):
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.is_stopped = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
+
+    async def run(self):
+        # Imported here, only the streaming mode needs it
+        import websockets
+
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        delay = 1.0
+        while not self.is_stopped:
+            try:
+                if len(self.names) == 0:
+                    self.names = await asyncio.to_thread(self.ws_names)
+
+                async with websockets.connect(self.url) as websocket:
+                    await websocket.send(
+                        json.dumps({"event": "subscribe", "pair": list(self.names), "subscription": {"name": "ticker"}})
+                    )
+                    self.connections += 1
+                    delay = 1.0
+                    await self.listen(websocket)
+            except asyncio.CancelledError:
+                return
+            except Exception as e:
+                print("Kraken stream disconnected (" + str(e) + "), reconnecting in " + str(delay) + " s")
+
+            self.aggregator.reset()
+            try:
+                await self.wait(delay)
+            except asyncio.CancelledError:
+                return
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def wait(self, seconds):
+        # Sleep before reconnecting, still closing the current bar on time
+        end = time.time() + seconds
+        while time.time() < end:
+            self.publish(self.aggregator.close_until(time.time()))
+            await asyncio.sleep(max(0.0, min(end, self.aggregator.next_close(time.time())) - time.time()))
+        self.publish(self.aggregator.close_until(time.time()))
+
+    async def listen(self, websocket):
+        last_message = time.time()
+        while True:
+            now = time.time()
+            if now - last_message > self.silence:
+                raise RuntimeError("no message for " + str(self.silence) + " s")
+
+            # Wake up at the end of the bar even if the market is quiet
+            timeout = min(self.aggregator.next_close(now) - now, self.silence - (now - last_message))
+            try:
+                message = await asyncio.wait_for(websocket.recv(), max(timeout, 0.0))
+            except asyncio.TimeoutError:
+                self.publish(self.aggregator.close_until(time.time()))
+                continue
+
+            last_message = time.time()
+            self.messages += 1
+            self.handle(json.loads(message), last_message)
+
+    def handle(self, message, now):
+        # Ticker updates are lists: [channel id, {"a": [ask, ...], "b": [bid, ...], ...}, "ticker", name]
+        if isinstance(message, dict):
+            if message.get("event") == "subscriptionStatus" and message.get("status") == "error":
+                print("Kraken refused the subscription: " + str(message.get("errorMessage")))
+            return
+
+        if len(message) < 4 or message[-2] != "ticker" or message[-1] not in self.names:
+            return
+
+        pair = self.names[message[-1]]
+        bid = float(message[1]["b"][0])
+        ask = float(message[1]["a"][0])
+        self.publish(self.aggregator.update(pair, ask, now))
+        self.latest[pair] = (bid, ask, now)
+        if pair not in self.pending:
+            self.pending.add(pair)
+            self.events.put(("price", pair))
+
+    def publish(self, bars):
+        for a_end, a_bar in bars:
+            self.events.put(("bar", a_end, a_bar))
+
+    def price(self, pair):
+        """
+        Returns:
+            tuple: (bid, ask, epoch seconds) of the latest update for this pair, None if there wasn't any. The
+            "price" event of the pair is marked as handled.
+        """
+        self.pending.discard(pair)
+        return self.latest.get(pair)
@@ -0,0 +1,157 @@
+import json
+import os
+import pickle
+import threading
+import time
+
+
+class order_journal:
+    """
+    Write-ahead journal of order events, replacing full rewrites of orders.pickle.
+
+    Every event (submitted, filled, cancelled, sell_submitted, sold) is one JSON line appended to the journal, with
+    the fields of the record class and a sequence number. A position is keyed by the id of the buy order that
+    opened it: "filled" replaces it (e.g. with the quantity a partly filled order got), "sell_submitted" marks it
+    with the id of the sell order closing it (and the quantity it sells), "sold" closes it (or reduces it, if less
+    than its quantity was sold, which also ends its sell order).
+    Lines are flushed right away and fsync'ed in batches (every fsync_every events, after fsync_interval seconds,
+    or when sync() is called, e.g. once per tick). On startup the open positions are rebuilt by loading the last
+    snapshot and replaying the events of the journal it doesn't include yet (by sequence number); a line cut short
+    by a crash (even one that parses, as long as its newline is missing) is dropped. Every snapshot_every events
+    the positions are snapshotted and the journal is emptied, so replay never has to go through more than that
+    many events.
+
+    Args:
+        path (str): journal file; the snapshot is saved next to it with a .snapshot suffix.
+        fsync_every (int, optional): events between two fsyncs. Defaults to 32.
+        fsync_interval (float, optional): maximum seconds between two fsyncs. Defaults to 1.0.
+        snapshot_every (int, optional): events between two snapshots/compactions. Defaults to 10000.
+    """
+
+    events = ("submitted", "filled", "cancelled", "sell_submitted", "sold")
+
+    def __init__(self, path, fsync_every=32, fsync_interval=1.0, snapshot_every=10000):
+        self.path = path
+        self.snapshot_path = path + ".snapshot"
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.positions = {}  # order_id -> fields of the record for each open position
+        self.sequence = 0  # sequence number of the last event applied to positions
+        self.journaled = 0  # events written since the last snapshot
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.lock = threading.RLock()  # events can be logged from several threads
+
+        self.recover()
+        self.file = open(self.path, "a")
+
+    def recover(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+            if "positions" in snapshot and "sequence" in snapshot:
+                self.positions, self.sequence = snapshot["positions"], snapshot["sequence"]
+            else:  # snapshot saved before events were numbered
+                self.positions = snapshot
+
+        if not os.path.exists(self.path):
+            return
+
+        valid_bytes = 0
+        with open(self.path, "rb") as f:
+            for a_line in f:
+                if not a_line.endswith(b"\n"):
+                    break  # last line cut short by a crash; the next event appended would be glued to it
+                try:
+                    event = json.loads(a_line)
+                except ValueError:
+                    break  # incomplete line written during a crash, everything after it is discarded
+
+                # Events the snapshot already includes (we stopped between the snapshot and the emptying of the
+                # journal) are skipped: a partial "sold" applied twice would reduce its position twice
+                if event.get("sequence", self.sequence + 1) > self.sequence:
+                    self.apply(event)
+                    self.sequence = event.get("sequence", self.sequence)
+                self.journaled += 1
+                valid_bytes += len(a_line)
+
+        if valid_bytes < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_bytes)
+
+    def apply(self, event):
+        order_id = event["order_id"]
+        if event["event"] in ("submitted", "filled") and event["order_type"] == "buy":
+            self.positions[order_id] = {
+                a_field: event[a_field] for a_field in event if a_field not in ("event", "sequence")
+            }
+        elif event["event"] == "sell_submitted" and order_id in self.positions:
+            self.positions[order_id]["sell_order_id"] = event["sell_order_id"]
+            self.positions[order_id]["sell_price"] = event["price"]
+            self.positions[order_id]["sell_quantity"] = event["quantity"]
+        elif (
+            event["event"] == "sold"
+            and order_id in self.positions
+            and event["quantity"] < self.positions[order_id]["quantity"]
+        ):
+            self.positions[order_id]["quantity"] -= event["quantity"]  # part of the position was sold
+            for a_field in ("sell_order_id", "sell_price", "sell_quantity"):
+                self.positions[order_id].pop(a_field, None)
+        elif event["event"] in ("cancelled", "sold"):
+            self.positions.pop(order_id, None)
+
+    def log(self, event, a_record):
+        """
+        Append an event for this record (an instance of the record class, or anything with the same fields).
+        """
+        assert event in self.events
+        with self.lock:
+            entry = dict(vars(a_record), event=event, sequence=self.sequence + 1)
+            self.apply(entry)
+            self.sequence += 1
+
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            self.journaled += 1
+            self.unsynced += 1
+
+            if (
+                self.unsynced >= self.fsync_every
+                or time.monotonic() - self.last_sync >= self.fsync_interval
+            ):
+                self.sync()
+
+            if self.journaled >= self.snapshot_every:
+                self.snapshot()
+
+    def sync(self):
+        with self.lock:
+            if self.unsynced > 0:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+            self.last_sync = time.monotonic()
+
+    def snapshot(self):
+        """
+        Save the open positions and empty the journal (compaction).
+        """
+        with self.lock:
+            self.sync()
+
+            # The snapshot replaces the previous one atomically, and it's only then that the journal is emptied
+            # (if we stop in between, recover() skips the events of the journal up to the sequence of the snapshot)
+            with open(self.snapshot_path + ".tmp", "wb") as f:
+                pickle.dump({"positions": self.positions, "sequence": self.sequence}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.snapshot_path + ".tmp", self.snapshot_path)
+
+            self.file.close()
+            self.file = open(self.path, "w")
+            self.journaled = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
@@ -0,0 +1,156 @@
+#!/usr/bin/python3 -u
+
+# Sherwood paper trading
+# Runs the trader against a simulated_exchange (see exchange.py) instead of Robinhood: every order goes through
+# the same lifecycle as live trading (increments, buying power, open orders, partial fills, cancellations), on the
+# live Kraken prices or on a replayed price history.
+# Run from the repository root: python3 cli.py paper [--replay prices.csv]
+
+import contextlib
+import os
+import tempfile
+import time
+from datetime import datetime
+from config import config
+from exchange import simulated_exchange
+import sherwood
+
+
+class paper_trader(sherwood.trader):
+    """
+    trader whose Robinhood calls go to a simulated_exchange, quoted with the prices the bot fetches (or is given)
+    at every tick, around spread.
+
+    Args:
+        exchange (simulated_exchange): installed as robin_stocks.robinhood (sherwood.r) until close() is called.
+        spread (float, optional): ask - bid quoted around each price, as a fraction of it. Defaults to 0.
+    """
+
+    legacy_orders = None  # the positions of live trading are never imported
+
+    def __init__(self, exchange, spread=0.0):
+        self.exchange = exchange
+        self.spread = spread
+        self.robinhood = sherwood.r  # put back by close()
+        sherwood.r = exchange
+
+        # Orders are sent (to the exchange) and the prices are real, the positions are kept apart from live trading
+        if config.get("orders_journal", "orders.journal") == "orders.journal":
+            config["orders_journal"] = "paper_orders.journal"
+        config["trades_enabled"] = True
+        config["debug_enabled"] = False
+        config["username"] = config.get("username") or "paper"
+        config["password"] = config.get("password") or "paper"
+        try:
+            super().__init__()
+        except BaseException:  # including the exit() of a failed login
+            sherwood.r = self.robinhood
+            raise
+
+    def close(self):
+        """
+        Close the history and the journal, and put the Robinhood client back, so that a trader or a thief built
+        later in this process sends its orders to Robinhood again.
+        """
+        self.history.close()
+        self.journal.close()
+        sherwood.r = self.robinhood
+
+    def get_new_data(self, now, prices=None):
+        store = super().get_new_data(now, prices)
+
+        # The resting orders fill against the prices of this tick (only the coins that got a new one) before the
+        # strategies run
+        timestamp = int(now.timestamp())
+        self.exchange.update_prices(
+            {
+                a_ticker: store.last(a_ticker)
+                for a_ticker in config["ticker_list"].values()
+                if self.last_sample.get(a_ticker) == timestamp
+            },
+            timestamp,
+            self.spread,
+        )
+        return store
+
+
+def replay(timestamps, prices, cash=10000.0, fee_rate=0.0, depth=None, spread=0.0, verbose=False):
+    """
+    Run the trader tick by tick over a price history (one trader.run per row), against a simulated exchange. The
+    orders journal and the history go to a temporary directory.
+
+    Args:
+        timestamps (array): int64 epoch seconds, one per row.
+        prices (dict): Robinhood ticker -> float array of prices (see backtest.load_prices).
+        cash (float, optional): starting buying power. Defaults to 10000.
+        fee_rate (float, optional): fee of each fill, as a fraction of its value. Defaults to 0.
+        depth (float, optional): USD that can be filled per symbol, side and tick. Defaults to no limit.
+        spread (float, optional): ask - bid around each price, as a fraction of it. Defaults to 0.
+        verbose (bool, optional): show what the bot prints. Defaults to False.
+
+    Returns:
+        dict: the exchange's stats, plus ticks, seconds and ticks_per_second.
+    """
+    # Kraken pair of each ticker, as trader.run expects them (the ticker itself when it's not in ticker_list)
+    pairs = {a_ticker: a_pair for a_pair, a_ticker in config.get("ticker_list", {}).items()}
+    pairs = {a_ticker: pairs.get(a_ticker, a_ticker) for a_ticker in prices}
+
+    saved_config = dict(config)
+    saved_robinhood = sherwood.r
+    directory = tempfile.TemporaryDirectory()
+    output = None if verbose else open(os.devnull, "w")
+    try:
+        config.update(
+            {
+                "ticker_list": {a_pair: a_ticker for a_ticker, a_pair in pairs.items()},
+                "history_dir": os.path.join(directory.name, "history"),
+                "orders_journal": os.path.join(directory.name, "orders.journal"),
+                "save_charts": False,
+                "quote_feed_seconds": 0,
+                "metrics_port": None,
+                "metrics_file": None,
+            }
+        )
+
+        exchange = simulated_exchange(cash, fee_rate, depth)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+            bot = paper_trader(exchange, spread)
+            bot.is_printing_prices = verbose  # nobody would read them, and they're most of the time of a tick
+            for i, a_timestamp in enumerate(timestamps):
+                bot.run(
+                    {pairs[a_ticker]: float(a_prices[i]) for a_ticker, a_prices in prices.items() if a_prices[i] == a_prices[i]},
+                    datetime.fromtimestamp(int(a_timestamp)),
+                )
+            bot.close()
+        elapsed = time.perf_counter() - start
+    finally:
+        sherwood.r = saved_robinhood  # even if the bot failed before close()
+        config.clear()
+        config.update(saved_config)
+        directory.cleanup()
+        if output:
+            output.close()
+
+    results = exchange.stats()
+    results.update({"ticks": len(timestamps), "seconds": elapsed, "ticks_per_second": len(timestamps) / elapsed})
+    return results
+
+
+def print_results(results):
+    print("-- Paper trading --------------------------")
+    print("Ticks: " + str(results["ticks"]) + " in " + str(round(results["seconds"], 1)) + " s (" + str(round(results["ticks_per_second"], 1)) + " per second)")
+    print(
+        "Orders: "
+        + str(results["orders"])
+        + " | fills: "
+        + str(results["fills"])
+        + " (partial: "
+        + str(results["partial_fills"])
+        + ") | rejected: "
+        + str(results["rejections"])
+        + " | still open: "
+        + str(results["open_orders"])
+    )
+    print("Volume: $" + str(round(results["volume"], 2)) + " | fees: $" + str(round(results["fees"], 2)))
+    print("Equity: $" + str(round(results["equity"], 2)) + " | PnL: $" + str(round(results["pnl"], 2)))
@@ -0,0 +1,155 @@
+from datetime import datetime
+import numpy as np
+from lazy import lazy_module
+
+pd = lazy_module("pandas")  # only needed by frame() and load_frame()
+
+
+class price_store:
+    """
+    Fixed-size, columnar store for the price and indicator history.
+
+    Every column (and the int64 epoch timestamps) lives in its own preallocated NumPy array, so appending a row
+    never allocates and the number of rows can never go past max_rows. Each array is twice as long as the
+    capacity and every value is written twice (at i and i + capacity): that way the most recent rows are always
+    contiguous, and window() can hand out views instead of copies even after the buffer wrapped around.
+
+    Args:
+        columns (list): names of the float columns to track (prices and indicators).
+        max_rows (int): maximum number of rows kept; older rows are overwritten.
+    """
+
+    def __init__(self, columns, max_rows):
+        self.capacity = int(max_rows)
+        self.start = 0  # physical position of the oldest row
+        self.rows = 0  # number of rows currently stored
+        self.version = 0  # incremented on every change, used to invalidate the cached DataFrame
+        self.timestamps = np.zeros(2 * self.capacity, dtype=np.int64)
+        self.columns = {}
+        for a_column in columns:
+            self.add_column(a_column)
+
+        self._frame = None
+        self._frame_key = None
+
+    def __len__(self):
+        return self.rows
+
+    def add_column(self, column):
+        if column not in self.columns:
+            self.columns[column] = np.full(2 * self.capacity, np.nan)
+
+    def append(self, timestamp, values):
+        """
+        Add a row in O(1). Columns missing from values are stored as NaN.
+
+        Args:
+            timestamp (int): epoch seconds for this sample.
+            values (dict): column name -> value.
+        """
+        if self.rows < self.capacity:
+            position = self.start + self.rows
+            self.rows += 1
+        else:
+            # Full: overwrite the oldest row
+            position = self.start
+            self.start = (self.start + 1) % self.capacity
+
+        mirror = position + self.capacity
+        self.timestamps[position] = self.timestamps[mirror] = timestamp
+        for a_column, a_buffer in self.columns.items():
+            a_buffer[position] = a_buffer[mirror] = values.get(a_column, np.nan)
+
+        self.version += 1
+
+    def window(self, column, rows=None):
+        """
+        Zero-copy view on the last rows of a column, oldest first. Don't hold on to it across appends: the
+        underlying memory is reused once the buffer wraps around.
+        """
+        buffer = self.timestamps if column == "timestamp" else self.columns[column]
+        rows = self.rows if rows is None else min(rows, self.rows)
+
+        return buffer[self.start + self.rows - rows : self.start + self.rows]
+
+    def last(self, column):
+        if self.rows == 0:
+            return np.nan
+
+        return self.window(column, 1)[0]
+
+    def frame(self, rows=None):
+        """
+        DataFrame with the last rows (all of them by default), built only when asked for and cached until
+        the next append.
+        """
+        key = (self.version, rows)
+        if self._frame_key != key:
+            frame = {"timestamp": self.window("timestamp", rows)}
+            for a_column in self.columns:
+                frame[a_column] = self.window(a_column, rows)
+
+            self._frame = pd.DataFrame(frame)  # copies, so it stays valid after the next append
+            self._frame_key = key
+
+        return self._frame
+
+    def load_arrays(self, timestamps, values):
+        """
+        Replace the contents of the store with the last max_rows rows of these arrays, in bulk.
+
+        Args:
+            timestamps (array): int64 epoch seconds.
+            values (dict): column name -> array with one value per timestamp; other columns are set to NaN.
+        """
+        rows = min(len(timestamps), self.capacity)
+        self.start = 0
+        self.rows = rows
+
+        # Both halves of each buffer get a copy, see append()
+        self.timestamps[:] = 0
+        if rows > 0:
+            self.timestamps[:rows] = timestamps[-rows:]
+            self.timestamps[self.capacity : self.capacity + rows] = timestamps[-rows:]
+
+        for a_column, a_buffer in self.columns.items():
+            a_buffer[:] = np.nan
+            if a_column in values and rows > 0:
+                a_buffer[:rows] = values[a_column][-rows:]
+                a_buffer[self.capacity : self.capacity + rows] = values[a_column][-rows:]
+
+        self.version += 1
+
+    def load_frame(self, data):
+        """
+        Fill the store from a saved DataFrame. Timestamps saved as "%Y-%m-%d %H:%M" strings are converted
+        to epoch seconds. Only the last max_rows rows are kept.
+        """
+        data = data.tail(self.capacity)
+        if "timestamp" in data.columns and pd.api.types.is_numeric_dtype(data["timestamp"]):
+            timestamps = data["timestamp"].to_numpy(dtype=np.int64)
+        elif "timestamp" in data.columns:
+            timestamps = [
+                int(datetime.strptime(a_timestamp, "%Y-%m-%d %H:%M").timestamp())
+                for a_timestamp in data["timestamp"]
+            ]
+        else:
+            timestamps = np.zeros(len(data), dtype=np.int64)
+
+        values = {
+            a_column: data[a_column].to_numpy(dtype=float)
+            for a_column in data.columns
+            if a_column in self.columns
+        }
+        self.load_arrays(np.asarray(timestamps, dtype=np.int64), values)
+
+    def memory_report(self):
+        """
+        Bytes allocated for each column; this is fixed at creation time and doesn't grow with the history.
+        """
+        report = {"timestamp": self.timestamps.nbytes}
+        for a_column, a_buffer in self.columns.items():
+            report[a_column] = a_buffer.nbytes
+
+        report["total"] = sum(report.values())
+        return report
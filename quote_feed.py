@@ -0,0 +1,135 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from metrics import endpoint, errors
+
+# One Robinhood quote, as last fetched (fetched_at is in epoch seconds, latency in seconds)
+quote = namedtuple("quote", ["symbol", "bid", "ask", "mark", "fetched_at", "latency"])
+
+
+class quote_feed:
+    """
+    Keeps the latest Robinhood quote of every symbol in memory, so the trader and the thief loop can read a price
+    without making a network call. A background thread fetches the quotes of all the symbols concurrently once
+    every `cadence` seconds and publishes them as a new snapshot; the snapshot is never modified once published,
+    so reading it doesn't need a lock. A symbol whose quote couldn't be refreshed keeps its previous quote until it
+    is older than `max_age` and flagged as stale.
+
+    Args:
+        symbols (list): e.g. ['BTC', 'ETH'].
+        fetch (function): called with a symbol, returns Robinhood's quote (a dict with 'bid_price', 'ask_price' and
+            'mark_price'), e.g. r.orders.get_crypto_quote.
+        cadence (float, optional): seconds between two refreshes. Defaults to 15.
+        max_age (float, optional): seconds after which a quote is stale. Defaults to twice the cadence.
+        workers (int, optional): concurrent requests. Defaults to one per symbol, up to 32.
+    """
+
+    def __init__(self, symbols, fetch, cadence=15, max_age=None, workers=None):
+        self.symbols = list(symbols)
+        self.fetch = fetch
+        self.cadence = cadence
+        self.max_age = max_age if max_age is not None else 2 * cadence
+        self.executor = ThreadPoolExecutor(max_workers=workers or max(1, min(len(self.symbols), 32)))
+        self.snapshot = {}  # symbol -> quote, replaced as a whole by every refresh
+        self.stopped = threading.Event()
+        self.thread = None
+        self.refreshes = 0
+        self.errors = 0
+        self.last_refresh = 0.0  # seconds taken by the most recent refresh (all the symbols)
+        self.max_refresh = 0.0
+        self.total_refresh = 0.0
+
+    def fetch_one(self, symbol):
+        start = time.perf_counter()
+        try:
+            tick = self.fetch(symbol)
+            latency = time.perf_counter() - start
+            endpoint("robinhood.get_crypto_quote").observe(latency)
+            return quote(
+                symbol,
+                float(tick["bid_price"]),
+                float(tick["ask_price"]),
+                float(tick["mark_price"]),
+                time.time(),
+                latency,
+            )
+        except Exception as e:
+            print("An exception occurred fetching the quote for " + str(symbol) + ": " + str(e))
+            errors("quote_feed").inc()
+            return None
+
+    def refresh(self):
+        # Fetch every symbol at once, then publish the new snapshot in a single assignment
+        start = time.perf_counter()
+        snapshot = dict(self.snapshot)
+        for a_quote in self.executor.map(self.fetch_one, self.symbols):
+            if a_quote is None:
+                self.errors += 1
+            else:
+                snapshot[a_quote.symbol] = a_quote
+        self.snapshot = snapshot
+
+        self.last_refresh = time.perf_counter() - start
+        self.max_refresh = max(self.max_refresh, self.last_refresh)
+        self.total_refresh += self.last_refresh
+        self.refreshes += 1
+
+    def run(self):
+        while not self.stopped.is_set():
+            start = time.monotonic()
+            self.refresh()
+            self.stopped.wait(max(0.0, self.cadence - (time.monotonic() - start)))
+
+    def start(self):
+        # The first snapshot is fetched before returning, so the quotes can be read right away
+        self.refresh()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.executor.shutdown(wait=False)
+
+    def get(self, symbol):
+        """
+        Returns:
+            quote: the latest quote of this symbol, None if it was never fetched.
+        """
+        return self.snapshot.get(symbol)
+
+    def age(self, symbol):
+        a_quote = self.snapshot.get(symbol)
+        return time.time() - a_quote.fetched_at if a_quote is not None else float("inf")
+
+    def is_stale(self, symbol):
+        return self.age(symbol) > self.max_age
+
+    def fresh(self, symbol):
+        """
+        Returns:
+            quote: the latest quote of this symbol, None if it was never fetched or is stale.
+        """
+        a_quote = self.snapshot.get(symbol)
+        if a_quote is None or time.time() - a_quote.fetched_at > self.max_age:
+            return None
+        return a_quote
+
+    def stats(self):
+        snapshot = self.snapshot
+        now = time.time()
+        ages = [now - a_quote.fetched_at for a_quote in snapshot.values()]
+        latencies = [a_quote.latency for a_quote in snapshot.values()]
+        return {
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "refresh_last": self.last_refresh,
+            "refresh_mean": self.total_refresh / self.refreshes if self.refreshes > 0 else 0.0,
+            "refresh_max": self.max_refresh,
+            "fetch_max": max(latencies) if len(latencies) > 0 else 0.0,
+            "age_max": max(ages) if len(ages) > 0 else float("inf"),
+            "stale": sorted(a_symbol for a_symbol in self.symbols if self.is_stale(a_symbol)),
+        }
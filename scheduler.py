@@ -0,0 +1,159 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from math import floor
+import time
+
+# Calls per second and burst size allowed for each endpoint the thief loop uses (config['rate_limits'] overrides them)
+default_rate_limits = {
+    "positions": (1.0, 1),  # r.get_crypto_positions
+    "orders": (0.2, 2),  # r.orders.order_crypto
+    "tradingview": (1.0, 3),  # TA_Handler.get_analysis, only when the cache doesn't have the analysis
+}
+
+
+class token_bucket:
+    """
+    Rate limiter for one endpoint: calls are allowed at `rate` per second on average, with bursts of up to `burst`
+    calls. acquire() waits (without blocking the event loop) until a call is allowed.
+
+    Args:
+        rate (float): calls per second, greater than 0; None for no limit.
+        burst (int, optional): calls that can be made back to back, at least 1. Defaults to 1.
+    """
+
+    def __init__(self, rate, burst=1):
+        # A rate of 0 (or a burst under 1) would never allow a call: to block an endpoint, don't call it
+        if rate is not None and not rate > 0:
+            raise ValueError("Rate limit must be greater than 0 calls per second (or None for no limit): " + str(rate))
+        if burst < 1:
+            raise ValueError("Rate limit burst must be at least 1 call: " + str(burst))
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.waited = 0.0  # total seconds spent waiting for a token
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self):
+        if self.rate is None:
+            return
+
+        start = time.monotonic()
+        self.refill()
+        while self.tokens < 1.0:
+            await asyncio.sleep((1.0 - self.tokens) / self.rate)
+            self.refill()
+
+        self.tokens -= 1.0
+        self.waited += time.monotonic() - start
+
+
+def rate_limiters(limits=None):
+    """
+    One token_bucket per endpoint.
+
+    Args:
+        limits (dict, optional): endpoint -> (calls per second, burst), or None for no limit on that endpoint.
+            Endpoints missing from it get default_rate_limits.
+    """
+    limits = dict(default_rate_limits, **(limits or {}))
+    return {
+        a_endpoint: token_bucket(*a_limit) if a_limit is not None else token_bucket(None)
+        for a_endpoint, a_limit in limits.items()
+    }
+
+
+class coin_scheduler:
+    """
+    Evaluates every coin concurrently, each one on its own fixed cadence: coin i is evaluated at
+    start + i * cadence / len(coins) + k * cadence, so the coins are spread evenly over the cadence and how long
+    it takes to get to a coin doesn't depend on how many other coins there are. If an evaluation runs past the
+    next due time, the slots it missed are skipped (and counted) instead of running late evaluations back to back.
+
+    Args:
+        coins (list): e.g. ['BTC', 'ETH'].
+        evaluate (function): coroutine function called with a coin.
+        cadence (float): seconds between two evaluations of the same coin.
+        every_cadence (function, optional): called once per cadence, before the first coin (housekeeping).
+        rounds (int, optional): evaluations of each coin before run() returns; None to run forever.
+        workers (int, optional): threads for the blocking calls (asyncio.to_thread). Defaults to one per coin, up to 64.
+    """
+
+    def __init__(self, coins, evaluate, cadence, every_cadence=None, rounds=None, workers=None):
+        self.coins = list(coins)
+        self.evaluate = evaluate
+        self.cadence = cadence
+        self.every_cadence = every_cadence
+        self.rounds = rounds
+        self.workers = workers or max(1, min(len(self.coins), 64))
+        self.latencies = {a_coin: [] for a_coin in self.coins}  # seconds taken by each evaluation
+        self.missed = {a_coin: 0 for a_coin in self.coins}  # slots skipped because an evaluation ran late
+        self.failures = {a_coin: 0 for a_coin in self.coins}  # evaluations that raised an exception
+        self.is_stopped = False
+
+    def stop(self):
+        self.is_stopped = True
+
+    async def sleep_until(self, due):
+        delay = due - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def next_slot(self, due):
+        now = asyncio.get_running_loop().time()
+        due += self.cadence
+        if due < now:
+            missed = floor((now - due) / self.cadence) + 1 if self.cadence > 0 else 0
+            due += missed * self.cadence
+            return due, missed
+
+        return due, 0
+
+    async def run_coin(self, coin, due):
+        rounds = 0
+        while not self.is_stopped and (self.rounds is None or rounds < self.rounds):
+            await self.sleep_until(due)
+            start = asyncio.get_running_loop().time()
+            try:
+                await self.evaluate(coin)
+            except Exception as e:
+                print("An exception occurred evaluating " + str(coin) + ": " + str(e))
+                self.failures[coin] += 1
+            self.latencies[coin].append(asyncio.get_running_loop().time() - start)
+            rounds += 1
+
+            due, missed = self.next_slot(due)
+            self.missed[coin] += missed
+
+    async def run_housekeeping(self, due):
+        rounds = 0
+        while not self.is_stopped and (self.rounds is None or rounds < self.rounds):
+            await self.sleep_until(due)
+            try:
+                self.every_cadence()
+            except Exception as e:
+                print("An exception occurred during housekeeping: " + str(e))
+            rounds += 1
+            due, missed = self.next_slot(due)
+
+    async def run(self):
+        if len(self.coins) == 0:
+            return  # nothing to evaluate, nor to spread over the cadence
+
+        # Enough threads that a coin never waits for another coin's network call to finish
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=self.workers))
+
+        start = asyncio.get_running_loop().time()
+        tasks = [
+            self.run_coin(a_coin, start + i * self.cadence / len(self.coins))
+            for i, a_coin in enumerate(self.coins)
+        ]
+        if self.every_cadence is not None:
+            tasks.insert(0, self.run_housekeeping(start))
+
+        await asyncio.gather(*tasks)
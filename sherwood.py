@@ -4,21 +4,40 @@
 # Version 1.1.0
 # Graham Waters
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from math import floor
 import pickle
-import time, random
+from random import randint
+from threading import Lock, Timer
+import time
+from charts import chart_renderer
 from config import config
 
+from history_store import history_store
+from indicators import indicator_engine
+from lazy import lazy_module
+from ledger import lot, lot_ledger
+from market_data import kraken_feed, kraken_stream
+from metrics import endpoint, errors, metrics, stage
+from order_journal import order_journal
+from price_store import price_store
+from quote_feed import quote_feed
+from scheduler import coin_scheduler, rate_limiters
+from signals import batch_signals, required_indicators, resolve_strategies
+from tradingview_cache import tradingview_cache
 from tradingview_config import (
     exchanges_dict,
 )  # this contains the exchange names for each currency pair.
-import pandas as pd
-from tradingview_ta import TA_Handler, Interval, Exchange
-import tradingview_ta
-from robin_stocks import *  # get all functions from robin_stocks
-import robin_stocks.robinhood as r
+import numpy as np
 import os.path as path
 
+# Imported the first time they're used: collecting prices or backtesting doesn't need them
+pd = lazy_module("pandas")
+tradingview_ta = lazy_module("tradingview_ta")
+r = lazy_module("robin_stocks.robinhood")
+
 
 simulate_pausing = False  # set to True to simulate pausing the bot for debugging purposes.
 
@@ -46,13 +65,13 @@ class signals:  #
         """
         assert type(ticker) == str
         pos_df = pd.DataFrame()  # hold the ta data for all of the tickers
-        output = TA_Handler(
+        # Cached until the current candle closes, so this only reaches TradingView once per interval
+        output_analysis = tradingview_cache.get_analysis(
             symbol=f"{ticker.upper()}USD",
-            screener="Crypto",
             exchange="COINBASE",
-            interval=Interval.INTERVAL_15_MINUTES,
+            screener="Crypto",
+            interval=tradingview_ta.Interval.INTERVAL_15_MINUTES,
         )
-        output_analysis = output.get_analysis()
         dict2 = (
             output_analysis.summary
         )  # get the summary dictionary. NOTE: Also available is the output_analysis.technical_indicators, for further analysis.
@@ -86,9 +105,10 @@ class record:
     timestamp = ""  # the time the trade was made
     order_type = ""  # 'buy' or 'sell'
 
-    def __init__(self, crypto_ticker, quantity, price, order_id, timestamp, order_type):
+    def __init__(self, crypto_ticker, quantity, price, order_id, timestamp, order_type, sell_order_id=None):
         """
-        Initialize the record class with the crypto ticker, quantity, price, order_id, timestamp, and order_type.
+        Initialize the record class with the crypto ticker, quantity, price, order_id, timestamp, and order_type
+        (and, for a sell_submitted event, the id of the sell order closing the position order_id).
         """
         self.crypto_ticker = crypto_ticker
         self.quantity = float(quantity)
@@ -96,9 +116,438 @@ class record:
         self.order_id = order_id
         self.timestamp = timestamp
         self.order_type = order_type
+        if sell_order_id is not None:
+            self.sell_order_id = sell_order_id
+
+
+class asset:
+    ticker = ""  # the ticker for the coin on Robinhood.
+    quantity = 0.0  # how much of the coin we hold from this order.
+    price = 0.0  # the price at which the coin was bought.
+    order_id = ""  # Robinhood order ID of the buy order
+
+    def __init__(self, ticker, quantity, price, order_id):
+        """
+        Initialize the asset class (a position opened by one of our buy orders) with the ticker, quantity, price and order_id.
+        """
+        self.ticker = ticker
+        self.quantity = float(quantity)
+        self.price = float(price)
+        self.order_id = order_id
+
+
+# Recorded at every tick (see metrics.py), looked up once here so each probe is only a few additions
+stage_seconds = {
+    a_stage: stage(a_stage)
+    for a_stage in ("tick", "fetch", "consistency", "cash", "reconcile", "sell_signals", "buy_signals", "orders", "persist")
+}
+tick_to_order_seconds = metrics.histogram(
+    "sherwood_tick_to_order_seconds", "Time from the start of a tick (or a streamed price update) to an order being sent"
+)
+ticks_total = metrics.counter("sherwood_ticks_total", "Ticks run")
+skipped_ticks_total = metrics.counter("sherwood_skipped_ticks_total", "Ticks without trading (missing or interrupted prices)")
+orders_total = {a_side: metrics.counter("sherwood_orders_total", "Orders sent", side=a_side) for a_side in ("buy", "sell")}
+
+ended_states = ("canceled", "cancelled", "rejected", "failed")  # final states of an order that didn't fill
+
+
+def sell_order_state(sell_order_id):
+    """
+    Look up how a sell order is doing on Robinhood, for the trader and the thief, which only close a position once
+    its sell order filled.
+
+    Returns:
+        tuple: (state, e.g. 'filled' or one of ended_states, quantity filled so far); (None, 0.0) if the order
+        couldn't be retrieved.
+    """
+    try:
+        with endpoint("robinhood.get_crypto_order_info").time():
+            order = r.get_crypto_order_info(sell_order_id)
+    except:
+        print("An exception occurred while retrieving the state of order #" + str(sell_order_id) + ".")
+        errors("order_info").inc()
+        return None, 0.0
+
+    return order.get("state"), float(order.get("cumulative_quantity") or 0)
+
+
+class checker:
+    def __init__(self):
+        self.stats_table = pd.DataFrame()  # Indicators for each ticker (one row per symbol, one column per indicator)
+
+    def check_price(self, ticker):
+        ticker_price = 0  # update with code for a query to robinhood
+        return ticker_price
+
+    def update_holdings(self, holdings_df):
+        # update the holdings from robinhood.
+        return
+
+    def check_order_status(self, order_id):  #
+        # update the order status from robinhood for the order that is referenced with "order_id".
+        return
+
+    def load_prices(self, new_store=price_store):
+        """
+        Set up the Kraken feed, the indicators and the price history, loaded from disk.
+
+        Args:
+            new_store (class, optional): store for the history, created with (columns, max_data_rows). Defaults
+                to price_store; the market-data bus passes shared_price_store (see market_bus.py).
+        """
+        self.kraken = kraken_feed(config["ticker_list"].keys())
+
+        # Only the indicators the configured strategies (and the charts) read are computed and stored
+        strategies = resolve_strategies(config["trade_strategies"])
+        lookback = max(a_strategy.lookback for a_strategy in strategies.values())
+        if config["max_data_rows"] < lookback:
+            raise ValueError(
+                "max_data_rows must be at least " + str(lookback) + " for the selected strategies"
+            )
+        self.indicators = indicator_engine(
+            config, required_indicators(strategies, config["save_charts"])
+        )
+
+        # Only track up to a fixed amount of data points
+        columns = []
+        for a_robinhood_ticker in config["ticker_list"].values():
+            columns += [a_robinhood_ticker] + self.indicators.columns(a_robinhood_ticker)
+        self.store = new_store(columns, config["max_data_rows"])
+        self.history = history_store(config["history_dir"], columns)
+
+        # Load data points: only the last rows are read (memory-mapped), however long the history is
+        timestamps, values = self.history.load(config["max_data_rows"])
+        if len(timestamps) > 0:
+            self.store.load_arrays(timestamps, values)
+        elif path.exists("dataframe.pickle"):
+            # History saved by an older version of the bot, import it once
+            print("Importing dataframe.pickle into " + str(config["history_dir"]))
+            self.store.load_frame(pd.read_pickle("dataframe.pickle"))
+            self.history.append_rows(
+                self.store.window("timestamp"),
+                {a_column: self.store.window(a_column) for a_column in columns},
+            )
+
+        # Find the interruptions in the saved data once, each new sample then only updates the counters
+        self.count_consecutive_samples()
+
+        # Replay the saved prices once so that each new sample only costs a constant-time update
+        for a_robinhood_ticker in config["ticker_list"].values():
+            self.indicators.warm_up(
+                a_robinhood_ticker, self.store.window(a_robinhood_ticker)
+            )
+
+        print(
+            "Price history: "
+            + str(self.store.memory_report()["total"])
+            + " bytes for "
+            + str(len(self.store.columns))
+            + " columns x "
+            + str(self.store.capacity)
+            + " rows"
+        )
+
+    def max_sample_gap(self):
+        # Longest time between two samples (in seconds) that doesn't count as an interruption
+        return config["minutes_between_updates"] * 120
+
+    def is_data_consistent(self, now, ticker=None):
+        """
+        Constant-time check that the price data has no interruption: the last sample is recent, and the last
+        min_consecutive_samples samples follow each other without any gap (see count_consecutive_samples).
 
+        Args:
+            now (datetime): current time.
+            ticker (str, optional): check the samples of this ticker instead of the rows. Defaults to None.
+        """
+        if self.store.rows <= 1:
+            return False
+
+        # Check for break between now and last sample
+        timediff = now.timestamp() - self.store.last("timestamp")
+
+        # Not enough data points available or it's been too long since we recorded any data
+        if timediff > self.max_sample_gap():
+            return False
+
+        # Check for break in sequence of samples to minimum consecutive sample number
+        column = "timestamp" if ticker is None else ticker
+        if (
+            self.store.rows - 1 >= self.min_consecutive_samples
+            and self.consecutive_samples.get(column, 0) - 1 < self.min_consecutive_samples
+        ):
+            print(
+                "Holding trades"
+                + ("" if ticker is None else " for " + str(ticker))
+                + ": interruption found in price data."
+            )
+            return False
+
+        return True
+
+    def count_consecutive_samples(self):
+        """
+        Rebuild the consecutive sample counters from the whole price history at once (np.diff over the epoch
+        timestamps), e.g. after loading saved data. A ticker's samples are the rows that have a price for it.
+        """
+        timestamps = self.store.window("timestamp")
+        self.consecutive_samples = {}
+        self.last_sample = {}
+
+        for a_column in ["timestamp"] + list(config["ticker_list"].values()):
+            if a_column == "timestamp":
+                sampled = timestamps
+            elif a_column in self.store.columns:
+                sampled = timestamps[~np.isnan(self.store.window(a_column))]
+            else:
+                continue
+
+            if len(sampled) == 0:
+                continue
+
+            # Samples after the last interruption
+            interruptions = np.flatnonzero(np.diff(sampled) > self.max_sample_gap())
+            self.consecutive_samples[a_column] = len(sampled) - (
+                interruptions[-1] + 1 if len(interruptions) > 0 else 0
+            )
+            self.last_sample[a_column] = int(sampled[-1])
+
+    def track_consecutive_samples(self, timestamp, tickers):
+        # Constant-time update of the counters for a new row, with a price for each of these tickers
+        for a_column in ["timestamp"] + list(tickers):
+            if timestamp - self.last_sample.get(a_column, timestamp) > self.max_sample_gap():
+                self.consecutive_samples[a_column] = 1
+            else:
+                self.consecutive_samples[a_column] = (
+                    self.consecutive_samples.get(a_column, 0) + 1
+                )
+            self.last_sample[a_column] = timestamp
+
+    def get_new_data(self, now, prices=None):
+        new_row = {}
+
+        self.is_trading_locked = False
+        timestamp = int(now.timestamp())
+
+        # Get the prices of all the pairs with a single request, unless they were streamed
+        if prices is not None:
+            pass
+        elif not config["debug_enabled"]:
+            try:
+                prices = self.kraken.fetch()
+            except:
+                print("An exception occurred retrieving prices.")
+                errors("fetch").inc()
+                self.is_trading_locked = True
+                return self.store
+
+            print(
+                "Fetched "
+                + str(len(prices))
+                + " prices in "
+                + str(round(self.kraken.last_latency * 1000, 1))
+                + " ms"
+            )
+        else:
+            prices = {
+                a_kraken_ticker: float(randint(10, 100))
+                for a_kraken_ticker in config["ticker_list"]
+            }
+
+        # Calculate moving averages and RSI values
+        for a_kraken_ticker, a_robinhood_ticker in config["ticker_list"].items():
+            if a_kraken_ticker not in prices:
+                print("No price returned for " + str(a_kraken_ticker))
+                continue
+
+            price = round(prices[a_kraken_ticker], 3)
+
+            # If the Kraken API is overloaded, they freeze the values it returns
+            if (
+                self.store.rows >= 3
+                and (self.store.window(a_robinhood_ticker, 3) == price).all()
+            ):
+                print(
+                    "Repeating values detected for "
+                    + str(a_robinhood_ticker)
+                    + ". Ignoring data point."
+                )
+                continue
 
-class trader:
+            # Only the new sample goes through the indicators, the history is never recomputed
+            new_row[a_robinhood_ticker] = price
+            new_row.update(self.indicators.update(a_robinhood_ticker, price))
+
+        # Exactly one row per tick, with every pair that returned a fresh price
+        if len(new_row) > 0:
+            self.store.append(timestamp, new_row)
+            self.history.append(timestamp, new_row)  # a single small write, the rest of the history is untouched
+            self.track_consecutive_samples(
+                timestamp,
+                [a_ticker for a_ticker in config["ticker_list"].values() if a_ticker in new_row],
+            )
+
+        if config["save_charts"] == True:
+            # Drawing happens in another process; only the coins that got a new price are submitted
+            if self.charts is None:
+                self.charts = chart_renderer()
+            for a_robinhood_ticker in config["ticker_list"].values():
+                self.charts.submit(
+                    a_robinhood_ticker,
+                    self.store.window("timestamp"),
+                    {
+                        a_column: self.store.window(a_column)
+                        for a_column in (
+                            a_robinhood_ticker,
+                            str(a_robinhood_ticker) + "_SMA_F",
+                            str(a_robinhood_ticker) + "_SMA_S",
+                        )
+                        if a_column in self.store.columns
+                    },
+                    version=self.last_sample.get(a_robinhood_ticker),
+                )
+
+        return self.store
+
+    def get_available_cash(self):
+        available_cash = -1.0
+
+        if not config["debug_enabled"]:
+            try:
+                with endpoint("robinhood.load_phoenix_account").time():
+                    me = r.account.load_phoenix_account(info=None)
+                available_cash = round(
+                    float(me["crypto_buying_power"]["amount"]) - config["reserve"], 3
+                )
+            except:
+                print("An exception occurred while reading available cash amount.")
+                errors("available_cash").inc()
+        else:
+            self.available_cash = randint(1000, 5000) + config["reserve"]
+
+        return available_cash
+
+    def retrieve_indicators(
+        symbol,
+        screener="crypto",
+        interval="15m",  # Interval.INTERVAL_15_MINUTES
+        exchange="BITFINEX",
+    ):
+        """
+        Gets indicators given a symbol and interval
+
+        Args:
+            symbol (_type_): _description_
+            screener (str, optional): _description_. Defaults to 'crypto'.
+            interval (_type_, optional): _description_. Defaults to Interval.INTERVAL_15_MINUTES.
+            exchange (str, optional): _description_. Defaults to 'BITFINEX'.
+
+        Returns:
+            _type_: _description_
+        """
+        result = tradingview_cache.get_analysis(
+            symbol=symbol,
+            exchange=exchange,
+            screener=screener,
+            interval=interval,
+        ).indicators  # this result can be parsed for the indicators desired.
+        return result
+
+    def retrieve_indicators_bulk(
+        symbols,
+        screener="crypto",
+        interval="15m",  # Interval.INTERVAL_15_MINUTES
+        default_exchange="BITFINEX",
+    ):
+        """
+        Gets indicators for several symbols with a single request to TradingView. Each symbol is looked up on
+        the exchange listed for it in tradingview_config.exchanges_dict.
+
+        Args:
+            symbols (list): currency pairs, e.g. ['BTCUSD', 'ETHUSD'].
+            screener (str, optional): TradingView screener. Defaults to 'crypto'.
+            interval (str, optional): candle interval. Defaults to Interval.INTERVAL_15_MINUTES.
+            default_exchange (str, optional): exchange for symbols missing from exchanges_dict. Defaults to 'BITFINEX'.
+
+        Returns:
+            pd.DataFrame: one row per symbol and one column per indicator; a symbol TradingView has no data for gets a row of NaN.
+        """
+        exchange_symbols = {
+            symbol: (exchanges_dict.get(symbol, default_exchange) + ":" + symbol).upper()
+            for symbol in symbols
+        }
+        analysis = tradingview_ta.get_multiple_analysis(
+            screener=screener,
+            interval=interval,
+            symbols=list(exchange_symbols.values()),
+        )
+
+        indicators = {}
+        for symbol, exchange_symbol in exchange_symbols.items():
+            result = analysis.get(exchange_symbol)
+            indicators[symbol] = result.indicators if result is not None else {}
+
+        return pd.DataFrame.from_dict(indicators, orient="index").reindex(symbols)
+
+    def get_tradingview_statsdict(self, tickers=None):  #
+        if not tickers:
+            tickers = [
+                "BTC",
+                "ETH",
+                "DOGE",
+                "ETC",
+                "SHIB",
+                "MATIC",
+                "UNI",
+                "XLM",
+                "LTC",
+                "LINK",
+            ]
+        coins_with_base = [str(str(coin) + "USD") for coin in tickers]
+        # One request for all of the currency pairs, however many there are
+        self.stats_table = checker.retrieve_indicators_bulk(
+            coins_with_base
+        )  # technical analysis results for each currency pair. updated every iteration.
+        return self.stats_table
+
+    def trading_view_suggestion(self, ticker='BTC'):
+        # Trading View suggestions for buying/selling/holding crypto
+        """
+        Takes in a ticker and returns a 1,-1, or 0 indicating whether or not to buy or sell the ticker. This is based on tradingview_ta data. The exchange this function utilizes is not Kraken. It is Coinbase.
+
+        Args:
+            ticker (str): the ticker of the crypto to check.
+        """
+        assert type(ticker) == str
+        pos_df = pd.DataFrame()  # hold the ta data for all of the tickers
+        # Cached until the current candle closes, so this only reaches TradingView once per interval
+        output_analysis = tradingview_cache.get_analysis(
+            symbol=f"{ticker.upper()}USD",
+            exchange="COINBASE",
+            screener="Crypto",
+            interval=tradingview_ta.Interval.INTERVAL_1_MINUTE,
+        )
+        dict2 = (
+            output_analysis.summary
+        )  # get the summary dictionary. NOTE: Also available is the output_analysis.technical_indicators, for further analysis.
+
+        buyScore = float(dict2["BUY"])
+        sellScore = float(dict2["SELL"])
+        neutralScore = float(dict2["NEUTRAL"])
+
+        if (
+            buyScore > sellScore and buyScore > neutralScore
+        ):  # if more suggestions for buy than sell and neutral.
+            return 1  # buy
+        elif (
+            sellScore > buyScore and sellScore > neutralScore
+        ):  # if more suggestions for sell than buy and neutral.
+            return -1
+        else:  #
+            return 0  # do not buy but don't sell either. This means that the ticker is neutral.
+
+
+class trader(checker):
     default_config = {
         "username": "",
         "password": "",
@@ -123,19 +572,42 @@ class trader:
         "minutes_between_updates": 5,
         "save_charts": True,
         "max_data_rows": 10000,
+        "history_dir": "history",
+        "orders_journal": "orders.journal",
+        "quote_feed_seconds": 0,
     }
-    data = pd.DataFrame()
-    orders = {}
+    store = None  # fixed-size columnar history of prices and indicators (see price_store.py)
+    orders = None  # the lots we hold, by order id (see ledger.py)
     min_share_increments = {}  # the smallest increment of a coin you can buy/sell
     min_price_increments = (
         {}
     )  # the smallest fraction of a dollar you can buy/sell a coin with
     min_consecutive_samples = 0
+    consecutive_samples = {}  # samples since the last interruption, for every row ('timestamp') and each ticker
+    last_sample = {}  # epoch timestamp of the last sample of every row ('timestamp') and each ticker
     available_cash = 0
     is_trading_locked = False  # used to determine if we have had a break in our incoming price data and hold buys if so
     is_new_order_added = False  # the bot performs certain cleanup operations after new orders are sent out
+    indicators = None  # running SMA/RSI/MACD state for each ticker, updated one sample at a time
+    strategies = None  # the buy and sell strategies selected in the config (see signals.resolve_strategies)
+    kraken = None  # fetches the prices of all the pairs in one request
+    kraken_stream = None  # pushes the prices in streaming mode (see stream)
+    kraken_pairs = {}  # Robinhood ticker -> Kraken pair
+    history = None  # append-only copy of every row on disk (see history_store.py)
+    journal = None  # append-only log of order events, the open positions are rebuilt from it (see order_journal.py)
+    legacy_orders = "orders.pickle"  # state saved by older versions of the bot, imported into an empty journal
+    pending_sells = None  # sell order id -> (lot, limit price) until the order fills or is cancelled (see reconcile_orders)
+    charts = None  # draws the charts in a separate process (see charts.py)
+    quotes = None  # latest Robinhood bid/ask of each coin, refreshed in the background (see quote_feed.py)
+    tick_started = 0.0  # epoch seconds at which the prices being acted on arrived, for tick_to_order_seconds
+    is_printing_prices = True  # print the last rows at every tick (formatting them takes longer than the rest of the tick)
     #!signal = signals()
 
+    @property
+    def data(self):
+        # Full history as a DataFrame, only built when something asks for it (cached until the next append)
+        return self.store.frame()
+
     def __init__(self):
         # Set Pandas to output all columns in the dataframe
         pd.set_option("display.max_columns", None)
@@ -143,7 +615,7 @@ class trader:
 
         print("-- Configuration ------------------------")
         for c in self.default_config:
-            isDefined = config.get(c)
+            isDefined = c in config  # a setting turned off (False, 0) is still defined
             if not isDefined:
                 config[c] = self.default_config[c]
 
@@ -164,21 +636,70 @@ class trader:
 
         print("-- End Configuration --------------------")
 
-        if path.exists("orders.pickle"):
+        # An unknown strategy stops the bot now, before logging in
+        self.strategies = resolve_strategies(config["trade_strategies"])
+        self.signal = batch_signals()
+        self.buy_strategy = getattr(self.signal, self.strategies["buy"].method)
+        self.sell_strategy = getattr(self.signal, self.strategies["sell"].method)
+
+        self.orders = lot_ledger()
+        self.pending_sells = {}
+        self.journal = order_journal(config["orders_journal"])
+        if len(self.journal.positions) == 0 and self.legacy_orders and path.exists(self.legacy_orders):
+            # State saved by an older version of the bot, import it once
+            print("Importing " + self.legacy_orders + " into " + str(config["orders_journal"]))
+            with open(self.legacy_orders, "rb") as f:
+                for a_key, a_asset in pickle.load(f).items():
+                    if not all(hasattr(a_asset, a_field) for a_field in ("ticker", "quantity", "price", "order_id")):
+                        # e.g. {'BTC': 0.05}, what older versions of the thief saved
+                        print("Skipping " + str(a_key) + " in " + self.legacy_orders + ": not a position (" + repr(a_asset) + ")")
+                        continue
+
+                    self.journal.log(
+                        "submitted",
+                        record(
+                            a_asset.ticker,
+                            a_asset.quantity,
+                            a_asset.price,
+                            a_asset.order_id,
+                            int(time.time()),
+                            "buy",
+                        ),
+                    )
+            self.journal.snapshot()
+
+        if len(self.journal.positions) > 0:
             # Load state
             print("Loading previously saved state")
-            with open("orders.pickle", "rb") as f:
-                self.orders = pickle.load(f)
+            for a_order_id, a_position in self.journal.positions.items():
+                if "sell_order_id" in a_position:
+                    # Being sold when we stopped: the first tick finds out whether the sell order went through
+                    self.pending_sells[a_position["sell_order_id"]] = (
+                        lot(
+                            a_position["crypto_ticker"],
+                            a_position["quantity"],
+                            a_position["price"],
+                            a_order_id,
+                            a_position.get("timestamp", 0),
+                            "buy",
+                        ),
+                        a_position["sell_price"],
+                    )
+                    self.is_new_order_added = True
+                    continue
+
+                self.orders.add(
+                    a_position["crypto_ticker"],
+                    a_position["quantity"],
+                    a_position["price"],
+                    a_order_id,
+                    a_position.get("timestamp", 0),
+                )
         else:
             # Start from scratch
             print("No state saved, starting from scratch")
 
-        # Load data points
-        if path.exists("dataframe.pickle"):
-            self.data = pd.read_pickle("dataframe.pickle")
-
-            # Only track up to a fixed amount of data points
-            self.data = self.data.tail(config["max_data_rows"] - 1)
+        self.load_prices()
 
         # Connect to RobinHood
         if not config["debug_enabled"]:
@@ -205,6 +726,18 @@ class trader:
             self.min_share_increments.update({a_robinhood_ticker: float(s_inc)})
             self.min_price_increments.update({a_robinhood_ticker: float(p_inc)})
 
+        # Prometheus scrapes http://127.0.0.1:<metrics_port>/metrics (or /metrics.json)
+        if config.get("metrics_port") and metrics.server is None:
+            metrics.serve(config["metrics_port"])
+
+        # Robinhood's own bid/ask, when enabled, are used for the limit prices instead of Kraken's price
+        if config["quote_feed_seconds"] and not config["debug_enabled"]:
+            self.quotes = quote_feed(
+                config["ticker_list"].values(),
+                lambda symbol: r.orders.get_crypto_quote(symbol),
+                config["quote_feed_seconds"],
+            ).start()
+
         # Initialize the available_cash amount
         self.available_cash = self.get_available_cash()
 
@@ -215,13 +748,191 @@ class trader:
     def cancel_order(self, order_id):
         if not config["debug_enabled"]:
             try:
-                cancelResult = r.cancel_crypto_order(order_id)
+                with endpoint("robinhood.cancel_crypto_order").time():
+                    cancelResult = r.cancel_crypto_order(order_id)
             except:
                 print("Got exception canceling order, will try again.")
+                errors("cancel_order").inc()
                 return False
 
         return True
 
+    def reconcile_orders(self):
+        """
+        Cancel our orders that are still open on Robinhood (not filled since they were sent). The open orders are
+        fetched once and indexed by id, so all our assets are matched in one pass, and the cancellations are sent
+        concurrently.
+
+        A buy order partly filled before being cancelled keeps the quantity that was filled. A sell order that is no
+        longer open is looked up: if it was filled, it closes its position in the journal ("sold"); if it was
+        cancelled, rejected or failed on Robinhood's side, its lot is held again, less what it sold. One still open is
+        cancelled and its lot is held again the same way.
+
+        Returns:
+            set: ids of the buy orders cancelled and removed from self.orders.
+        """
+        try:
+            with endpoint("robinhood.get_all_open_crypto_orders").time():
+                open_orders = r.get_all_open_crypto_orders()
+        except:
+            print("An exception occurred while retrieving list of open orders.")
+            errors("open_orders").inc()
+            return set()
+
+        open_orders = {a_order["id"]: a_order for a_order in open_orders}
+        for a_sell_order_id in [a_id for a_id in self.pending_sells if a_id not in open_orders]:
+            self.settle_sell(a_sell_order_id)
+
+        unfilled = [
+            (a_asset, open_orders[a_asset.order_id])
+            for a_asset in self.orders.all()
+            if a_asset.order_id in open_orders
+        ]
+        unfilled += [
+            (a_asset, open_orders[a_sell_order_id])
+            for a_sell_order_id, (a_asset, a_price) in self.pending_sells.items()
+            if a_sell_order_id in open_orders
+        ]
+        if len(unfilled) == 0:
+            return set()
+
+        with ThreadPoolExecutor(max_workers=min(len(unfilled), 16)) as executor:
+            is_cancelled = list(
+                executor.map(lambda unfilled_order: self.cancel_order(unfilled_order[1]["id"]), unfilled)
+            )
+
+        cancelled = set()
+        for (a_asset, a_order), a_is_cancelled in zip(unfilled, is_cancelled):
+            if not a_is_cancelled:
+                continue
+
+            filled = float(a_order.get("cumulative_quantity") or 0)
+            if a_order["side"] == "sell":
+                print(
+                    "Order #"
+                    + str(a_order["id"])
+                    + " (sell "
+                    + a_asset.ticker
+                    + ") was not filled ("
+                    + str(filled)
+                    + " of "
+                    + str(a_asset.quantity)
+                    + " sold). Cancelled, the rest is held again."
+                )
+
+                self.release_sell(a_order["id"], filled)
+                continue
+
+            if filled > 0:
+                print(
+                    "Order #"
+                    + str(a_order["id"])
+                    + " ("
+                    + a_order["side"]
+                    + " "
+                    + a_asset.ticker
+                    + ") was partially filled ("
+                    + str(filled)
+                    + " of "
+                    + str(a_asset.quantity)
+                    + "). Cancelled the rest."
+                )
+
+                self.orders.set_quantity(a_asset.order_id, filled)
+                self.journal.log(
+                    "filled",
+                    record(
+                        a_asset.ticker,
+                        filled,
+                        a_asset.price,
+                        a_asset.order_id,
+                        int(time.time()),
+                        a_order["side"],
+                    ),
+                )
+                continue
+
+            print(
+                "Order #"
+                + str(a_order["id"])
+                + " ("
+                + a_order["side"]
+                + " "
+                + a_asset.ticker
+                + ") was not filled. Cancelled and removed from orders."
+            )
+
+            self.orders.remove(a_asset.order_id)
+            self.journal.log(
+                "cancelled",
+                record(
+                    a_asset.ticker,
+                    a_asset.quantity,
+                    a_asset.price,
+                    a_asset.order_id,
+                    int(time.time()),
+                    a_order["side"],
+                ),
+            )
+            cancelled.add(a_asset.order_id)
+
+        return cancelled
+
+    def settle_sell(self, sell_order_id):
+        """
+        Close or restore the lot of a pending sell order that is no longer open on Robinhood, depending on how it
+        ended. An order whose state can't be retrieved, or isn't final yet, stays pending until the next tick.
+        """
+        state, filled = sell_order_state(sell_order_id)
+        a_asset, a_price = self.pending_sells[sell_order_id]
+        if state == "filled":
+            self.journal.log(
+                "sold", record(a_asset.ticker, a_asset.quantity, a_price, a_asset.order_id, int(time.time()), "sell")
+            )
+            del self.pending_sells[sell_order_id]
+        elif state in ended_states:
+            print(
+                "Order #"
+                + str(sell_order_id)
+                + " (sell "
+                + a_asset.ticker
+                + ") was "
+                + state
+                + " ("
+                + str(filled)
+                + " of "
+                + str(a_asset.quantity)
+                + " sold), the rest is held again."
+            )
+            self.release_sell(sell_order_id, filled)
+
+    def release_sell(self, sell_order_id, filled):
+        # A sell order that ended without selling the whole lot: the part it sold is closed in the journal, the rest
+        # is back in our orders, and no longer waiting on a sell order in the journal
+        a_asset, a_price = self.pending_sells.pop(sell_order_id)
+        if filled > 0:
+            self.journal.log("sold", record(a_asset.ticker, filled, a_price, a_asset.order_id, int(time.time()), "sell"))
+
+        self.orders.add(a_asset.ticker, a_asset.quantity - filled, a_asset.price, a_asset.order_id, a_asset.timestamp)
+        self.journal.log(
+            "filled",
+            record(a_asset.ticker, a_asset.quantity - filled, a_asset.price, a_asset.order_id, a_asset.timestamp, "buy"),
+        )
+
+    def last_price(self, ticker, side):
+        # Robinhood's ask (buying) or bid (selling) if the quote feed has a fresh one, then the latest streamed
+        # price, Kraken's last sample otherwise
+        if self.quotes is not None:
+            a_quote = self.quotes.fresh(ticker)
+            if a_quote is not None:
+                return a_quote.ask if side == "buy" else a_quote.bid
+
+        if self.kraken_stream is not None and self.kraken_pairs.get(ticker) in self.kraken_stream.latest:
+            bid, ask, updated = self.kraken_stream.latest[self.kraken_pairs[ticker]]
+            return ask if side == "buy" else bid
+
+        return self.store.last(ticker)
+
     def buy(self, ticker):
         if (
             self.available_cash < config["buy_amount_per_trade"]
@@ -232,7 +943,7 @@ class trader:
         # Values need to be specified to no more precision than listed in min_price_increments.
         # Truncate to 7 decimal places to avoid floating point problems way out at the precision limit
         price = round(
-            floor(self.data.iloc[-1][ticker] / self.min_price_increments[ticker])
+            floor(self.last_price(ticker, "buy") / self.min_price_increments[ticker])
             * self.min_price_increments[ticker],
             7,
         )
@@ -253,14 +964,20 @@ class trader:
 
         if config["trades_enabled"] and not config["debug_enabled"]:
             try:
-                buy_info = r.order_buy_crypto_limit(str(ticker), quantity, price)
+                with endpoint("robinhood.order_buy_crypto_limit").time():
+                    buy_info = r.order_buy_crypto_limit(str(ticker), quantity, price)
+                orders_total["buy"].inc()
+                tick_to_order_seconds.observe(time.time() - self.tick_started)
 
                 # Add this new asset to our orders
-                self.orders[buy_info["id"]] = asset(
-                    ticker, quantity, price, buy_info["id"]
+                self.orders.add(ticker, quantity, price, buy_info["id"], int(time.time()))
+                self.journal.log(
+                    "submitted",
+                    record(ticker, quantity, price, buy_info["id"], int(time.time()), "buy"),
                 )
             except:
                 print("Got exception trying to buy, aborting.")
+                errors("buy").inc()
                 return False
 
         return True
@@ -274,7 +991,7 @@ class trader:
         # Truncate to 7 decimal places to avoid floating point problems way out at the precision limit
         price = round(
             floor(
-                self.data.iloc[-1][asset.ticker]
+                self.last_price(asset.ticker, "sell")
                 / self.min_price_increments[asset.ticker]
             )
             * self.min_price_increments[asset.ticker],
@@ -296,24 +1013,104 @@ class trader:
 
         if config["trades_enabled"] and not config["debug_enabled"]:
             try:
-                sell_info = r.order_sell_crypto_limit(
-                    str(asset.ticker), asset.quantity, price
+                with endpoint("robinhood.order_sell_crypto_limit").time():
+                    sell_info = r.order_sell_crypto_limit(
+                        str(asset.ticker), asset.quantity, price
+                    )
+                orders_total["sell"].inc()
+                tick_to_order_seconds.observe(time.time() - self.tick_started)
+
+                # The position is only closed ("sold") once the order went through, see reconcile_orders
+                self.journal.log(
+                    "sell_submitted",
+                    record(
+                        asset.ticker,
+                        asset.quantity,
+                        price,
+                        asset.order_id,
+                        int(time.time()),
+                        "sell",
+                        sell_info["id"],
+                    ),
                 )
+                self.pending_sells[sell_info["id"]] = (asset, price)
 
                 # Mark this asset as sold, the garbage collector (see 'run' method) will remove it from our orders at the next iteration
-                self.orders[asset.order_id].quantity = 0
+                self.orders.set_quantity(asset.order_id, 0)
             except:
                 print("Got exception trying to sell, aborting.")
+                errors("sell").inc()
                 return False
 
         return True
 
-    def run(self):
-        now = datetime.now()
-        self.data = self.get_new_data(now)
+    def check_stop_loss(self, ticker):
+        # Between two bars (streaming mode): sell the assets of this coin whose price fell below the stop-loss
+        self.tick_started = self.kraken_stream.latest[self.kraken_pairs[ticker]][2]
+        if ticker not in self.orders.ticker_ids:
+            return
+
+        # Only this coin's price matters, the others are left at NaN (never below the stop-loss)
+        prices = np.full(len(self.orders.tickers), np.nan)
+        prices[self.orders.ticker_ids[ticker]] = self.last_price(ticker, "sell")
+        stop_loss = self.orders.triggers(prices, config["stop_loss_threshold"])[0]
+        for a_asset in [self.orders.lot(a_row) for a_row in np.flatnonzero(stop_loss)]:
+            self.is_new_order_added = self.sell(a_asset) or self.is_new_order_added
+
+    def price_vector(self):
+        # Latest price of every ticker of the ledger, indexed by ticker id (see lot_ledger.valuation); NaN for a
+        # ticker we don't follow (not in ticker_list anymore, or in a shard, another shard's slice), which never
+        # triggers the stop-loss
+        followed = set(config["ticker_list"].values())
+        return np.array(
+            [
+                self.last_price(a_ticker, "sell") if a_ticker in followed else np.nan
+                for a_ticker in self.orders.tickers
+            ],
+            dtype=float,
+        )
 
-        # Schedule the next iteration
-        Timer(config["minutes_between_updates"] * 60, self.run).start()
+    def stream(self, bars=None):
+        """
+        Streaming mode, used instead of run(): Kraken pushes the prices over a WebSocket, the strategies are
+        evaluated as soon as each bar of minutes_between_updates closes, and the stop-loss is checked on every
+        price update in between.
+
+        Args:
+            bars (int, optional): bars to evaluate before returning. Defaults to None, to run forever.
+        """
+        self.kraken_pairs = {
+            a_robinhood_ticker: a_kraken_ticker
+            for a_kraken_ticker, a_robinhood_ticker in config["ticker_list"].items()
+        }
+        self.kraken_stream = kraken_stream(
+            config["ticker_list"].keys(), config["minutes_between_updates"] * 60
+        ).start()
+
+        evaluated = 0
+        try:
+            while bars is None or evaluated < bars:
+                event = self.kraken_stream.events.get()
+                if event[0] == "bar":
+                    prices = {a_pair: a_bar[3] for a_pair, a_bar in event[2].items()}
+                    self.run(prices, datetime.fromtimestamp(event[1]))
+                    evaluated += 1
+                elif self.kraken_stream.price(event[1]) is not None:
+                    self.check_stop_loss(config["ticker_list"][event[1]])
+        finally:
+            self.kraken_stream.stop()
+
+    def run(self, prices=None, now=None):
+        now = now or datetime.now()
+        self.tick_started = now.timestamp()
+        ticks_total.inc()
+        start = time.perf_counter()
+        self.get_new_data(now, prices)
+        stage_seconds["fetch"].observe(time.perf_counter() - start)
+
+        # Schedule the next iteration (in streaming mode, the next bar does)
+        if prices is None:
+            Timer(config["minutes_between_updates"] * 60, self.run).start()
 
         # Print state
         print(
@@ -321,355 +1118,107 @@ class trader:
             + str(datetime.now().strftime("%Y-%m-%d %H:%M"))
             + " ---------------------"
         )
-        print(self.data.tail())
+        if self.is_printing_prices:
+            print(self.store.frame(5))
 
         # We don't have enough consecutive data points to decide what to do
+        # (each stage is timed with observe(), cheaper than a with block, see metrics.histogram)
+        stage_start = time.perf_counter()
         self.is_trading_locked = not self.is_data_consistent(now)
+        stage_seconds["consistency"].observe(time.perf_counter() - stage_start)
+        if self.is_trading_locked:
+            skipped_ticks_total.inc()
 
         # Let's make sure we have the correct cash amount available for trading
         if self.is_new_order_added or self.available_cash < 0:
+            stage_start = time.perf_counter()
             self.available_cash = self.get_available_cash()
+            stage_seconds["cash"].observe(time.perf_counter() - stage_start)
+
+        tickers = list(config["ticker_list"].values())
+
+        # Do we have any orders not filled on the platform? (swing/miss)
+        if self.is_new_order_added:
+            stage_start = time.perf_counter()
+            self.reconcile_orders()
+            stage_seconds["reconcile"].observe(time.perf_counter() - stage_start)
+
+            # We're done processing new orders (a sell order we couldn't cancel is looked at again at the next tick)
+            self.is_new_order_added = len(self.pending_sells) > 0
 
         if len(self.orders) > 0:
             print("-- Orders -------------------------------")
 
-            for a_asset in list(self.orders.values()):
-                # Check if any of these open orders on Robinhood are ours
-                is_asset_deleted = False
-
-                # Do we have any orders not filled on the platform? (swing/miss)
-                if self.is_new_order_added:
-                    try:
-                        open_orders = r.get_all_open_crypto_orders()
-                    except:
-                        print(
-                            "An exception occurred while retrieving list of open orders."
-                        )
-                        open_orders = []
-
-                    for a_order in open_orders:
-                        if a_order["id"] == a_asset.order_id and self.cancel_order(
-                            a_order["id"]
-                        ):
-                            print(
-                                "Order #"
-                                + str(a_order["id"])
-                                + " ("
-                                + a_order["side"]
-                                + " "
-                                + a_asset.ticker
-                                + ") was not filled. Cancelled and removed from orders."
-                            )
-
-                            self.orders.pop(a_asset.order_id)
-                            is_asset_deleted = True
-
-                    # We're done processing new orders
-                    self.is_new_order_added = False
-
-                if not is_asset_deleted:
-                    # Print a summary of all our assets
-                    print(str(a_asset.ticker) + ": " + str(a_asset.quantity), end="")
-
-                    if a_asset.quantity > 0.0:
-                        cost = a_asset.quantity * a_asset.price
-                        print(
-                            " | Price: $"
-                            + str(round(a_asset.price, 3))
-                            + " | Cost: $"
-                            + str(round(cost, 3))
-                            + " | Current value: $"
-                            + str(
-                                round(
-                                    self.data.iloc[-1][a_asset.ticker]
-                                    * a_asset.quantity,
-                                    3,
-                                )
-                            )
-                        )
-                    else:
-                        # We sold this asset during the previous iteration, and it wasn't still pending here above
-                        # We can remove it from our orders safely (garbage collector)
-                        self.orders.pop(a_asset.order_id)
-                        print("\n")
-
-                    # Is it time to sell any of them?
-                    if (
-                        getattr(
-                            self.signal,
-                            "sell_" + str(config["trade_strategies"]["sell"]),
-                        )(a_asset, self.data)
-                        or
-                        # Stop-loss: is the current price below the purchase price by the percentage defined in the config file?
-                        (
-                            self.data.iloc[-1][a_asset.ticker]
-                            < a_asset.price
-                            - (a_asset.price * config["stop_loss_threshold"])
-                        )
-                    ):
-                        self.is_new_order_added = (
-                            self.sell(a_asset) or self.is_new_order_added
-                        )
+            # We sold these assets during the previous iteration, and they weren't still pending here above
+            # We can remove them from our orders safely (garbage collector)
+            self.orders.remove_sold()
+
+            # Evaluate the sell strategy, the value and the stop-loss of all of our assets in one pass
+            stage_start = time.perf_counter()
+            sell_signals = self.sell_strategy(tickers, self.orders, self.store)
+            prices = self.price_vector()
+            valuation = self.orders.valuation(prices)
+            # Stop-loss: is the current price below the purchase price by the percentage defined in the config file?
+            stop_loss = self.orders.triggers(prices, config["stop_loss_threshold"])[0]
+            stage_seconds["sell_signals"].observe(time.perf_counter() - stage_start)
+
+            # Print a summary of all our assets
+            lots = self.orders.view()
+            for a_row in range(len(self.orders)):
+                print(
+                    str(self.orders.tickers[lots["ticker"][a_row]])
+                    + ": "
+                    + str(lots["quantity"][a_row])
+                    + " | Price: $"
+                    + str(round(lots["price"][a_row], 3))
+                    + " | Cost: $"
+                    + str(round(valuation["cost"][a_row], 3))
+                    + " | Current value: $"
+                    + str(round(valuation["value"][a_row], 3))
+                )
+            print(
+                "Total cost: $"
+                + str(round(valuation["total_cost"], 3))
+                + " | Current value: $"
+                + str(round(valuation["total_value"], 3))
+                + " | Unrealized PnL: $"
+                + str(round(valuation["total_pnl"], 3))
+            )
 
-        # Buy?
-        for a_robinhood_ticker in config["ticker_list"].values():
-            if getattr(self.signal, "buy_" + str(config["trade_strategies"]["buy"]))(
-                a_robinhood_ticker, self.data
-            ):
+            # Is it time to sell any of them? (looked up before selling: sell() changes the quantities)
+            for a_asset in [self.orders.lot(a_row) for a_row in np.flatnonzero(sell_signals | stop_loss)]:
+                stage_start = time.perf_counter()
+                self.is_new_order_added = (
+                    self.sell(a_asset) or self.is_new_order_added
+                )
+                stage_seconds["orders"].observe(time.perf_counter() - stage_start)
+
+        # Buy? (evaluated for all tickers in one pass)
+        stage_start = time.perf_counter()
+        buy_signals = self.buy_strategy(tickers, self.store)
+        stage_seconds["buy_signals"].observe(time.perf_counter() - stage_start)
+        for a_robinhood_ticker, a_buy_signal in zip(tickers, buy_signals):
+            # A coin whose own prices were interrupted (missing or frozen) is held, even if the others are fine
+            if a_buy_signal and self.is_data_consistent(now, a_robinhood_ticker):
+                stage_start = time.perf_counter()
                 self.is_new_order_added = (
                     self.buy(a_robinhood_ticker) or self.is_new_order_added
                 )
+                stage_seconds["orders"].observe(time.perf_counter() - stage_start)
 
         # Final status for this iteration
         print("-- Bot Status ---------------------------")
         print("Buying power: $" + str(self.available_cash))
 
-        # Save state
-        with open("orders.pickle", "wb") as f:
-            pickle.dump(self.orders, f)
-
-        self.data.to_pickle("dataframe.pickle")
+        # Save state: every order event is already in the journal, make sure it's on disk
+        stage_start = time.perf_counter()
+        self.journal.sync()
+        stage_seconds["persist"].observe(time.perf_counter() - stage_start)
 
+        stage_seconds["tick"].observe(time.perf_counter() - start)
+        if config.get("metrics_file"):
+            metrics.write(config["metrics_file"])
 
-class checker:
-    def __init__(self):
-        self.stats_dict = {}  # Dictionary to hold stats for each ticker
-
-    def check_price(self, ticker):
-        ticker_price = 0  # update with code for a query to robinhood
-        return ticker_price
-
-    def update_holdings(self, holdings_df):
-        # update the holdings from robinhood.
-        return
-
-    def check_order_status(self, order_id):  #
-        # update the order status from robinhood for the order that is referenced with "order_id".
-        return
-
-    def is_data_consistent(self, now):
-        if self.data.shape[0] <= 1:
-            return False
-
-        # Check for break between now and last sample
-        timediff = now - datetime.strptime(
-            self.data.iloc[-1]["timestamp"], "%Y-%m-%d %H:%M"
-        )
-
-        # Not enough data points available or it's been too long since we recorded any data
-        if timediff.seconds > config["minutes_between_updates"] * 120:
-            return False
-
-        # Check for break in sequence of samples to minimum consecutive sample number
-        position = len(self.data) - 1
-        if position >= self.min_consecutive_samples:
-            for x in range(0, self.min_consecutive_samples):
-                timediff = datetime.strptime(
-                    self.data.iloc[position - x]["timestamp"], "%Y-%m-%d %H:%M"
-                ) - datetime.strptime(
-                    self.data.iloc[position - (x + 1)]["timestamp"], "%Y-%m-%d %H:%M"
-                )
-
-                if timediff.seconds > config["minutes_between_updates"] * 120:
-                    print("Holding trades: interruption found in price data.")
-                    return False
-
-        return True
-
-    def get_new_data(self, now):
-        new_row = {}
-
-        self.is_trading_locked = False
-        new_row["timestamp"] = now.strftime("%Y-%m-%d %H:%M")
-
-        # Calculate moving averages and RSI values
-        for a_kraken_ticker, a_robinhood_ticker in config["ticker_list"].items():
-            if not config["debug_enabled"]:
-                try:
-                    result = get_json(
-                        "https://api.kraken.com/0/public/Ticker?pair="
-                        + str(a_kraken_ticker)
-                    ).json()
-
-                    if len(result["error"]) == 0:
-                        new_row[a_robinhood_ticker] = round(
-                            float(result["result"][a_kraken_ticker]["a"][0]), 3
-                        )
-                except:
-                    print("An exception occurred retrieving prices.")
-                    self.is_trading_locked = True
-                    return self.data
-            else:
-                new_row[a_robinhood_ticker] = round(float(randint(10, 100)), 3)
-
-            self.data = self.data.append(new_row, ignore_index=True)
-
-            # If the Kraken API is overloaded, they freeze the values it returns
-            if (
-                self.data.tail(4)[a_robinhood_ticker].to_numpy()[-1]
-                == self.data.tail(4)[a_robinhood_ticker].to_numpy()
-            ).all():
-                print(
-                    "Repeating values detected for "
-                    + str(a_robinhood_ticker)
-                    + ". Ignoring data point."
-                )
-                self.data = self.data[:-1]
-            elif self.data.shape[0] > 0:
-                self.data[a_robinhood_ticker + "_SMA_F"] = (
-                    self.data[a_robinhood_ticker]
-                    .shift(1)
-                    .rolling(window=config["moving_average_periods"]["sma_fast"])
-                    .mean()
-                )
-                self.data[a_robinhood_ticker + "_SMA_S"] = (
-                    self.data[a_robinhood_ticker]
-                    .shift(1)
-                    .rolling(window=config["moving_average_periods"]["sma_slow"])
-                    .mean()
-                )
-                self.data[a_robinhood_ticker + "_RSI"] = RSI(
-                    self.data[a_robinhood_ticker].values,
-                    timeperiod=config["rsi_period"],
-                )
-                (
-                    self.data[a_robinhood_ticker + "_MACD"],
-                    self.data[a_robinhood_ticker + "_MACD_S"],
-                    macd_hist,
-                ) = MACD(
-                    self.data[a_robinhood_ticker].values,
-                    fastperiod=config["moving_average_periods"]["macd_fast"],
-                    slowperiod=config["moving_average_periods"]["macd_slow"],
-                    signalperiod=config["moving_average_periods"]["macd_signal"],
-                )
-
-            if config["save_charts"] == True:
-                slice = self.data[
-                    [
-                        a_robinhood_ticker,
-                        str(a_robinhood_ticker) + "_SMA_F",
-                        str(a_robinhood_ticker) + "_SMA_S",
-                    ]
-                ]
-                fig = slice.plot.line().get_figure()
-                fig.savefig(
-                    "chart-" + str(a_robinhood_ticker).lower() + "-sma.png", dpi=300
-                )
-                plt.close(fig)
-
-        return self.data
-
-    def get_available_cash(self):
-        available_cash = -1.0
-
-        if not config["debug_enabled"]:
-            try:
-                me = r.account.load_phoenix_account(info=None)
-                available_cash = round(
-                    float(me["crypto_buying_power"]["amount"]) - config["reserve"], 3
-                )
-            except:
-                print("An exception occurred while reading available cash amount.")
-        else:
-            self.available_cash = randint(1000, 5000) + config["reserve"]
-
-        return available_cash
-
-    def retrieve_indicators(
-        symbol,
-        screener="crypto",
-        interval=Interval.INTERVAL_15_MINUTES,
-        exchange="BITFINEX",
-    ):
-        """
-        Gets indicators given a symbol and interval
-
-        Args:
-            symbol (_type_): _description_
-            screener (str, optional): _description_. Defaults to 'crypto'.
-            interval (_type_, optional): _description_. Defaults to Interval.INTERVAL_15_MINUTES.
-            exchange (str, optional): _description_. Defaults to 'BITFINEX'.
-
-        Returns:
-            _type_: _description_
-        """
-        coin_data = TA_Handler(
-            symbol=symbol,
-            exchange=exchange,
-            screener=screener,
-            interval=interval,
-            timeout=None,
-        )
-        result = (
-            coin_data.get_analysis().indicators
-        )  # this result can be parsed for the indicators desired.
-        return result
-
-    def get_tradingview_statsdict(self, tickers):  #
-        stats_dict = (
-            {}
-        )  # will hold technical analysis results for each currency pair. updated every iteration.
-        tickers = [
-            "BTC",
-            "ETH",
-            "DOGE",
-            "ETC",
-            "SHIB",
-            "MATIC",
-            "UNI",
-            "XLM",
-            "LTC",
-            "LINK",
-        ]
-        coins_with_base = [str(str(coin) + "USD") for coin in tickers]
-        for ticker in coins_with_base:  # loop through each currency pair.
-            res = checker.retrieve_indicators(
-                ticker
-            )  # *get the technical analysis results for the coin designated by the variable: "ticker"
-            # res contains the indicators for the ticker
-            stats_dict[ticker] = res  # add results to our stats dictionary
-            if simulate_pausing:
-                time.sleep(
-                    random.randint(1, 3)
-                )  # sleep for a random amount of time between 1 and 3 seconds.
-        self.stats_dict = (
-            stats_dict  # update the dictionary of technical analysis results.
-        )
-    def trading_view_suggestion(self, ticker='BTC'):
-        # Trading View suggestions for buying/selling/holding crypto
-        """
-        Takes in a ticker and returns a 1,-1, or 0 indicating whether or not to buy or sell the ticker. This is based on tradingview_ta data. The exchange this function utilizes is not Kraken. It is Coinbase.
-
-        Args:
-            ticker (str): the ticker of the crypto to check.
-        """
-        assert type(ticker) == str
-        pos_df = pd.DataFrame()  # hold the ta data for all of the tickers
-        output = TA_Handler(
-            symbol=f"{ticker.upper()}USD",
-            screener="Crypto",
-            exchange="COINBASE",
-            interval=Interval.INTERVAL_1_MINUTE,
-        )
-        output_analysis = output.get_analysis()
-        dict2 = (
-            output_analysis.summary
-        )  # get the summary dictionary. NOTE: Also available is the output_analysis.technical_indicators, for further analysis.
-
-        buyScore = float(dict2["BUY"])
-        sellScore = float(dict2["SELL"])
-        neutralScore = float(dict2["NEUTRAL"])
-
-        if (
-            buyScore > sellScore and buyScore > neutralScore
-        ):  # if more suggestions for buy than sell and neutral.
-            return 1  # buy
-        elif (
-            sellScore > buyScore and sellScore > neutralScore
-        ):  # if more suggestions for sell than buy and neutral.
-            return -1
-        else:  #
-            return 0  # do not buy but don't sell either. This means that the ticker is neutral.
 
 class thief:
     # There are several options available
@@ -704,16 +1253,18 @@ class thief:
         self.sold_crypto = False # initialize
         self.orders = {}
         self.currentPrice = 0.00 # current price of whatever coin is being used
-        self.currentDataFrame = pd.DataFrame() # initialize
-        if path.exists("orders.pickle"):
-                # Load state
+        self.positions = {} # positions held on Robinhood, by currency code (see scout)
+        self.is_positions_stale = True # set after every order, the next lookup refreshes the positions
+        self.positions_lock = Lock() # coins are evaluated concurrently, only one of them refreshes the positions
+        self.last_dump = 0.0 # when the positions were last saved to df_master.csv
+        # Its own journal: the trader would otherwise replay the thief's buys as its lots, and sell them
+        self.journal = order_journal(config.get("thief_journal", "thief_orders.journal"))
+        self.orders = self.journal.positions # open positions, rebuilt from the journal
+        if len(self.orders) > 0:
             print("Loading previously saved state")
-            with open("orders.pickle", "rb") as f:
-                self.orders = pickle.load(f)
         else:
             # Start from scratch
             print("No state saved, starting from scratch")
-            pd.DataFrame(self.orders).to_pickle("dataframe.pickle")
         # Connect to RobinHood
         if not config["debug_enabled"]:
             try:
@@ -724,82 +1275,231 @@ class thief:
 
 
 
-        #? self.orders.to_pickle("dataframe.pickle")
     # actions
     def scout(self):
-        df_master = pd.DataFrame.from_dict(r.get_crypto_positions()).drop(
-            columns=["account_id", "cost_bases", "id", "updated_at"]
+        # One call to Robinhood for all the positions, indexed by currency code (done once per pass)
+        self.positions = {a_position['currency']['code']: a_position for a_position in r.get_crypto_positions()}
+        self.is_positions_stale = False
+    def position(self, ticker):
+        # cached position for this coin (quantity, quantity_available...), None if there isn't one
+        with self.positions_lock:
+            if self.is_positions_stale:
+                self.scout() # an order was sent since the last refresh
+        return self.positions.get(ticker)
+    def dump_positions(self, filename='df_master.csv'):
+        # Save the cached positions as a CSV file (the main loop does it every positions_csv_minutes, if set)
+        df_master = pd.DataFrame.from_dict(list(self.positions.values())).drop(
+            columns=["account_id", "cost_bases", "id", "updated_at"], errors='ignore'
             )
-        df_master.to_csv('df_master.csv')
-        self.currentDataFrame = df_master
+        df_master.to_csv(filename)
+        self.last_dump = time.time()
     def buy_robinhood_crypto_limit(self,ticker,limit_price):
         try:
             quantityOrPrice = config['buy_amount_per_trade'] # the buy amount per trade
-            r.orders.order_crypto(ticker,'buy',
+            order_info = r.orders.order_crypto(ticker,'buy',
                                   quantityOrPrice,
                                   amountIn='price',
                                   limitPrice=limit_price,
                                   timeInForce='gtc',
                                   jsonify=True)
+            self.log_order("submitted", ticker, order_info)
         except Exception:
             pass
-        # Save state
-        with open("orders.pickle", "wb") as f:
-            pickle.dump(self.orders, f)
 
     def buy_robinhood_crypto_dollars(self,ticker,dollars):
         try:
             quantityOrPrice = dollars # the buy amount per trade
-            r.orders.order_crypto(ticker,'buy',
+            order_info = r.orders.order_crypto(ticker,'buy',
                                   quantityOrPrice,
                                   amountIn='price',
                                   limitPrice=None,
                                   timeInForce='gtc',
                                   jsonify=True)
+            self.log_order("submitted", ticker, order_info)
         except Exception:
             pass
-        # Save state
-        with open("orders.pickle", "wb") as f:
-            pickle.dump(self.orders, f)
 
     def sell_robinhood_crypto_coins(self,ticker):
         try:
-            # hashing out the coin name from the embedded dictionary in the df_master
-            row_id = -1 # initializer for row
-            self.scout()
-            df_master = self.currentDataFrame
-            for i in range(0,len(df_master)):
-                coin_name = df_master['currency'][i]['code']
-                if coin_name == ticker:
-                    row_id = i # this is the row where our data lives.
-                    break
-            if row_id > -1:
+            position = self.position(ticker) # cached, refreshed once per pass or after an order
+            if position is not None:
                 #todo can limit decimal places with the string here
-                current_holdings = float(df_master['quantity'][row_id]) # ...or quantity available
+                current_holdings = float(position['quantity']) # ...or quantity available
                 digits = len(str(current_holdings)) # digits for this coin (maximum granularity)
                 quantityOrPrice = current_holdings/4 # one fourth of the quantity held.
                 quantityOrPrice = str(quantityOrPrice)[0:int(digits)]
                 quantityOrPrice = float(quantityOrPrice)
-                r.orders.order_crypto(ticker,'sell',
+                order_info = r.orders.order_crypto(ticker,'sell',
                                     quantityOrPrice,
                                     amountIn='quantity',
                                     limitPrice=None,
                                     timeInForce='gtc',
                                     jsonify=True)
                 print("order submitted for a sell of ",quantityOrPrice," ",ticker)
+                self.log_sale(ticker, order_info)
             else:
-                print("row id issue")
+                print("no position found for ", ticker)
         except Exception as e:
             pass
-        # Save state
-        current_holdings = current_holdings - quantityOrPrice
-        self.orders['BTC'] = current_holdings
-        with open("orders.pickle", "wb") as f:
-            pickle.dump(self.orders, f)
+
+    def log_order(self, event, ticker, order_info):
+        self.is_positions_stale = True # the order changes what we hold
+        # Save state: a single line appended to the order journal
+        self.journal.log(event, record(ticker,
+                                       order_info.get('quantity') or 0.0,
+                                       order_info.get('price') or 0.0,
+                                       order_info['id'],
+                                       int(time.time()),
+                                       order_info.get('side', 'buy' if event == 'submitted' else 'sell')))
+
+    def log_sale(self, ticker, order_info):
+        # The positions are keyed by their buy order: the quantity sold is taken from ours in this coin, oldest
+        # first. They're marked with the sell order, and only closed once it filled (see settle_sells)
+        self.is_positions_stale = True
+        remaining = float(order_info.get('quantity') or 0.0)
+        with self.journal.lock: # coins are evaluated concurrently
+            positions = sorted(
+                [(a_position.get('timestamp', 0), a_order_id, a_position['quantity'])
+                 for a_order_id, a_position in self.journal.positions.items()
+                 if a_position['crypto_ticker'] == ticker and 'sell_order_id' not in a_position])
+            for a_timestamp, a_order_id, a_quantity in positions:
+                if remaining <= 0:
+                    break
+                self.journal.log("sell_submitted", record(ticker,
+                                                          min(remaining, a_quantity),
+                                                          order_info.get('price') or 0.0,
+                                                          a_order_id,
+                                                          int(time.time()),
+                                                          'sell',
+                                                          order_info['id']))
+                remaining -= a_quantity
+
+    def settle_sells(self):
+        """
+        Close the positions of the sell orders that filled, and put back those of the orders cancelled, rejected
+        or failed on Robinhood's side (less what they sold), like the trader does (see sell_order_state). An
+        order that isn't final yet is checked again at the next call (the main loop makes one per cadence).
+        """
+        with self.journal.lock:
+            sells = {} # sell order id -> [(buy order id, position)], oldest first
+            for a_order_id, a_position in sorted(self.journal.positions.items(), key=lambda item: item[1].get('timestamp', 0)):
+                if 'sell_order_id' in a_position:
+                    sells.setdefault(a_position['sell_order_id'], []).append((a_order_id, dict(a_position)))
+
+        for a_sell_order_id, a_positions in sells.items():
+            state, filled = sell_order_state(a_sell_order_id)
+            if state == 'filled':
+                filled = sum(a_position['sell_quantity'] for a_order_id, a_position in a_positions)
+            elif state in ended_states:
+                print("Order #" + str(a_sell_order_id), "(sell", a_positions[0][1]['crypto_ticker'] + ") was", state,
+                      "(" + str(filled), "sold), the rest is held again.")
+            else:
+                continue
+
+            self.is_positions_stale = True
+            for a_order_id, a_position in a_positions:
+                sold = min(filled, a_position['sell_quantity'])
+                filled -= sold
+                if sold > 0:
+                    # Closes or reduces the position, which isn't waiting on a sell order anymore
+                    self.journal.log("sold", record(a_position['crypto_ticker'],
+                                                    sold,
+                                                    a_position['sell_price'],
+                                                    a_order_id,
+                                                    int(time.time()),
+                                                    'sell'))
+                else:
+                    self.journal.log("filled", record(a_position['crypto_ticker'],
+                                                      a_position['quantity'],
+                                                      a_position['price'],
+                                                      a_order_id,
+                                                      a_position.get('timestamp', 0),
+                                                      'buy'))
 
 bought_prices = {}
 bought_signals = {}
 
+
+async def steal(Sherrif, MaidMarian, ticker, limits, quotes):
+    """
+    One evaluation of a single coin by the thief: check the position, the quote and the TradingView suggestion,
+    then buy or sell. Every call to Robinhood or TradingView first waits for a token from the rate limiter of
+    its endpoint, then runs in a worker thread so the other coins keep being evaluated in the meantime.
+
+    Args:
+        Sherrif (thief): places the orders.
+        MaidMarian (checker): provides the TradingView suggestions.
+        ticker (str): the coin, e.g. 'BTC'.
+        limits (dict): endpoint -> token_bucket, see scheduler.rate_limiters.
+        quotes (quote_feed): latest Robinhood quotes, read without a network call.
+    """
+    try:
+        bought = bought_signals[ticker]
+    except Exception:
+        bought = False
+    print("Running on Coin: ",ticker," bought is currently ", bought)
+    #ticker = 'BTC'
+    #!Sherrif.buy_robinhood_crypto_dollars(ticker,1.00) # market order order
+    if Sherrif.is_positions_stale:
+        await limits['positions'].acquire()
+    position = await asyncio.to_thread(Sherrif.position, ticker) # positions are fetched once per cadence, not once per coin
+    if position is not None:
+        current_holdings = float(position['quantity'])
+
+    tick = quotes.fresh(ticker) # refreshed in the background for all the coins at once
+    if tick is None:
+        print("No recent quote for ", ticker, ", skipping it")
+        return
+    currentPrice = tick.mark # current price
+    currentSpread = abs(tick.bid - tick.ask)
+    try:
+        boughtPrice = bought_prices[ticker] # initialize
+    except Exception: #
+        boughtPrice = currentPrice
+    #?current_holdings
+    Sell_Conditions_Met = False
+    val = boughtPrice - currentPrice
+    formatted_string = "{:.9f}".format(val)
+
+
+    if not tradingview_cache.is_cached(f"{ticker.upper()}USD", "COINBASE", "Crypto", tradingview_ta.Interval.INTERVAL_1_MINUTE):
+        await limits['tradingview'].acquire()
+    tv = await asyncio.to_thread(MaidMarian.trading_view_suggestion, ticker)
+
+    if boughtPrice + currentSpread < currentPrice or tv == -1:
+        Sell_Conditions_Met = True #
+    else: #
+        pass
+
+    #//guess_price = currentPrice - currentPrice*0.0001 # 1% less than current price
+    #//print("guessing price:  ", guess_price)
+
+    if not bought and tv == 1: # trading view suggests buy
+        try:
+            await limits['orders'].acquire()
+            await asyncio.to_thread(Sherrif.buy_robinhood_crypto_dollars, ticker, 2.00)
+            #//Sherrif.buy_robinhood_crypto_limit(ticker,guess_price)
+            bought = True
+            boughtPrice = currentPrice
+            bought_prices[ticker] = boughtPrice
+        except Exception:
+            pass
+    elif Sell_Conditions_Met: #* when not bought: sell balances not reflected by 'bought' variable
+        try: #
+            if Sherrif.is_positions_stale:
+                await limits['positions'].acquire()
+            await limits['orders'].acquire()
+            await asyncio.to_thread(Sherrif.sell_robinhood_crypto_coins, ticker)
+            if bought:
+                bought_prices[ticker] = -1 # remove the price from the prices
+        except Exception:
+            pass
+    else: #
+        print("Neither event received")
+    print(f'tv:{tv}, bought:{bought}')
+    bought_signals[ticker] = bought # save the signal
+
+
 if __name__ == "__main__":
 
     login = r.login(config['username'], config['password'])
@@ -808,75 +1508,30 @@ if __name__ == "__main__":
     #LittleJohn = trader()  # initialize the trader class
     Sherrif = thief() # initialize the thief class
 
-    bought = False
-    coin_names = ['BTC','ETH','DOGE','ETC','SHIB','MATIC','UNI',"XLM",'LTC','LINK']
-    while True:
-        print("Running Over The Coins...")
-        for ticker in coin_names:
-            try:
-                bought = bought_signals[ticker]
-            except Exception:
-                bought = False
-            print("Running on Coin: ",ticker," bought is currently ", bought)
-            #ticker = 'BTC'
-            #!Sherrif.buy_robinhood_crypto_dollars(ticker,1.00) # market order order
-            Sherrif.scout()
-            df_master = Sherrif.currentDataFrame
-            for i in range(0,len(df_master)):
-                coin_name = df_master['currency'][i]['code']
-                if coin_name == ticker:
-                    row_id = i # this is the row where our data lives.
-                    current_holdings = float(df_master['quantity'][row_id])
-                    break
-
-            tick = r.orders.get_crypto_quote(ticker)
-            currentPrice = float(tick['mark_price'])# current price
-            currentSpread = abs(float(tick['bid_price']) - float(tick['ask_price']))
-            try:
-                boughtPrice = bought_prices[ticker] # initialize
-            except Exception: #
-                boughtPrice = currentPrice
-            #?current_holdings
-            Sell_Conditions_Met = False
-            val = boughtPrice - currentPrice
-            formatted_string = "{:.9f}".format(val)
-
+    # Serve the previous candle's suggestion while the new one is fetched in the background
+    tradingview_cache.stale_while_revalidate = True
 
-            tv = checker.trading_view_suggestion(ticker)
-
-            if boughtPrice + currentSpread < currentPrice or tv == -1:
-                Sell_Conditions_Met = True #
-            else: #
-                pass
-
-            #//guess_price = currentPrice - currentPrice*0.0001 # 1% less than current price
-            #//print("guessing price:  ", guess_price)
+    coin_names = ['BTC','ETH','DOGE','ETC','SHIB','MATIC','UNI',"XLM",'LTC','LINK']
+    limits = rate_limiters(config.get('rate_limits')) # replaces the random sleeps between calls
+    # The quotes of all the coins are fetched together, twice per cadence, instead of one call per coin
+    quotes = quote_feed(coin_names, lambda symbol: r.orders.get_crypto_quote(symbol), config.get('thief_cadence_seconds', 90) / 2).start()
 
-            if not bought and tv == 1: # trading view suggests buy
-                try:
-                    Sherrif.buy_robinhood_crypto_dollars(ticker,2.00)
-                    #//Sherrif.buy_robinhood_crypto_limit(ticker,guess_price)
-                    bought = True
-                    boughtPrice = currentPrice
-                    bought_prices[ticker] = boughtPrice
-                    time.sleep(random.randint(5,10))
-                except Exception:
-                    pass
-            elif bought and Sell_Conditions_Met:
-                Sherrif.sell_robinhood_crypto_coins(ticker)
-                bought_prices[ticker] = -1 # remove the price from the prices
-                time.sleep(random.randint(5,10))
-            elif not bought and Sell_Conditions_Met: #* sell balances not reflected by 'bought' variable
-                try: #
-                    Sherrif.sell_robinhood_crypto_coins(ticker)
-                except Exception:
-                    pass
-            else: #
-                print("Neither event received")
-            print(f'tv:{tv}, bought:{bought}')
-            bought_signals[ticker] = bought # save the signal
-            time.sleep(random.randint(0,2))
-
-        seconds = random.randint(60,120)
-        print("napping...",seconds,' seconds')
-        time.sleep(seconds)
\ No newline at end of file
+    def housekeeping():
+        # Once per cadence: positions are refreshed by the next coin, order events are flushed to disk
+        print("Running Over The Coins...")
+        Sherrif.is_positions_stale = True
+        Sherrif.settle_sells()
+        Sherrif.journal.sync()
+        print("TradingView cache: ", tradingview_cache.stats())
+        print("Quote feed: ", quotes.stats())
+        if config.get('positions_csv_minutes') and time.time() - Sherrif.last_dump >= config['positions_csv_minutes'] * 60:
+            Sherrif.dump_positions()
+
+    # Every coin is evaluated concurrently, once every thief_cadence_seconds (90 by default, like the old naps)
+    scheduler = coin_scheduler(
+        coin_names,
+        lambda ticker: steal(Sherrif, MaidMarian, ticker, limits, quotes),
+        config.get('thief_cadence_seconds', 90),
+        every_cadence=housekeeping,
+    )
+    asyncio.run(scheduler.run())
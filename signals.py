@@ -1,10 +1,15 @@
+from collections import namedtuple
 from config import config
 from math import isnan
-import pandas as pd
-import time, random
 import numpy as np
-from tradingview_ta import TA_Handler, Interval
-from sherwood import checker, simulate_pausing
+from indicators import indicator_columns
+from lazy import lazy_module
+from tradingview_cache import tradingview_cache
+from ledger import lot_ledger
+
+# Imported the first time they're used (see lazy.py)
+pd = lazy_module("pandas")
+tradingview_ta = lazy_module("tradingview_ta")
 
 
 class old_signals:
@@ -87,11 +92,11 @@ class old_signals:
             > data.iloc[-4][asset.ticker + "_SMA_S"]
             and
             # ... and they diverge
-            data.iloc[-1][ticker + "_SMA_S"] - data.iloc[-1][ticker + "_SMA_F"]
-            >= data.iloc[-2][ticker + "_SMA_S"] - data.iloc[-2][ticker + "_SMA_F"]
+            data.iloc[-1][asset.ticker + "_SMA_S"] - data.iloc[-1][asset.ticker + "_SMA_F"]
+            >= data.iloc[-2][asset.ticker + "_SMA_S"] - data.iloc[-2][asset.ticker + "_SMA_F"]
             and
             # RSI below threshold
-            data.iloc[-1][ticker + "_RSI"] <= config["rsi_threshold"]["sell"]
+            data.iloc[-1][asset.ticker + "_RSI"] <= config["rsi_threshold"]["sell"]
             and
             # Price is greater than purchase price by at least profit percentage
             data.iloc[-1][asset.ticker]
@@ -121,13 +126,13 @@ class signals:  #
         """
         assert type(ticker) == str
         pos_df = pd.DataFrame()  # hold the ta data for all of the tickers
-        output = TA_Handler(
+        # Cached until the current candle closes, so this only reaches TradingView once per interval
+        output_analysis = tradingview_cache.get_analysis(
             symbol=f"{ticker.upper()}USD",
-            screener="Crypto",
             exchange="COINBASE",
-            interval=Interval.INTERVAL_15_MINUTES,
+            screener="Crypto",
+            interval=tradingview_ta.Interval.INTERVAL_15_MINUTES,
         )
-        output_analysis = output.get_analysis()
         dict2 = (
             output_analysis.summary
         )  # get the summary dictionary. NOTE: Also available is the output_analysis.technical_indicators, for further analysis.
@@ -152,3 +157,177 @@ class signals:  #
             return 1  # signal a buy when price is above where we bought the coin
         else:  # signal a neutral when price is below where we bought the coin
             return 0
+
+
+# A strategy of batch_signals, and what it reads from the price_store: the indicators it needs (names from
+# indicators.indicator_columns) and how many of the last rows
+strategy = namedtuple("strategy", ["side", "name", "method", "indicators", "lookback"])
+
+strategies = {}  # (side, name) -> strategy, filled by register_strategy
+
+unfollowed_reported = set()  # tickers of held lots not in ticker_list, reported once by batch_signals.lot_columns
+
+
+def register_strategy(side, name, indicators=(), lookback=1):
+    # Decorator for the batch_signals methods selected by config['trade_strategies']
+    def register(method):
+        strategies[(side, name)] = strategy(side, name, method.__name__, tuple(indicators), lookback)
+        return method
+
+    return register
+
+
+def resolve_strategies(trade_strategies):
+    """
+    Look the configured strategies up once, at startup, so a typo in the config stops the bot right away instead
+    of in the middle of a tick.
+
+    Args:
+        trade_strategies (dict): config['trade_strategies'], e.g. {'buy': 'sma_rsi_threshold', 'sell': 'above_buy'}.
+
+    Returns:
+        dict: 'buy' and 'sell' -> strategy.
+    """
+    resolved = {}
+    for a_side in ("buy", "sell"):
+        name = str(trade_strategies[a_side])
+        if (a_side, name) not in strategies:
+            known = sorted(a_name for a_strategy_side, a_name in strategies if a_strategy_side == a_side)
+            raise ValueError("Unknown " + a_side + " strategy: " + name + " (available: " + ", ".join(known) + ")")
+        resolved[a_side] = strategies[(a_side, name)]
+
+    return resolved
+
+
+def required_indicators(resolved, charts=False):
+    """
+    Returns:
+        list: names of the indicators read by these strategies (and drawn on the charts, the two SMAs), in the
+        order of indicator_columns.
+    """
+    needed = {a_name for a_strategy in resolved.values() for a_name in a_strategy.indicators}
+    if charts:
+        needed.update(("sma_fast", "sma_slow"))
+    return [a_name for a_name in indicator_columns if a_name in needed]
+
+
+class batch_signals:
+    # Vectorized versions of the old_signals strategies: instead of one ticker (or one asset) per call and a
+    # handful of scalar data.iloc[-k] lookups each, every method evaluates the whole ticker universe (or every
+    # held lot) in one pass over NumPy arrays holding the last rows of the price_store, and returns a boolean
+    # mask. old_signals stays as the reference implementation these must agree with.
+    lookback = 4  # rows needed by the crossover strategies
+
+    def recent(self, store, tickers, suffix="", rows=lookback):
+        # rows x tickers matrix with the last values of each ticker's column, oldest first
+        return np.column_stack(
+            [store.window(a_ticker + suffix, rows) for a_ticker in tickers]
+        )
+
+    def lot_columns(self, tickers, lots):
+        # Position of each lot's ticker in the tickers list, the purchase price of each lot, and which lots can be
+        # evaluated: a lot whose ticker isn't in the list anymore (removed from ticker_list) is never sold here
+        if isinstance(lots, lot_ledger):
+            columns, prices = lots.columns(tickers), lots.view()["price"]
+        else:
+            column_of = {a_ticker: i for i, a_ticker in enumerate(tickers)}
+            columns = np.array([column_of.get(a_lot.ticker, -1) for a_lot in lots], dtype=np.intp)
+            prices = np.array([a_lot.price for a_lot in lots], dtype=float)
+
+        is_known = columns >= 0
+        if not is_known.all():
+            if isinstance(lots, lot_ledger):
+                missing = {lots.tickers[a_id] for a_id in lots.view()["ticker"][~is_known]}
+            else:
+                missing = {a_lot.ticker for a_lot, a_is_known in zip(lots, is_known) if not a_is_known}
+            # Reported once per ticker: this runs at every tick and every sell evaluation
+            missing -= unfollowed_reported
+            if len(missing) > 0:
+                unfollowed_reported.update(missing)
+                print("Not evaluating the lots of " + ", ".join(sorted(missing)) + ": not in ticker_list")
+
+        return np.where(is_known, columns, 0), prices, is_known
+
+    @register_strategy("buy", "sma_crossover_rsi", ("sma_fast", "sma_slow", "rsi"), lookback)
+    def buy_sma_crossover_rsi(self, tickers, store):
+        if store.rows < self.lookback or len(tickers) == 0:
+            return np.zeros(len(tickers), dtype=bool)
+
+        sma_f = self.recent(store, tickers, "_SMA_F")
+        sma_s = self.recent(store, tickers, "_SMA_S")
+        rsi = self.recent(store, tickers, "_RSI", 1)[-1]
+
+        return (
+            # Make sure the data is valid
+            ~np.isnan(sma_f).any(axis=0)
+            & ~np.isnan(sma_s).any(axis=0)
+            & ~np.isnan(rsi)
+            # Fast-SMA crossed Slow-SMA and stays above
+            & (sma_f[1:] >= sma_s[1:]).all(axis=0)
+            & (sma_f[0] < sma_s[0])
+            # ... and they diverge
+            & (sma_f[-1] - sma_s[-1] >= sma_f[-2] - sma_s[-2])
+            # RSI above threshold
+            & (rsi > config["rsi_threshold"]["buy"])
+        )
+
+    @register_strategy("buy", "sma_rsi_threshold", ("sma_fast", "rsi"))
+    def buy_sma_rsi_threshold(self, tickers, store):
+        if store.rows < 1 or len(tickers) == 0:
+            return np.zeros(len(tickers), dtype=bool)
+
+        price = self.recent(store, tickers, "", 1)[-1]
+        sma_f = self.recent(store, tickers, "_SMA_F", 1)[-1]
+        rsi = self.recent(store, tickers, "_RSI", 1)[-1]
+
+        return (
+            ~np.isnan(sma_f)
+            & ~np.isnan(rsi)
+            # Is the current price below the Fast-SMA by the percentage defined in the config file?
+            & (price <= sma_f - (sma_f * config["buy_below_moving_average"]))
+            # RSI below the threshold
+            & (rsi <= config["rsi_threshold"]["buy"])
+        )
+
+    @register_strategy("sell", "above_buy")
+    def sell_above_buy(self, tickers, lots, store):
+        if store.rows < 1 or len(lots) == 0:
+            return np.zeros(len(lots), dtype=bool)
+
+        columns, lot_prices, is_known = self.lot_columns(tickers, lots)
+        price = self.recent(store, tickers, "", 1)[-1]
+
+        # Simple percentage
+        return is_known & (price[columns] > lot_prices + (lot_prices * config["profit_percentage"]))
+
+    @register_strategy("sell", "sma_crossover_rsi", ("sma_fast", "sma_slow", "rsi"), lookback)
+    def sell_sma_crossover_rsi(self, tickers, lots, store):
+        if store.rows < self.lookback or len(lots) == 0:
+            return np.zeros(len(lots), dtype=bool)
+
+        columns, lot_prices, is_known = self.lot_columns(tickers, lots)
+        price = self.recent(store, tickers, "", 1)[-1]
+        sma_f = self.recent(store, tickers, "_SMA_F")
+        sma_s = self.recent(store, tickers, "_SMA_S")
+        rsi = self.recent(store, tickers, "_RSI", 1)[-1]
+
+        # The crossover part only depends on the ticker, so it's evaluated once per ticker
+        crossed = (
+            # Make sure the data is valid
+            ~np.isnan(sma_f).any(axis=0)
+            & ~np.isnan(sma_s).any(axis=0)
+            & ~np.isnan(rsi)
+            # Fast-SMA crossed Slow-SMA and stays below
+            & (sma_f[1:] <= sma_s[1:]).all(axis=0)
+            & (sma_f[0] > sma_s[0])
+            # ... and they diverge
+            & (sma_s[-1] - sma_f[-1] >= sma_s[-2] - sma_f[-2])
+            # RSI below threshold
+            & (rsi <= config["rsi_threshold"]["sell"])
+        )
+
+        return is_known & crossed[columns] & (
+            # Price is greater than purchase price by at least profit percentage
+            price[columns]
+            >= lot_prices + (lot_prices * config["profit_percentage"])
+        )
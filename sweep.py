@@ -0,0 +1,231 @@
+#!/usr/bin/python3 -u
+
+# Sherwood parameter sweep
+# Runs the backtest for every combination of a grid of config parameters, in parallel.
+
+import argparse
+import copy
+import itertools
+import os
+import time
+from multiprocessing import Pool, shared_memory
+import numpy as np
+import pandas as pd
+from config import config
+from backtest import backtest, load_prices
+
+# Parameters that can be swept, and where they live in config
+parameters = {
+    "sma_fast": ("moving_average_periods", "sma_fast"),
+    "sma_slow": ("moving_average_periods", "sma_slow"),
+    "rsi_period": ("rsi_period",),
+    "rsi_buy": ("rsi_threshold", "buy"),
+    "rsi_sell": ("rsi_threshold", "sell"),
+    "buy_below_moving_average": ("buy_below_moving_average",),
+    "profit_percentage": ("profit_percentage",),
+    "stop_loss_threshold": ("stop_loss_threshold",),
+    "buy_amount_per_trade": ("buy_amount_per_trade",),
+}
+
+# Indicator columns depend on these only; combinations sharing them are sent to the same worker
+indicator_parameters = ("sma_fast", "sma_slow", "rsi_period")
+
+# State of each worker process, set once by attach() instead of being pickled with every task
+worker = {}
+
+
+def settings_for(combination, base=config):
+    settings = copy.deepcopy(base)
+    for a_name, a_value in combination.items():
+        *path, key = parameters[a_name]
+        target = settings
+        for a_key in path:
+            target = target[a_key]
+        target[key] = a_value
+
+    return settings
+
+
+def indicator_key(combination):
+    return tuple(combination.get(a_name) for a_name in indicator_parameters)
+
+
+def attach(name, shape, tickers, starting_cash, cache_size):
+    # Map the price matrix placed in shared memory by the parent (no copy, nothing is pickled)
+    try:
+        memory = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13: the worker registers the block again with the resource tracker
+        # The workers of a Pool (fork, spawn or forkserver) all talk to the parent's tracker, where the block is
+        # already registered once: it's unlinked (and unregistered) by the parent only, so there's nothing to undo
+        # here (unregistering would drop the parent's entry, and its unlink() would print a KeyError)
+        memory = shared_memory.SharedMemory(name=name)
+
+    matrix = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+    worker["memory"] = memory
+    worker["timestamps"] = matrix[0].astype(np.int64)
+    worker["prices"] = {a_ticker: matrix[i + 1] for i, a_ticker in enumerate(tickers)}
+    worker["starting_cash"] = starting_cash
+    worker["cache"] = {}  # indicator columns computed by this worker, shared between combinations
+    worker["cache_size"] = cache_size * len(tickers)  # a combination needs a few columns per ticker
+
+
+def evaluate(combinations):
+    results = []
+    cache = worker["cache"]
+    last_key = None
+    for a_combination in combinations:
+        # Keep the memory of each worker bounded, forgetting the oldest columns first, but only between two groups
+        # of indicator periods (see tasks_for): every combination of a group reuses the same columns
+        if indicator_key(a_combination) != last_key:
+            while len(cache) > worker["cache_size"]:
+                cache.pop(next(iter(cache)))
+            last_key = indicator_key(a_combination)
+
+        start = time.perf_counter()
+        try:
+            result = backtest(
+                worker["timestamps"],
+                worker["prices"],
+                settings_for(a_combination),
+                starting_cash=worker["starting_cash"],
+                cache=cache,
+            ).run()
+        except Exception as e:
+            print("An exception occurred evaluating " + str(a_combination) + ": " + str(e))
+            continue
+
+        trades = result["trades"]
+        results.append(
+            dict(
+                a_combination,
+                pnl=result["pnl"],
+                realized_pnl=result["realized_pnl"],
+                unrealized_pnl=result["unrealized_pnl"],
+                max_drawdown=result["max_drawdown"],
+                trades=len(trades),
+                stop_losses=int((trades["reason"] == "stop_loss").sum()),
+                open_lots=result["open_lots"],
+                seconds=time.perf_counter() - start,
+            )
+        )
+
+    return results
+
+
+def combinations_for(grid):
+    names = list(grid)
+    for a_values in itertools.product(*[grid[a_name] for a_name in names]):
+        a_combination = dict(zip(names, a_values))
+        fast = a_combination.get("sma_fast", config["moving_average_periods"]["sma_fast"])
+        slow = a_combination.get("sma_slow", config["moving_average_periods"]["sma_slow"])
+        if fast < slow:
+            yield a_combination
+
+
+def tasks_for(combinations, chunk_size):
+    # Group the combinations by the indicator periods they use, so each worker computes every SMA/RSI column
+    # once and reuses it for all the thresholds, then split the groups into chunks to keep the load balanced
+    groups = {}
+    for a_combination in combinations:
+        groups.setdefault(indicator_key(a_combination), []).append(a_combination)
+
+    for a_group in groups.values():
+        for i in range(0, len(a_group), chunk_size):
+            yield a_group[i : i + chunk_size]
+
+
+def sweep(timestamps, prices, grid, processes=None, starting_cash=1000.0, chunk_size=64, cache_size=32):
+    """
+    Backtest every combination of the grid over a process pool.
+
+    The price history is copied once into a shared memory block that every worker maps, instead of being
+    pickled to each process or task, and each worker memoizes the indicator columns it computes.
+
+    Args:
+        timestamps (array): int64 epoch seconds, one per bar.
+        prices (dict): ticker -> float array of prices.
+        grid (dict): parameter name (see parameters) -> list of values to try.
+        processes (int, optional): worker processes. Defaults to the number of cores.
+        starting_cash (float, optional): buying power at the first bar. Defaults to 1000.
+        chunk_size (int, optional): combinations per task. Defaults to 64.
+        cache_size (int, optional): indicator columns each worker keeps per ticker, trimmed between two groups of
+            indicator periods. Defaults to 32.
+
+    Returns:
+        DataFrame: one row per combination, best PnL first.
+    """
+    for a_name in grid:
+        if a_name not in parameters:
+            raise ValueError("Unknown parameter: " + a_name + " (expected one of " + ", ".join(parameters) + ")")
+
+    tickers = list(prices)
+    shape = (len(tickers) + 1, len(timestamps))
+    memory = shared_memory.SharedMemory(create=True, size=max(1, shape[0] * shape[1] * 8))
+    try:
+        matrix = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+        matrix[0] = timestamps
+        for i, a_ticker in enumerate(tickers):
+            matrix[i + 1] = prices[a_ticker]
+        del matrix
+
+        results = []
+        with Pool(
+            processes or os.cpu_count(),
+            initializer=attach,
+            initargs=(memory.name, shape, tickers, starting_cash, cache_size),
+        ) as pool:
+            for a_result in pool.imap_unordered(evaluate, tasks_for(combinations_for(grid), chunk_size)):
+                results.extend(a_result)
+    finally:
+        memory.close()
+        memory.unlink()
+
+    results = pd.DataFrame(results)
+    if len(results) > 0:
+        results = results.sort_values(["pnl", "max_drawdown"], ascending=[False, True]).reset_index(drop=True)
+        results.index += 1  # rank
+
+    return results
+
+
+def parse_values(text):
+    values = []
+    for a_value in text.split(","):
+        if ":" in a_value:  # start:stop:step, stop included
+            start, stop, step = [float(a_part) for a_part in a_value.split(":")]
+            values.extend(np.round(np.arange(start, stop + step / 2, step), 10).tolist())
+        else:
+            values.append(float(a_value))
+
+    return [int(a_value) if float(a_value).is_integer() else a_value for a_value in values]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest a grid of strategy parameters on a price history.")
+    parser.add_argument("filename", help="CSV or Parquet file with the prices")
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="NAME=VALUES",
+        help="values to try for a parameter, e.g. sma_fast=12,24,48 or profit_percentage=0.005:0.03:0.005",
+    )
+    parser.add_argument("--ticker", help="ticker for an OHLC file (default: first ticker in config)")
+    parser.add_argument("--cash", type=float, default=1000.0, help="starting cash (default: 1000)")
+    parser.add_argument("--processes", type=int, help="worker processes (default: number of cores)")
+    parser.add_argument("--output", default="sweep_results.csv", help="ranked results (default: sweep_results.csv)")
+    arguments = parser.parse_args()
+
+    grid = {}
+    for a_param in arguments.param:
+        a_name, a_values = a_param.split("=", 1)
+        grid[a_name.strip()] = parse_values(a_values)
+
+    timestamps, prices = load_prices(arguments.filename, arguments.ticker)
+    start = time.perf_counter()
+    results = sweep(timestamps, prices, grid, arguments.processes, arguments.cash)
+    elapsed = time.perf_counter() - start
+
+    print(str(len(results)) + " configurations evaluated in " + str(round(elapsed, 1)) + "s")
+    print(results.head(20).to_string())
+    results.to_csv(arguments.output, index_label="rank")
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+import threading
+import time
+from lazy import lazy_module
+
+tradingview_ta = lazy_module("tradingview_ta")  # imported by the first lookup
+
+# Length of each TradingView interval in seconds (months are handled separately)
+interval_seconds = {
+    "1m": 60,
+    "5m": 5 * 60,
+    "15m": 15 * 60,
+    "30m": 30 * 60,
+    "1h": 60 * 60,
+    "2h": 2 * 60 * 60,
+    "4h": 4 * 60 * 60,
+    "1d": 24 * 60 * 60,
+    "1W": 7 * 24 * 60 * 60,
+}
+week_offset = 3 * 24 * 60 * 60  # the epoch was a Thursday: shift by 3 days so weekly candles open on Monday 00:00 UTC
+
+
+def next_candle(interval, now):
+    """
+    Epoch seconds at which the candle currently forming for this interval closes (candles are aligned to UTC).
+
+    Args:
+        interval (str): a tradingview_ta Interval value, e.g. '15m'.
+        now (float): current time in epoch seconds.
+    """
+    if interval == "1M":
+        today = datetime.fromtimestamp(now, tz=timezone.utc)
+        if today.month == 12:
+            return datetime(today.year + 1, 1, 1, tzinfo=timezone.utc).timestamp()
+        return datetime(today.year, today.month + 1, 1, tzinfo=timezone.utc).timestamp()
+
+    length = interval_seconds[interval]
+    offset = week_offset if interval == "1W" else 0
+    return ((now + offset) // length + 1) * length - offset
+
+
+class analysis_cache:
+    """
+    Shared cache for TradingView analyses, keyed by (symbol, exchange, screener, interval). A summary or set of
+    indicators can't change before the current candle closes, so each entry expires at the next candle boundary
+    for its interval. The cache holds at most max_entries analyses and evicts the least recently used one.
+
+    With stale_while_revalidate enabled, an expired entry is returned right away and refreshed by a background
+    thread, so callers never wait on TradingView once a symbol has been fetched.
+
+    Args:
+        max_entries (int, optional): maximum number of cached analyses. Defaults to 256.
+        stale_while_revalidate (bool, optional): serve expired entries while they are refreshed. Defaults to False.
+    """
+
+    def __init__(self, max_entries=256, stale_while_revalidate=False):
+        self.max_entries = max_entries
+        self.stale_while_revalidate = stale_while_revalidate
+        self.entries = OrderedDict()  # key -> (expires at, analysis)
+        self.refreshing = set()  # keys being refreshed in the background
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def key(self, symbol, exchange, screener, interval):
+        return (symbol.upper(), exchange.upper(), screener.lower(), interval)
+
+    def is_cached(self, symbol, exchange, screener, interval):
+        # Would get_analysis answer without waiting for TradingView?
+        with self.lock:
+            entry = self.entries.get(self.key(symbol, exchange, screener, interval))
+            return entry is not None and (time.time() < entry[0] or self.stale_while_revalidate)
+
+    def get_analysis(self, symbol, exchange, screener, interval):
+        key = self.key(symbol, exchange, screener, interval)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+                if time.time() < entry[0]:
+                    self.hits += 1
+                    return entry[1]
+
+                if self.stale_while_revalidate:
+                    self.stale_hits += 1
+                    if key not in self.refreshing:
+                        self.refreshing.add(key)
+                        threading.Thread(
+                            target=self.refresh, args=(key,), daemon=True
+                        ).start()
+                    return entry[1]
+
+            self.misses += 1
+
+        return self.fetch(key)
+
+    def fetch(self, key):
+        symbol, exchange, screener, interval = key
+        analysis = tradingview_ta.TA_Handler(
+            symbol=symbol,
+            exchange=exchange,
+            screener=screener,
+            interval=interval,
+            timeout=None,
+        ).get_analysis()
+
+        with self.lock:
+            self.entries[key] = (next_candle(interval, time.time()), analysis)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return analysis
+
+    def refresh(self, key):
+        try:
+            self.fetch(key)
+        except Exception:
+            print("An exception occurred refreshing TradingView data for " + str(key))
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+            }
+
+
+tradingview_cache = analysis_cache()  # shared by checker and signals
@@ -6,7 +6,7 @@ exchanges_dict = {
     'SHIBUSD':'GEMINI',
     'MATICUSD':'GEMINI',
     'UNIUSD':'BITFINEX', #todo -- this is a guess
-    'XMLUSD':'KRAKEN',
+    'XLMUSD':'KRAKEN',
     'LTCUSD':'EXMO',
     'LINKUSD':'COINBASE'
 }
\ No newline at end of file